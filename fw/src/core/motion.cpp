@@ -0,0 +1,173 @@
+/*******************************************************************************
+*                               Standard Libraries
+*******************************************************************************/
+
+#include <Arduino.h>
+#include "motion.h"
+
+/*******************************************************************************
+*                               Variables
+*******************************************************************************/
+
+static motion_axis_t axis_arr[AXIS_COUNT];
+
+static HardwareTimer* tick_timer;
+
+/*******************************************************************************
+*                               Static Functions
+*******************************************************************************/
+
+static uint32_t motion_toFixed(float perTick)
+{
+    return (uint32_t) (perTick * MOTION_FIXED_ONE);
+}
+
+// position of mark i, rounded so the spacing stays even when span isn't a multiple of count
+static uint32_t motion_markPosition(motion_axis_t* axis, uint8_t i)
+{
+    return axis->markFirst + (uint32_t) ((uint64_t) axis->markSpan * i / axis->markCount);
+}
+
+// Trapezoidal profile: speed up by accel every tick until cruise, and slow down
+// by accel once the units left are no more than the braking distance v^2 / 2a
+static void motion_advanceAxis(motion_axis_t* axis)
+{
+    uint64_t braking = (uint64_t) axis->velocity * axis->velocity;
+    uint64_t left = ((uint64_t) axis->remaining * 2 * axis->accel) << MOTION_FIXED_SHIFT;
+
+    if (braking >= left)
+    {
+        // never all the way to 0, the last unit still has to be reached
+        axis->velocity = axis->velocity > 2 * axis->accel ? axis->velocity - axis->accel : axis->accel;
+    }
+    else if (axis->velocity < axis->cruise)
+    {
+        axis->velocity = min(axis->velocity + axis->accel, axis->cruise);
+    }
+
+    axis->phase += axis->velocity;
+    while (axis->phase >= MOTION_FIXED_ONE && axis->remaining > 0)
+    {
+        axis->phase -= MOTION_FIXED_ONE;
+        axis->advance(axis->dir);
+        axis->remaining--;
+        axis->moved++;
+        if (axis->marksDone < axis->markCount && axis->moved == axis->nextMark)
+        {
+            axis->mark(axis->moved);
+            axis->marksDone++;
+            axis->nextMark = motion_markPosition(axis, axis->marksDone);
+        }
+    }
+
+    if (axis->remaining == 0)
+    {
+        axis->velocity = 0;
+        axis->phase = 0;
+        // marks only ever apply to the move they were set for
+        axis->markCount = 0;
+        axis->busy = false;
+        axis->done = true;
+    }
+}
+
+static void motion_tick(void)
+{
+    for (int i = 0; i < AXIS_COUNT; i++)
+    {
+        if (axis_arr[i].busy)
+        {
+            motion_advanceAxis(&axis_arr[i]);
+        }
+    }
+}
+
+/*******************************************************************************
+*                               Functions
+*******************************************************************************/
+
+void motion_init(void)
+{
+    tick_timer = new HardwareTimer(MOTION_TIMER);
+    tick_timer->setOverflow(MOTION_TICK_HZ, HERTZ_FORMAT);
+    tick_timer->attachInterrupt(motion_tick);
+    tick_timer->resume();
+}
+
+void motion_attach(motion_axis_id_t axis, motion_advance_t advance)
+{
+    axis_arr[axis].advance = advance;
+}
+
+// starts moving axis by units in dir and returns straight away, the interrupt
+// does the rest and raises the axis' motion-complete event when it is done
+void motion_start(motion_axis_id_t axis, uint32_t units, int8_t dir, float cruisePerS, float accelPerS2)
+{
+    motion_axis_t* a = &axis_arr[axis];
+
+    noInterrupts();
+    a->dir = dir;
+    a->remaining = units;
+    a->velocity = 0;
+    a->phase = 0;
+    a->moved = 0;
+    a->cruise = motion_toFixed(cruisePerS / MOTION_TICK_HZ);
+    a->accel = max(motion_toFixed(accelPerS2 / MOTION_TICK_HZ / MOTION_TICK_HZ), (uint32_t) 1);
+    a->done = units == 0;
+    a->busy = units > 0;
+    interrupts();
+}
+
+// the next move of axis calls mark count times, at first units and then every
+// span / count units, from the interrupt so it is exactly on the unit. Set it
+// before motion_start.
+void motion_setMarks(motion_axis_id_t axis, uint32_t first, uint32_t span, uint8_t count, motion_mark_t mark)
+{
+    motion_axis_t* a = &axis_arr[axis];
+
+    noInterrupts();
+    a->mark = mark;
+    a->markFirst = first;
+    a->markSpan = span;
+    a->markCount = count;
+    a->marksDone = 0;
+    a->nextMark = first;
+    interrupts();
+}
+
+bool motion_busy(motion_axis_id_t axis)
+{
+    return axis_arr[axis].busy;
+}
+
+bool motion_idle(void)
+{
+    for (int i = 0; i < AXIS_COUNT; i++)
+    {
+        if (axis_arr[i].busy)
+        {
+            return false;
+        }
+    }
+    return true;
+}
+
+// returns true once for every completed move of axis
+bool motion_pollDone(motion_axis_id_t axis)
+{
+    noInterrupts();
+    bool done = axis_arr[axis].done;
+    axis_arr[axis].done = false;
+    interrupts();
+    return done;
+}
+
+// blocks until axis has stopped, for the CLI
+void motion_wait(motion_axis_id_t axis)
+{
+    while (axis_arr[axis].busy)
+    {
+        yield();
+    }
+    motion_pollDone(axis);
+}
@@ -0,0 +1,85 @@
+#ifndef MOTION
+#define MOTION
+
+/*******************************************************************************
+*                               Standard Includes
+*******************************************************************************/
+
+#include <Arduino.h>
+
+/*******************************************************************************
+*                               Constants
+*******************************************************************************/
+
+// Every axis is advanced from one timer interrupt running at this rate
+#define MOTION_TICK_HZ       10000
+// TIM2 drives the lights (PA0, PA1) and TIM3 the servo (PB1)
+#define MOTION_TIMER         TIM4
+// Velocities are kept in units per tick and accelerations in units per tick^2,
+// both as fixed point with this many fractional bits (no FPU on the F103)
+#define MOTION_FIXED_SHIFT   24
+#define MOTION_FIXED_ONE     ((uint32_t) 1 << MOTION_FIXED_SHIFT)
+
+/*******************************************************************************
+*                               Structures
+*******************************************************************************/
+
+typedef enum {
+    AXIS_ARM,
+    AXIS_PLANE,
+    AXIS_COUNT
+} motion_axis_id_t;
+
+// moves the axis by one unit (a degree, a step) in dir (+1 or -1), called from the interrupt
+typedef void (*motion_advance_t)(int8_t dir);
+
+// called from the interrupt when the axis reaches a mark, with the units moved so far
+typedef void (*motion_mark_t)(uint32_t position);
+
+typedef struct {
+    motion_advance_t advance;
+    // set by motion_start, cleared by the interrupt once the last unit is done
+    volatile bool busy;
+    // motion-complete event, cleared by motion_pollDone
+    volatile bool done;
+    int8_t dir;
+    // units left to move
+    volatile uint32_t remaining;
+    // trapezoidal profile, all fixed point
+    uint32_t velocity;
+    uint32_t cruise;
+    uint32_t accel;
+    // progress towards the next unit
+    uint32_t phase;
+    // units moved since motion_start
+    volatile uint32_t moved;
+    // marks set with motion_setMarks, spread evenly over markSpan units from markFirst
+    motion_mark_t mark;
+    uint32_t markFirst;
+    uint32_t markSpan;
+    uint8_t markCount;
+    uint8_t marksDone;
+    uint32_t nextMark;
+} motion_axis_t;
+
+/*******************************************************************************
+*                               Functions
+*******************************************************************************/
+
+void motion_init(void);
+
+void motion_attach(motion_axis_id_t axis, motion_advance_t advance);
+
+void motion_start(motion_axis_id_t axis, uint32_t units, int8_t dir, float cruisePerS, float accelPerS2);
+
+void motion_setMarks(motion_axis_id_t axis, uint32_t first, uint32_t span, uint8_t count, motion_mark_t mark);
+
+bool motion_busy(motion_axis_id_t axis);
+
+bool motion_idle(void);
+
+bool motion_pollDone(motion_axis_id_t axis);
+
+void motion_wait(motion_axis_id_t axis);
+
+#endif
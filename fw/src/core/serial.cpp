@@ -80,6 +80,7 @@ void serial_init(serial_id_t serialId)
     // Serial1.begin(BAUD_RATE);
 
     serial_arr[serialId].connection->begin(BAUD_RATE);
+    serial_arr[serialId].frame.rxSeq = -1;
 
     // serial_arr[serialId].connection.println("here");
     // Serial2.begin(BAUD_RATE);
@@ -114,7 +115,11 @@ bool serial_handleByte(serial_id_t serialId, char byte)
     }
     else
     {
-        s->message.line[s->message.index++] = byte;
+        // leave room for the terminator, anything past that is dropped
+        if (s->message.index < (COMMAND_BUFF_MAX_LEN - 1))
+        {
+            s->message.line[s->message.index++] = byte;
+        }
         // we have not yet reached the end of the message
         return false;
     }
@@ -138,7 +143,7 @@ void serial_parseCmd(char* message)
     // Tokenize the line with spaces as the delimiter
     char* tok = (char*) strtok(message, " ");
     uint8_t i = 0;
-    while (tok != NULL && i < COMMAND_BUFF_MAX_LEN)
+    while (tok != NULL && i < (COMMAND_ARGS_MAX_LEN + 1))
     {
         tokCommand[i] = tok;
         tok = strtok(NULL, " ");
@@ -212,4 +217,166 @@ void serial_parseCmd(char* message)
 char* serial_getMessage(serial_id_t serialId)
 {
     return serial_arr[serialId].message.line;
-}
\ No newline at end of file
+}
+
+static uint16_t frame_crc16(const uint8_t* data, uint8_t len)
+{
+    // CRC-16/CCITT-FALSE, same as binascii.crc_hqx(data, 0xFFFF) on the host
+    uint16_t crc = 0xFFFF;
+    for (uint8_t i = 0; i < len; i++)
+    {
+        crc ^= ((uint16_t) data[i]) << 8;
+        for (uint8_t bit = 0; bit < 8; bit++)
+        {
+            crc = (crc & 0x8000) ? ((crc << 1) ^ 0x1021) : (crc << 1);
+        }
+    }
+    return crc;
+}
+
+static uint8_t frame_encode(uint8_t* out, msg_type_t type, uint8_t seq, const uint8_t* payload, uint8_t len)
+{
+    out[0] = FRAME_START;
+    out[1] = len;
+    out[2] = type;
+    out[3] = seq;
+    if (len > 0)
+    {
+        memcpy(&out[FRAME_HEADER_LEN], payload, len);
+    }
+    uint16_t crc = frame_crc16(&out[1], (FRAME_HEADER_LEN - 1 + len));
+    out[FRAME_HEADER_LEN + len] = crc >> 8;
+    out[FRAME_HEADER_LEN + len + 1] = crc & 0xFF;
+    return FRAME_HEADER_LEN + len + FRAME_CRC_LEN;
+}
+
+static void frame_sendControl(serial_conn_t* s, msg_type_t type, uint8_t seq)
+{
+    uint8_t out[FRAME_HEADER_LEN + FRAME_CRC_LEN];
+    s->connection->write(out, frame_encode(out, type, seq, NULL, 0));
+}
+
+static msg_type_t frame_handleByte(serial_conn_t* s, uint8_t byte)
+{
+    frame_link_t* f = &s->frame;
+
+    // skip anything between frames
+    if (f->index == 0 && byte != FRAME_START)
+    {
+        return MSG_NONE;
+    }
+    f->buff[f->index++] = byte;
+
+    // a length that can't be right means the frame is corrupt, drop it
+    if (f->index == 2 && f->buff[1] > FRAME_MAX_PAYLOAD)
+    {
+        f->index = 0;
+        frame_sendControl(s, MSG_NAK, 0);
+        return MSG_NONE;
+    }
+    if (f->index < FRAME_HEADER_LEN ||
+        f->index < (FRAME_HEADER_LEN + f->buff[1] + FRAME_CRC_LEN))
+    {
+        // we have not yet reached the end of the frame
+        return MSG_NONE;
+    }
+
+    uint8_t len = f->index;
+    f->index = 0;
+    uint16_t crc = (f->buff[len - 2] << 8) | f->buff[len - 1];
+    if (frame_crc16(&f->buff[1], (len - 1 - FRAME_CRC_LEN)) != crc)
+    {
+        // ask for the frame again
+        frame_sendControl(s, MSG_NAK, 0);
+        return MSG_NONE;
+    }
+
+    msg_type_t type = (msg_type_t) f->buff[2];
+    uint8_t seq = f->buff[3];
+    if (type == MSG_ACK)
+    {
+        if (f->pendingLen > 0 && f->pending[3] == seq)
+        {
+            f->pendingLen = 0;
+        }
+        return MSG_NONE;
+    }
+    if (type == MSG_NAK)
+    {
+        f->nak = f->pendingLen > 0;
+        return MSG_NONE;
+    }
+
+    frame_sendControl(s, MSG_ACK, seq);
+    if (seq == f->rxSeq)
+    {
+        // resent because our ack got lost, it was already delivered
+        return MSG_NONE;
+    }
+    f->rxSeq = seq;
+    return type;
+}
+
+void serial_sendFrame(serial_id_t serialId, msg_type_t type)
+{
+    serial_sendFramePayload(serialId, type, NULL, 0);
+}
+
+void serial_sendFramePayload(serial_id_t serialId, msg_type_t type, const uint8_t* payload, uint8_t len)
+{
+    serial_conn_t* s = &serial_arr[serialId];
+    frame_link_t* f = &s->frame;
+
+    if (len > FRAME_MAX_PAYLOAD)
+    {
+        serial_send(COMPUTER, "frame payload too long");
+        return;
+    }
+    // only one frame is in flight, serial_pollFrame resends it until it is acked
+    f->pendingLen = frame_encode(f->pending, type, f->txSeq++, payload, len);
+    f->attempts = 1;
+    f->nak = false;
+    f->sentAt = millis();
+    s->connection->write(f->pending, f->pendingLen);
+}
+
+msg_type_t serial_pollFrame(serial_id_t serialId)
+{
+    serial_conn_t* s = &serial_arr[serialId];
+    frame_link_t* f = &s->frame;
+
+    // resend the last frame if it was rejected or its ack is overdue
+    if (f->pendingLen > 0 && (f->nak || (millis() - f->sentAt) >= FRAME_RETRANSMIT_MS))
+    {
+        if (f->attempts >= FRAME_MAX_ATTEMPTS)
+        {
+            serial_send(COMPUTER, "frame was never acknowledged");
+            f->pendingLen = 0;
+        }
+        else
+        {
+            f->attempts++;
+            f->nak = false;
+            f->sentAt = millis();
+            s->connection->write(f->pending, f->pendingLen);
+        }
+    }
+
+    // returns the first new message, the rest stay in the UART buffer
+    while (serial_available(serialId))
+    {
+        msg_type_t type = frame_handleByte(s, serial_read(serialId));
+        if (type != MSG_NONE)
+        {
+            return type;
+        }
+    }
+    return MSG_NONE;
+}
+
+// true while the last frame sent is waiting to be acknowledged, sending another
+// one now would replace it
+bool serial_framePending(serial_id_t serialId)
+{
+    return serial_arr[serialId].frame.pendingLen > 0;
+}
@@ -25,6 +25,18 @@
 #define COMMAND_ARGS_MAX_LEN 4
 #define COMMAND_PROMPT       "station> "
 
+// Framed protocol on the RPI link, must match sw/serial_protocol.py:
+// FRAME_START | length | type | sequence | payload | CRC-16/CCITT-FALSE (big endian)
+// The CRC covers length, type, sequence and payload.
+#define FRAME_START          0xA5
+#define FRAME_HEADER_LEN     4
+#define FRAME_CRC_LEN        2
+#define FRAME_MAX_PAYLOAD    16
+#define FRAME_MAX_LEN        (FRAME_HEADER_LEN + FRAME_MAX_PAYLOAD + FRAME_CRC_LEN)
+// resend an unacknowledged frame after this long, give up after this many attempts
+#define FRAME_RETRANSMIT_MS  250
+#define FRAME_MAX_ATTEMPTS   40
+
 /*******************************************************************************
 *                               Structures
 *******************************************************************************/
@@ -36,8 +48,37 @@ typedef struct {
     uint8_t index;
 } message_t;
 
+typedef enum {
+    MSG_NONE             = 0x00,
+    MSG_START            = 0x01,
+    MSG_PICTURE          = 0x02,
+    MSG_FINISHED         = 0x03,
+    MSG_FINISHED_IMAGING = 0x04,
+    // hardware trigger mode, the payload is the index of the pose the camera was triggered at
+    MSG_TRIGGERED        = 0x05,
+    MSG_ACK              = 0x06,
+    MSG_NAK              = 0x15
+} msg_type_t;
+
+typedef struct {
+    // frame being received
+    uint8_t buff[FRAME_MAX_LEN];
+    uint8_t index;
+    // sequence number of the last frame delivered, -1 before the first one
+    int16_t rxSeq;
+    // sequence number of the next frame sent
+    uint8_t txSeq;
+    // last frame sent, kept until it is acknowledged (pendingLen 0 when it is)
+    uint8_t pending[FRAME_MAX_LEN];
+    uint8_t pendingLen;
+    uint8_t attempts;
+    uint32_t sentAt;
+    bool nak;
+} frame_link_t;
+
 typedef struct {
     message_t message;
+    frame_link_t frame;
     HardwareSerial* connection;
 } serial_conn_t;
 
@@ -70,4 +111,12 @@ void serial_parseCmd(char* message);
 
 char* serial_getMessage(serial_id_t serialId);
 
+void serial_sendFrame(serial_id_t serialId, msg_type_t type);
+
+void serial_sendFramePayload(serial_id_t serialId, msg_type_t type, const uint8_t* payload, uint8_t len);
+
+msg_type_t serial_pollFrame(serial_id_t serialId);
+
+bool serial_framePending(serial_id_t serialId);
+
 #endif
\ No newline at end of file
@@ -1,12 +1,13 @@
 
 #include "servo.h"
-#include "serial.h"
 #include <stdio.h>
 
 static servo_periph_t servo_arr[] = 
 {
     {
-        .servo = Servo(),
+        .timer = NULL,
+        .channel = 0,
+        .axis = AXIS_ARM,
         .angle = 15
     }
 };
@@ -17,10 +18,29 @@ float _angle_to_duty(uint8_t angle)
     return 1310.0 + angle / 180.0 * 6553;
 }
 
+static void _servo_write(servo_id_t servoId)
+{
+    // only a compare register write, safe from the motion interrupt
+    servo_arr[servoId].timer->setCaptureCompare(servo_arr[servoId].channel, _angle_to_duty(servo_arr[servoId].angle),
+                                               TimerCompareFormat_t::RESOLUTION_16B_COMPARE_FORMAT);
+}
+
+static void _arm_advance(int8_t dir)
+{
+    servo_arr[ARM].angle += dir;
+    _servo_write(ARM);
+}
+
 void servo_init(servo_id_t servoId, uint8_t pin)
 {
-    pinMode(PB1, OUTPUT);
-    pwm_start(PB_1, 50, _angle_to_duty(15), TimerCompareFormat_t::RESOLUTION_16B_COMPARE_FORMAT);
+    // the timer behind the pin is driven directly, so the motion interrupt can update the duty cycle
+    PinName pinName = digitalPinToPinName(pin);
+    TIM_TypeDef* instance = (TIM_TypeDef*) pinmap_peripheral(pinName, PinMap_PWM);
+    servo_arr[servoId].channel = STM_PIN_CHANNEL(pinmap_function(pinName, PinMap_PWM));
+    servo_arr[servoId].timer = new HardwareTimer(instance);
+    servo_arr[servoId].timer->setPWM(servo_arr[servoId].channel, pin, 50, 0);
+    _servo_write(servoId);
+    motion_attach(servo_arr[servoId].axis, _arm_advance);
 }
 
 // void servo_init(servo_id_t servoId, uint8_t pin)
@@ -29,31 +49,18 @@ void servo_init(servo_id_t servoId, uint8_t pin)
 //     servo_arr[servoId].servo.write(servo_arr[servoId].angle);
 // }
 
+// starts the move and returns, motion_busy/motion_idle tell when it is done
+void servo_moveTo(servo_id_t servoId, uint8_t angle)
+{
+    uint8_t current = servo_arr[servoId].angle;
+    int8_t dir = angle > current ? 1 : -1;
+    motion_start(servo_arr[servoId].axis, abs((int16_t) angle - current), dir, SERVO_SPEED_DPS, SERVO_ACCEL_DPS2);
+}
+
 void servo_rotateTo(servo_id_t servoId, uint8_t angle)
 {
-    if (servo_arr[servoId].angle > angle)
-    {
-        for (int i=servo_arr[servoId].angle; i > angle; i-=2)
-        {
-            pwm_start(PB_1, 50, _angle_to_duty(i), TimerCompareFormat_t::RESOLUTION_16B_COMPARE_FORMAT);
-            // servo_arr[servoId].servo.write(i);
-            delay(30);
-            // delay(100); // 50
-        }
-    }
-    else
-    {
-        for (int i=servo_arr[servoId].angle; i < angle; i+=2)
-        {
-            // serial_send(COMPUTER, "here");
-            Serial.println(_angle_to_duty(i));
-            pwm_start(PB_1, 50, _angle_to_duty(i), TimerCompareFormat_t::RESOLUTION_16B_COMPARE_FORMAT); // PERCENT_COMPARE_FORMAT
-            delay(30);
-            // servo_arr[servoId].servo.write(i);
-            // delay(100); // 50
-        }
-    }
-    servo_arr[servoId].angle = angle;
+    servo_moveTo(servoId, angle);
+    motion_wait(servo_arr[servoId].axis);
 }
 
 uint8_t servo_getAngle(servo_id_t servoId)
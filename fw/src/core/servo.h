@@ -1,10 +1,15 @@
-
 #include <Arduino.h>
-#include <Servo.h>
+#include "motion.h"
+
+// Old ramp was 2 degrees per delay(30), the same top speed with a ramp up and down
+#define SERVO_SPEED_DPS  66.7
+#define SERVO_ACCEL_DPS2 1000.0
 
 typedef struct {
-    Servo servo;
-    uint8_t angle;
+    HardwareTimer* timer;
+    uint32_t channel;
+    motion_axis_id_t axis;
+    volatile uint8_t angle;
 } servo_periph_t;
 
 typedef enum{
@@ -15,4 +20,6 @@ void servo_init(servo_id_t servoId, uint8_t pin);
 
 uint8_t servo_getAngle(servo_id_t servoId);
 
-void servo_rotateTo(servo_id_t servoId, uint8_t angle);
\ No newline at end of file
+void servo_moveTo(servo_id_t servoId, uint8_t angle);
+
+void servo_rotateTo(servo_id_t servoId, uint8_t angle);
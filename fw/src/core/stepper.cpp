@@ -1,4 +1,3 @@
-
 #include "stepper.h"
 
 #define STEPS 400
@@ -8,18 +7,102 @@ static stepper_t stepper_arr[] =
 {
     {
         .angle = 0,
-        .stepper = Stepper(STEPS, PA5 /*dir*/, PA6 /*step*/)
+        .pin1 = PA5 /*dir*/,
+        .pin2 = PA6 /*step*/,
+        .stepNumber = 0,
+        .rpm = 100,
+        .axis = AXIS_PLANE
     }
 };
 
 // static Stepper plane = Stepper(STEPS, PA5, PA6);
 
-void stepper_rotate(stepper_id_t stepperId, uint16_t angle)
+// one step of Stepper::step in 2 wire mode, called from the motion interrupt
+static void _stepper_step(stepper_id_t stepperId, int8_t dir)
+{
+    stepper_t* s = &stepper_arr[stepperId];
+    s->stepNumber = (s->stepNumber + STEPS + dir) % STEPS;
+    switch (s->stepNumber % 4)
+    {
+        case 0:
+            digitalWrite(s->pin1, LOW);
+            digitalWrite(s->pin2, HIGH);
+            break;
+        case 1:
+            digitalWrite(s->pin1, HIGH);
+            digitalWrite(s->pin2, HIGH);
+            break;
+        case 2:
+            digitalWrite(s->pin1, HIGH);
+            digitalWrite(s->pin2, LOW);
+            break;
+        case 3:
+            digitalWrite(s->pin1, LOW);
+            digitalWrite(s->pin2, LOW);
+            break;
+    }
+}
+
+static void _plane_advance(int8_t dir)
+{
+    _stepper_step(PLANE, dir);
+}
+
+void stepper_init(stepper_id_t stepperId)
+{
+    pinMode(stepper_arr[stepperId].pin1, OUTPUT);
+    pinMode(stepper_arr[stepperId].pin2, OUTPUT);
+    motion_attach(stepper_arr[stepperId].axis, _plane_advance);
+}
+
+// steps per second at the set speed, what Stepper::setSpeed works out as a step delay
+static float _stepper_speed(stepper_id_t stepperId)
+{
+    return (float) stepper_arr[stepperId].rpm * STEPS / 60;
+}
+
+uint32_t stepper_toSteps(uint16_t angle)
 {
-    stepper_arr[stepperId].stepper.step((int16_t) angle * 6 / STEP_ANGLE);
+    return (int16_t) angle * 6 / STEP_ANGLE;
+}
+
+// starts the move and returns, motion_busy/motion_idle tell when it is done
+void stepper_move(stepper_id_t stepperId, uint16_t angle)
+{
+    motion_start(stepper_arr[stepperId].axis, stepper_toSteps(angle), 1, _stepper_speed(stepperId), STEPPER_ACCEL_SPS2);
     stepper_arr[stepperId].angle += angle;
 }
 
+// turns through angle without stopping, calling mark from the motion interrupt at
+// views evenly spaced positions. The move is lengthened by the ramps at either end
+// so every mark is passed at the set speed. Returns the position of the first mark,
+// a mark's angle is (position - first) / stepper_toSteps(angle) of the way round.
+// The plane ends up twice that past where it started, see stepper_scanReturn.
+uint32_t stepper_scan(stepper_id_t stepperId, uint16_t angle, uint8_t views, motion_mark_t mark)
+{
+    uint32_t steps = stepper_toSteps(angle);
+    float speed = _stepper_speed(stepperId);
+    // steps taken getting up to speed, and again slowing down
+    uint32_t ramp = (uint32_t) (speed * speed / (2 * STEPPER_ACCEL_SPS2)) + 1;
+
+    motion_setMarks(stepper_arr[stepperId].axis, ramp, steps, views, mark);
+    motion_start(stepper_arr[stepperId].axis, steps + 2 * ramp, 1, speed, STEPPER_ACCEL_SPS2);
+    return ramp;
+}
+
+// turns back the ramps of the last stepper_scan, first being what it returned, so the
+// plane is where it was before the scan. Starts the move and returns like stepper_move.
+void stepper_scanReturn(stepper_id_t stepperId, uint32_t first)
+{
+    motion_start(stepper_arr[stepperId].axis, 2 * first, -1, _stepper_speed(stepperId), STEPPER_ACCEL_SPS2);
+}
+
+void stepper_rotate(stepper_id_t stepperId, uint16_t angle)
+{
+    stepper_move(stepperId, angle);
+    motion_wait(stepper_arr[stepperId].axis);
+}
+
 uint16_t stepper_getAngle(stepper_id_t stepperId) 
 {
     return stepper_arr[stepperId].angle;
@@ -27,11 +110,11 @@ uint16_t stepper_getAngle(stepper_id_t stepperId)
 
 void stepper_setSpeed(stepper_id_t stepperId, uint16_t rpm)
 {
-    stepper_arr[stepperId].stepper.setSpeed(rpm);
+    stepper_arr[stepperId].rpm = rpm;
 }
 
 
 void stepper_reset(stepper_id_t stepperId)
 {
     stepper_arr[stepperId].angle = 0;
-}
\ No newline at end of file
+}
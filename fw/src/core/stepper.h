@@ -1,6 +1,8 @@
-
 #include <Arduino.h>
-#include <Stepper.h>
+#include "motion.h"
+
+// Ramp up to and down from the speed set with stepper_setSpeed, in steps/s^2
+#define STEPPER_ACCEL_SPS2 8000.0
 
 typedef enum {
     PLANE,
@@ -10,13 +12,28 @@ typedef enum {
 
 typedef struct {
     uint16_t angle;
-    Stepper stepper;
+    // driven like the Arduino Stepper library's 2 wire mode
+    uint8_t pin1;
+    uint8_t pin2;
+    uint16_t stepNumber;
+    uint16_t rpm;
+    motion_axis_id_t axis;
 } stepper_t;
 
+void stepper_init(stepper_id_t stepperId);
+
+void stepper_move(stepper_id_t stepperId, uint16_t angle);
+
 void stepper_rotate(stepper_id_t stepperId, uint16_t angle);
 
+uint32_t stepper_toSteps(uint16_t angle);
+
+uint32_t stepper_scan(stepper_id_t stepperId, uint16_t angle, uint8_t views, motion_mark_t mark);
+
+void stepper_scanReturn(stepper_id_t stepperId, uint32_t first);
+
 uint16_t stepper_getAngle(stepper_id_t stepperId);
 
 void stepper_setSpeed(stepper_id_t stepperId, uint16_t rpm);
 
-void stepper_reset(stepper_id_t stepperId);
\ No newline at end of file
+void stepper_reset(stepper_id_t stepperId);
@@ -0,0 +1,44 @@
+#include "trigger.h"
+
+trigger_periph_t trigger_arr[] = 
+{
+    {
+        // wired to the camera's trigger input line
+        .pin = PB12,
+        .raisedAt = 0,
+        .high = false
+    }
+};
+
+void trigger_init(trigger_id_t trigger)
+{
+    pinMode(trigger_arr[trigger].pin, OUTPUT);
+    digitalWrite(trigger_arr[trigger].pin, LOW);
+}
+
+void trigger_pulse(trigger_id_t trigger)
+{
+    digitalWrite(trigger_arr[trigger].pin, HIGH);
+    delayMicroseconds(TRIGGER_PULSE_US);
+    digitalWrite(trigger_arr[trigger].pin, LOW);
+}
+
+// starts a pulse without waiting, safe from an interrupt. trigger_update ends it
+void trigger_raise(trigger_id_t trigger)
+{
+    digitalWrite(trigger_arr[trigger].pin, HIGH);
+    trigger_arr[trigger].raisedAt = micros();
+    trigger_arr[trigger].high = true;
+}
+
+// ends a pulse from trigger_raise once it has lasted TRIGGER_PULSE_US, call it from the loop
+void trigger_update(trigger_id_t trigger)
+{
+    trigger_periph_t* t = &trigger_arr[trigger];
+
+    if (t->high && (micros() - t->raisedAt) >= TRIGGER_PULSE_US)
+    {
+        t->high = false;
+        digitalWrite(t->pin, LOW);
+    }
+}
@@ -0,0 +1,25 @@
+#include <Arduino.h>
+
+// The camera's FrameStart trigger fires on the rising edge, this is well above its minimum pulse width
+#define TRIGGER_PULSE_US 100
+
+typedef enum
+{
+    CAMERA
+} trigger_id_t;
+
+typedef struct
+{
+    uint8_t pin;
+    // micros() at trigger_raise, the line is high until trigger_update lowers it
+    volatile uint32_t raisedAt;
+    volatile bool high;
+} trigger_periph_t;
+
+void trigger_init(trigger_id_t trigger);
+
+void trigger_pulse(trigger_id_t trigger);
+
+void trigger_raise(trigger_id_t trigger);
+
+void trigger_update(trigger_id_t trigger);
@@ -3,6 +3,30 @@
 #include "core/stepper.h"
 #include "core/servo.h"
 #include "core/light.h"
+#include "core/motion.h"
+#include "core/trigger.h"
+
+// Pulse the camera's trigger line at every pose instead of asking the RPi for a
+// picture, must match HARDWARE_TRIGGER in sw/data_collection_backend.py
+// #define HARDWARE_TRIGGER
+// Take the side-on views on the fly, triggering the camera at SCAN_VIEWS evenly
+// spaced positions while the plane turns once at SCAN_RPM instead of stopping
+// for each. Needs HARDWARE_TRIGGER, must match CONTINUOUS_SCAN in
+// sw/data_collection_backend.py. python-test-scripts/simulate_scan.py shows how
+// fast the plane can go before the camera can't keep up.
+// #define CONTINUOUS_SCAN
+
+#if defined(CONTINUOUS_SCAN) && !defined(HARDWARE_TRIGGER)
+#error "CONTINUOUS_SCAN needs HARDWARE_TRIGGER, the camera is triggered from the motion interrupt"
+#endif
+
+#define ARM_UP_ANGLE     15
+#define ARM_DOWN_ANGLE   160
+#define PLANE_STEP_ANGLE 180
+// the plane is done after this (8 moves, 9 side-on pictures)
+#define PLANE_END_ANGLE  (360*4)
+#define SCAN_VIEWS       9
+#define SCAN_RPM         100
 
 void setup() 
 {
@@ -10,10 +34,12 @@ void setup()
     serial_init(COMPUTER);
     serial_init(RPI);
 
-    // initilize the servo and stepper motor
+    // initilize the servo and stepper motor, both are moved from the motion timer interrupt
     servo_init(ARM, PB1);
     
+    stepper_init(PLANE);
     stepper_setSpeed(PLANE, 100);
+    motion_init();
 
     // enable pin of stepper
     pinMode(PA7, OUTPUT);
@@ -23,6 +49,8 @@ void setup()
     light_init(DOME);
     light_init(BACK);
 
+    trigger_init(CAMERA);
+
     // A0 back light (OFF Duty Cycle 0%)
     // 118042us exposure for back-light
 
@@ -38,14 +66,36 @@ typedef enum
 {
     ROT_ARM,
     ROT_PLANE,
+    WAIT_ON_MOTION,
     WAIT_ON_PIC,
     TAKE_PIC,
     WAIT_ON_RPI,
+#ifdef CONTINUOUS_SCAN
+    START_SCAN,
+    SCAN_PLANE,
+#endif
 } state_t;
 
 static state_t state = WAIT_ON_RPI;
+// pictures taken of the current fastener, sent with MSG_TRIGGERED
+static uint8_t pose = 0;
+
+#ifdef CONTINUOUS_SCAN
+// plane positions the camera was triggered at, written by the motion interrupt
+static volatile uint32_t scan_positions[SCAN_VIEWS];
+static volatile uint8_t scan_marks = 0;
+// views sent to the RPi
+static uint8_t scan_reported = 0;
+// position of the first view, and steps in a whole turn
+static uint32_t scan_first = 0;
+static uint32_t scan_steps = 0;
 
-static char picMessage[] = "picture";
+static void scan_mark(uint32_t position)
+{
+    trigger_raise(CAMERA);
+    scan_positions[scan_marks++] = position;
+}
+#endif
 
 // #define DEBUG
 
@@ -75,11 +125,9 @@ void loop()
             light_update(BACK, BACK_OFF);
             // debug message
             serial_send(COMPUTER, "rotating arm down");
-            // rotate arm update arm position
-            servo_rotateTo(ARM, 160); // 156
-            // turn on the dome light
-            light_update(DOME, DOME_ON);
-            state = TAKE_PIC;
+            // start rotating the arm, WAIT_ON_MOTION takes the picture once it is down
+            servo_moveTo(ARM, ARM_DOWN_ANGLE); // 156
+            state = WAIT_ON_MOTION;
             break;
 
         case ROT_PLANE:
@@ -88,82 +136,140 @@ void loop()
 
             serial_send(COMPUTER, "rotating plane");
             // rotate plane update plane position
-            if (stepper_getAngle(PLANE) >= 360*4)
+            if (stepper_getAngle(PLANE) >= PLANE_END_ANGLE)
             {
                 state = WAIT_ON_RPI;
                 stepper_reset(PLANE);
-                servo_rotateTo(ARM, 15);
+                // the RPi gets on with its side while the arm goes up,
+                // the next "start" waits in WAIT_ON_MOTION until it is there
+                servo_moveTo(ARM, ARM_UP_ANGLE);
                 // message indicating end of imaging session
-                serial_send(RPI, "finished-imaging");
+                serial_sendFrame(RPI, MSG_FINISHED_IMAGING);
             }
             else
             {
-                stepper_rotate(PLANE, 180);
-                // turn the dome light on for first side-on photo
-                light_update(DOME, DOME_ON);
+                stepper_move(PLANE, PLANE_STEP_ANGLE);
+                state = WAIT_ON_MOTION;
+            }
+            break;
+
+        case WAIT_ON_MOTION:
+            // nothing new is expected while moving, but polling keeps acking
+            // resent frames and resending ours instead of leaving the RPi waiting
+            serial_pollFrame(RPI);
+            if (motion_idle())
+            {
+                // the dome light is for the side-on photos, the top-down one is back lit
+                bool sideOn = servo_getAngle(ARM) != ARM_UP_ANGLE;
+                if (sideOn)
+                {
+                    light_update(DOME, DOME_ON);
+                }
+#ifdef CONTINUOUS_SCAN
+                state = sideOn ? START_SCAN : TAKE_PIC;
+#else
                 state = TAKE_PIC;
+#endif
             }
             break;
 
         case WAIT_ON_PIC:
             // wait until there is response from the RPi
             serial_send(COMPUTER, "waiting on finished pic");
-            if (serial_available(RPI))
+            // check whether message is the finished command
+            // if so, determine which state to change to
+            if (serial_pollFrame(RPI) == MSG_FINISHED)
             {
-                if (serial_handleByte(RPI, serial_read(RPI)))
+                // state determination
+                if (servo_getAngle(ARM) == ARM_UP_ANGLE)
+                {
+                    state = ROT_ARM;
+                }
+                else if (stepper_getAngle(PLANE) <= PLANE_END_ANGLE)
                 {
-                    // check whether message is the finished command
-                    // if so, determine which state to change to
-                    if (strcmp("finished", serial_getMessage(RPI)) == 0)
-                    {
-                        // state determination
-                        if (servo_getAngle(ARM) == 15)
-                        {
-                            state = ROT_ARM;
-                        }
-                        else if (stepper_getAngle(PLANE) <= 360*4)
-                        {
-                            state = ROT_PLANE;
-                        }
-                        else
-                        {
-                            // reset arm to top position
-                            state = WAIT_ON_RPI;
-                        }
-                    }
+                    state = ROT_PLANE;
                 }
-            }           
+                else
+                {
+                    // reset arm to top position
+                    state = WAIT_ON_RPI;
+                }
+            }
             break;
 
         case TAKE_PIC:
             // serial send take pic
+#ifdef HARDWARE_TRIGGER
+            // the pose is reached, expose straight away and tell the RPi which pose it is
+            serial_send(COMPUTER, "triggering camera");
+            trigger_pulse(CAMERA);
+            serial_sendFramePayload(RPI, MSG_TRIGGERED, &pose, 1);
+#else
             serial_send(COMPUTER, "requesting picture from rpi");
-            serial_send(RPI, picMessage);
+            serial_sendFrame(RPI, MSG_PICTURE);
+#endif
+            pose++;
             state = WAIT_ON_PIC;
             break;
 
         case WAIT_ON_RPI:
             // waiting for the RPi to send a request for data collection
-            if (serial_available(RPI))
+            // check whether message is the start command
+            // if so, change the state to take pic (polling also resends
+            // "finished-imaging" until the RPi acks it)
+            if (serial_pollFrame(RPI) == MSG_START)
             {
-                if (serial_handleByte(RPI, serial_read(RPI)))
-                {
-                    // check whether message is the start command
-                    // if so, change the state to take pic
-                    if (strcmp("start", serial_getMessage(RPI)) == 0)
-                    {
-                        // TODO: getMessage method exposes memory internal to 
-                        //       serial module, change this to return a copy 
-                        //       of the message or perhaps an enum indicator
-                        //       that is taken to represent the message.
-                        serial_send(COMPUTER, "starting control loop");
-                        // turn on the back light
-                        light_update(BACK, BACK_ON);
-                        state = TAKE_PIC;
-                    }
-                }
+                serial_send(COMPUTER, "starting control loop");
+                // turn on the back light
+                light_update(BACK, BACK_ON);
+                pose = 0;
+                // the arm may still be on its way up from the last fastener
+                state = WAIT_ON_MOTION;
+            }
+            break;
+
+#ifdef CONTINUOUS_SCAN
+        case START_SCAN:
+            serial_send(COMPUTER, "scanning plane");
+            stepper_setSpeed(PLANE, SCAN_RPM);
+            scan_marks = 0;
+            scan_reported = 0;
+            scan_steps = stepper_toSteps(PLANE_END_ANGLE);
+            // the motion interrupt triggers the camera at every view, see scan_mark
+            scan_first = stepper_scan(PLANE, PLANE_END_ANGLE, SCAN_VIEWS, scan_mark);
+            state = SCAN_PLANE;
+            break;
+
+        case SCAN_PLANE:
+            // the plane doesn't wait for the RPi, it only gets told what was taken where
+            trigger_update(CAMERA);
+            serial_pollFrame(RPI);
+            if (serial_framePending(RPI))
+            {
+                break;
+            }
+            if (scan_reported < scan_marks)
+            {
+                // pose, then the angle of the view in hundredths of a degree
+                uint16_t angle = (uint64_t) (scan_positions[scan_reported] - scan_first) * 36000 / scan_steps;
+                uint8_t payload[3] = {pose, (uint8_t) (angle >> 8), (uint8_t) angle};
+                serial_sendFramePayload(RPI, MSG_TRIGGERED, payload, sizeof(payload));
+                scan_reported++;
+                pose++;
+            }
+            else if (scan_reported == SCAN_VIEWS && motion_idle())
+            {
+                light_update(DOME, DOME_OFF);
+                // back to where the top-down view was taken, while the arm goes up,
+                // the next "start" waits in WAIT_ON_MOTION until both are done
+                stepper_scanReturn(PLANE, scan_first);
+                stepper_reset(PLANE);
+                state = WAIT_ON_RPI;
+                servo_moveTo(ARM, ARM_UP_ANGLE);
+                serial_sendFrame(RPI, MSG_FINISHED_IMAGING);
             }
             break;
+#endif
     }
 }
 #endif
@@ -1,16 +1,28 @@
 
-from time import sleep
-import serial
 import json
 import os
+from contextlib import ExitStack
 
-import cv2
-from vimba import *
-import time
+try:
+    from vimba import *
+except ImportError:
+    # Lets begin_imaging_process run against simulated_camera.SimulatedCamera without the Vimba SDK
+    Vimba = None
+    Camera = None
+
+    class PixelFormat:
+        Mono8 = "Mono8"
+
+    class VimbaFeatureError(Exception):
+        pass
 from datetime import datetime
+from serial_transport import SERIAL_PORT, ACK_TIMEOUT_S
+from serial_protocol import FramedSerialTransport
+from image_codecs import get_codec
 
 FOLDER_NAME = "imaging_test_{date}"
-FILE_NAME = "/pic_{n}.tiff"
+FILE_NAME = "/pic_{n}{extension}"
+IMAGE_CODEC = "tiff"
 
 
 def setup_camera(cam: Camera):
@@ -48,47 +60,50 @@ def setup_camera(cam: Camera):
                 abort('Camera does not support a OpenCV compatible format')
 
 
-def begin_imaging_process(imaging_camera: Camera):
-    # establish serial communication with Bluepill
-    s = serial.Serial("/dev/ttyUSB0", 115200)
+def open_camera(imaging_camera):
+    stack = ExitStack()
+    # requirement that Vimba instance is opened using "with", a simulated camera doesn't need it
+    if Camera is not None and isinstance(imaging_camera, Camera):
+        stack.enter_context(Vimba.get_instance())
+    stack.enter_context(imaging_camera)
+    return stack
 
-    # commence the imaging session with the "start" command
-    sleep(1)
-    print(s.write(b"start\n"))
-    s.flush()
 
+def begin_imaging_process(imaging_camera: Camera, port=SERIAL_PORT, codec=IMAGE_CODEC):
+    codec = get_codec(codec)
     # make a directory to temporarily store the images
     date = datetime.now().strftime("%d_%m_%Y_%H_%M_%S")
     f = FOLDER_NAME.format(date=date)
     os.mkdir(f)
     n = 0
 
-    while True:
-        # wait on serial communication
-        if s.in_waiting > 0:
-            time.sleep(1)
-            message = s.readline().decode("ascii")
-            if message == "picture\r\n":
-                # requirement that Vimba instance is opened using "with"
-                with Vimba.get_instance() as vimba:
-                    with imaging_camera as cam:
-                        # set frame capture timeout at max exposure time
-                        frame = cam.get_frame(timeout_ms=1000000)
-                        print("Got a frame")
-                        time.sleep(1)
-                        print("Frame saved to mem")
-                        frame.convert_pixel_format(PixelFormat.Mono8)
-                        cv2.imwrite(f+FILE_NAME.format(n=n),
-                                    frame.as_opencv_image())
-                        n += 1
-                        # send a message to indicate a picture was saved
-                        s.write(b"finished\n")
-                        s.flush()
-
-            elif message == "finished-imaging\r\n":
+    # establish serial communication with Bluepill
+    with FramedSerialTransport(port) as link:
+        # commence the imaging session with the "start" command,
+        # the first picture request acknowledges it
+        message = link.request("start", "picture")
+
+        while True:
+            if message == "picture":
+                with open_camera(imaging_camera):
+                    # set frame capture timeout at max exposure time
+                    frame = imaging_camera.get_frame(timeout_ms=1000000)
+                    print("Got a frame")
+                    frame.convert_pixel_format(PixelFormat.Mono8)
+                    codec.save(f+FILE_NAME.format(n=n, extension=codec.extension),
+                               frame.as_opencv_image())
+                    n += 1
+                    # send a message to indicate a picture was saved
+                    link.send("finished")
+
+            elif message == "finished-imaging":
                 # exit the control loop
                 break
 
+            # wait on serial communication
+            message = link.next_message(timeout_s=ACK_TIMEOUT_S)
+    return n
+
 
 if __name__ == "__main__":
     # Retrieve our camera once, set exposure/white balance
@@ -0,0 +1,269 @@
+import json
+import os
+import time
+import xml.etree.ElementTree as ET
+from collections import OrderedDict
+from contextlib import ExitStack
+
+from PyQt5 import QtCore
+
+try:
+    from vimba import Vimba, Camera, VimbaFeatureError, PersistType
+except ImportError:
+    # Lets profiles drive simulated_camera.SimulatedCamera without the Vimba SDK
+    Vimba = None
+    Camera = None
+    PersistType = None
+
+    class VimbaFeatureError(Exception):
+        pass
+
+# Features that depend on a selector are written as "Feature[Selector value]"
+SELECTED_FEATURES = {"BalanceRatio": "BalanceRatioSelector"}
+# Switching one of these to an automatic mode makes the camera change the listed features itself
+AUTO_FEATURES = {"ExposureAuto": ("ExposureTime",),
+                 "BalanceWhiteAuto": ("BalanceRatio[Red]", "BalanceRatio[Blue]")}
+
+
+class CameraProfile:
+    """An ordered set of feature values, applied top to bottom."""
+
+    def __init__(self, name, features):
+        self.name = name
+        self.features = OrderedDict(features)
+
+    def __repr__(self):
+        return f"CameraProfile({self.name})"
+
+    def to_xml(self):
+        root = ET.Element("CameraProfile", name=self.name)
+        for key, value in self.features.items():
+            ET.SubElement(root, "Feature", name=key, type=type(value).__name__).text = str(value)
+        return root
+
+    @classmethod
+    def from_xml(cls, root):
+        types = {"int": int, "float": float, "str": str}
+        features = [(feature.get("name"), types[feature.get("type")](feature.text))
+                    for feature in root.findall("Feature")]
+        return cls(root.get("name"), features)
+
+
+# Camera config
+AUTO_PROFILE = CameraProfile("auto", [
+    ("ExposureAuto", "Continuous"),
+    ("BalanceWhiteAuto", "Continuous"),
+])
+TOP_DOWN_PROFILE = CameraProfile("top_down", [
+    ("ExposureAuto", "Off"),
+    ("ExposureTime", 133952),
+    # undoes SIDE_VIEW_SCAN_PROFILE's gain
+    ("Gain", 0.0),
+    ("BalanceWhiteAuto", "Off"),
+    ("BalanceRatio[Red]", 2.88),
+    ("BalanceRatio[Blue]", 1.9),
+])
+SIDE_VIEW_PROFILE = CameraProfile("side_view", [
+    ("ExposureAuto", "Off"),
+    ("ExposureTime", 723824),
+    ("BalanceWhiteAuto", "Off"),
+    ("BalanceRatio[Red]", 2.52),
+    ("BalanceRatio[Blue]", 1.45),
+])
+# Side-on views taken while the plane keeps turning (CONTINUOUS_SCAN), the exposure has to
+# be short enough not to smear the fastener, python-test-scripts/simulate_scan.py shows
+# how far it turns during one. Gain makes up for some of the light lost.
+SIDE_VIEW_SCAN_PROFILE = CameraProfile("side_view_scan", [
+    ("ExposureAuto", "Off"),
+    ("ExposureTime", 8000),
+    ("Gain", 24.0),
+    ("BalanceWhiteAuto", "Off"),
+    ("BalanceRatio[Red]", 2.52),
+    ("BalanceRatio[Blue]", 1.45),
+])
+DEFAULT_PROFILES = [AUTO_PROFILE, TOP_DOWN_PROFILE, SIDE_VIEW_PROFILE, SIDE_VIEW_SCAN_PROFILE]
+# Camera user sets holding the fixed profiles, see Examples_from_Vimba/user_set.py.
+# "Default" is the read-only factory set, leave it alone.
+USER_SETS = {"top_down": "UserSet1", "side_view": "UserSet2"}
+# Longest a UserSetSave or UserSetLoad may take before the set is given up on
+USER_SET_TIMEOUT_S = 5
+# How often a running user set command is checked on, it runs on the GUI thread
+USER_SET_POLL_S = 0.002
+
+
+def save_profiles(profiles, path):
+    root = ET.Element("CameraProfiles")
+    for profile in profiles:
+        root.append(profile.to_xml())
+    ET.ElementTree(root).write(path, encoding="utf-8", xml_declaration=True)
+
+
+def load_profiles(path):
+    return [CameraProfile.from_xml(element) for element in ET.parse(path).getroot().findall("CameraProfile")]
+
+
+class CameraProfileManager(QtCore.QObject):
+    """
+    Remembers the feature values it has applied to the camera and, when
+    switching profile, only writes the ones that differ. Call invalidate()
+    whenever something else may have changed the camera (eg. loading settings).
+
+    Profiles provisioned into camera user sets are switched to with a single
+    UserSetLoad instead. If the camera has no user sets, or refuses to load one
+    (some models don't while streaming), the feature-by-feature path is used.
+    Every switch is logged in switch_times as (profile, method, seconds).
+
+    A user set also holds the trigger settings as they were when it was
+    saved, so user_set_loaded is emitted right after every load, from within
+    apply(), for the capture backend to put its own back.
+    """
+    # profile name, number of features written, seconds taken
+    profile_applied = QtCore.pyqtSignal(str, int, float)
+    user_set_loaded = QtCore.pyqtSignal()
+
+    def __init__(self, cam, profiles=DEFAULT_PROFILES):
+        super(CameraProfileManager, self).__init__()
+        self.cam = cam
+        self.profiles = OrderedDict((profile.name, profile) for profile in profiles)
+        self.current = None
+        self.user_sets = {}
+        self.switch_times = []
+        self._applied = {}
+
+    def invalidate(self):
+        self._applied = {}
+        self.current = None
+
+    def _open(self):
+        stack = ExitStack()
+        # requirement that Vimba instance is opened using "with", cheap if the capture engine has it open
+        if Camera is not None and isinstance(self.cam, Camera):
+            stack.enter_context(Vimba.get_instance())
+        stack.enter_context(self.cam)
+        return stack
+
+    def _write(self, key, value):
+        if key.endswith("]"):
+            name, selected = key[:-1].split("[")
+            getattr(self.cam, SELECTED_FEATURES[name]).set(selected)
+            getattr(self.cam, name).set(value)
+        else:
+            getattr(self.cam, key).set(value)
+
+    def _run_user_set_command(self, command, set_id):
+        self.cam.UserSetSelector.set(set_id)
+        cmd = getattr(self.cam, command)
+        cmd.run()
+
+        deadline = time.monotonic() + USER_SET_TIMEOUT_S
+        while not cmd.is_done():
+            if time.monotonic() > deadline:
+                raise VimbaFeatureError(f"{command} of {set_id} didn't finish within {USER_SET_TIMEOUT_S}s")
+            time.sleep(USER_SET_POLL_S)
+
+    def provision_user_sets(self, user_sets=USER_SETS, record_file=None):
+        """
+        Saves each profile into its user set so apply() can load it in one go.
+        record_file remembers what was saved to which camera, so the flash is
+        only rewritten when a profile has changed.
+        """
+        record = {}
+        if record_file and os.path.exists(record_file):
+            with open(record_file) as f:
+                record = json.load(f)
+        with self._open():
+            cam_id = self.cam.get_id()
+            saved = record.setdefault(cam_id, {})
+            try:
+                available = [str(entry) for entry in self.cam.UserSetSelector.get_available_entries()]
+            except (AttributeError, VimbaFeatureError) as e:
+                print(f"Camera has no user sets, switching profiles feature by feature: {e}")
+                return False
+            for name, set_id in user_sets.items():
+                if set_id not in available:
+                    print(f"Camera has no user set {set_id}, '{name}' is switched feature by feature")
+                    continue
+                contents = {"user_set": set_id, "features": list(self.profiles[name].features.items())}
+                # compare in json form, tuples come back from the file as lists
+                if json.loads(json.dumps(contents)) != saved.get(name):
+                    print(f"Saving camera profile '{name}' to {set_id}")
+                    try:
+                        self._apply_features(self.profiles[name])
+                        self._run_user_set_command("UserSetSave", set_id)
+                    except (AttributeError, VimbaFeatureError) as e:
+                        print(f"Could not save {set_id}: {e}")
+                        continue
+                    saved[name] = contents
+                self.user_sets[name] = set_id
+        if record_file:
+            with open(record_file, "w") as f:
+                json.dump(record, f, indent=2)
+        return bool(self.user_sets)
+
+    def _load_user_set(self, name):
+        try:
+            self._run_user_set_command("UserSetLoad", self.user_sets[name])
+        except (AttributeError, VimbaFeatureError) as e:
+            print(f"Could not load user set for '{name}', switching feature by feature from now on: {e}")
+            del self.user_sets[name]
+            return False
+        # the camera now holds exactly what was saved in the user set
+        self._applied = dict(self.profiles[name].features)
+        self.user_set_loaded.emit()
+        return True
+
+    def apply(self, name):
+        """Switch to a profile, returns the number of writes to the camera."""
+        profile = self.profiles[name]
+        start = time.monotonic()
+        with self._open():
+            if all(self._applied.get(key) == value for key, value in profile.features.items()):
+                method, writes = "cached", 0
+            elif name in self.user_sets and self._load_user_set(name):
+                method, writes = "user set", 1
+            else:
+                method, writes = "features", self._apply_features(profile)
+        self.current = name
+        elapsed = time.monotonic() - start
+        self.switch_times.append((name, method, elapsed))
+        print(f"Camera profile '{name}' applied ({method}), {writes} writes in {elapsed * 1000:.1f}ms")
+        self.profile_applied.emit(name, writes, elapsed)
+        return writes
+
+    def _apply_features(self, profile):
+        writes = 0
+        for key, value in profile.features.items():
+            if self._applied.get(key) == value:
+                continue
+            try:
+                self._write(key, value)
+            except (AttributeError, VimbaFeatureError) as e:
+                print(f"Could not set {key} to {value}: {e}")
+                self._applied.pop(key, None)
+                continue
+            writes += 1
+            self._applied[key] = value
+            if value != "Off":
+                # the camera now drives these itself
+                for dependent in AUTO_FEATURES.get(key, ()):
+                    self._applied.pop(dependent, None)
+        return writes
+
+    def save(self, path):
+        save_profiles(self.profiles.values(), path)
+
+    def load(self, path):
+        for profile in load_profiles(path):
+            self.profiles[profile.name] = profile
+        # a changed profile has to be written in full next time
+        self.invalidate()
+
+    def save_camera_state(self, path):
+        """Full camera state as Vimba XML, see Examples_from_Vimba/load_save_settings.py."""
+        with self._open():
+            self.cam.save_settings(path, PersistType.All)
+
+    def load_camera_state(self, path):
+        with self._open():
+            self.cam.load_settings(path, PersistType.All)
+        self.invalidate()
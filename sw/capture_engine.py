@@ -0,0 +1,231 @@
+import queue
+import threading
+import time
+from collections import namedtuple
+
+import numpy
+
+from instrumentation import span
+
+# Frames waiting for the worker. Kept small: the worker only ever wants the
+# frame it just asked for, anything older than that is stale.
+FRAME_QUEUE_SIZE = 4
+# Number of frame buffers announced to the camera driver
+FRAME_BUFFER_COUNT = 10
+# Matches the old get_frame(timeout_ms=1000000)
+FRAME_TIMEOUT_S = 1000
+
+CapturedFrame = namedtuple("CapturedFrame", ["image", "frame_id", "timestamp"])
+
+
+class CaptureTimeout(Exception):
+    pass
+
+
+class CaptureEngine:
+    """
+    Keeps the camera open and streaming for a whole imaging session and hands
+    frames to the caller through a bounded queue.
+
+    The backend must provide open(), close(), enable_exposure_events(handler),
+    start_streaming(handler, buffer_count), stop_streaming() and trigger(). The
+    exposure handler is called with no arguments as soon as the sensor has stopped
+    integrating; enable_exposure_events returns False if the camera can't tell us,
+    expose() then waits for the whole frame instead. The frame handler is called from the backend's
+    acquisition thread as handler(image, frame_id); the image is only valid for the
+    duration of the call, so it is copied into a ring of preallocated host buffers.
+    A frame returned by capture() stays valid until ring_size more frames have been
+    captured, callers that want to keep it longer must copy it (cv2.flip already does).
+
+    capture() is expose() followed by collect(). Callers that only need the
+    sensor to be done (eg. to let the arm move on) can do something else in
+    between while the frame is read out.
+
+    When something else triggers the camera (the Bluepill pulsing its trigger
+    line), call begin_sequence() before the first trigger and use
+    expose_sequence(n)/collect_sequence(n) for the n-th exposure after it.
+    Frames are matched to exposures by their frame id, so a frame the camera
+    lost is reported instead of the next one being taken for it. The camera
+    doesn't wait for the caller then, so begin_sequence(length) grows the
+    queue to hold the whole sequence, and dropping one of its frames is
+    logged as an error.
+    """
+
+    def __init__(self, backend, queue_size=FRAME_QUEUE_SIZE, buffer_count=FRAME_BUFFER_COUNT):
+        self.backend = backend
+        self.buffer_count = buffer_count
+        self.frame_queue = queue.Queue(maxsize=queue_size)
+        # One slot per queued frame, one held by the consumer and one being filled
+        self.ring_size = queue_size + 2
+        self._ring = []
+        self._ring_index = 0
+        self._ring_lock = threading.Lock()
+        self.streaming = False
+        self.dropped_frames = 0
+        self.exposure_events = False
+        self._exposure_ended = threading.Event()
+        # exposures and frames since begin_sequence(), and the frame id of the first one
+        self._sequence = threading.Condition()
+        self._sequence_exposures = 0
+        self._sequence_frames = 0
+        self._sequence_first_id = None
+        self._sequence_ahead = None
+        self._sequence_length = None
+        self._last_frame_id = None
+        # a frame expose() already had to wait for, handed out by the next collect()
+        self._exposed_frame = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def start(self):
+        if self.streaming:
+            return
+        with span("camera open"):
+            self.backend.open()
+            try:
+                self.exposure_events = self.backend.enable_exposure_events(self._on_exposure_end)
+                self.backend.start_streaming(self._on_frame, self.buffer_count)
+            except Exception:
+                self.backend.close()
+                raise
+        self.streaming = True
+
+    def stop(self):
+        if not self.streaming:
+            return
+        try:
+            self.backend.stop_streaming()
+        finally:
+            self.backend.close()
+            self.streaming = False
+            self._drain()
+
+    def capture(self, timeout_s=FRAME_TIMEOUT_S):
+        """Request a new exposure and block until its frame arrives."""
+        self.expose(timeout_s)
+        return self.collect(timeout_s)
+
+    def expose(self, timeout_s=FRAME_TIMEOUT_S):
+        """Request a new exposure and block until the sensor is done with it, collect() returns its frame."""
+        # Anything already queued was exposed before the caller asked for it
+        self._drain()
+        self._exposed_frame = None
+        self._exposure_ended.clear()
+        triggered = self.backend.trigger()
+        if triggered and self.exposure_events:
+            if not self._exposure_ended.wait(timeout_s):
+                raise CaptureTimeout(f"Exposure didn't end within {timeout_s}s")
+            return
+        frame = self._get(timeout_s)
+        if not triggered:
+            # Free running camera: the first frame may have started exposing
+            # before the request (ie while the arm was still moving)
+            frame = self._get(timeout_s)
+        self._exposed_frame = frame
+
+    def collect(self, timeout_s=FRAME_TIMEOUT_S):
+        """The frame of the last expose(), blocks while it is still being read out."""
+        frame, self._exposed_frame = self._exposed_frame, None
+        if frame is not None:
+            return frame
+        return self._get(timeout_s)
+
+    def begin_sequence(self, length=None):
+        """The next exposure is number 0 of a new sequence of length externally triggered ones."""
+        self._drain()
+        if length is not None and length > self.frame_queue.maxsize:
+            with self._ring_lock:
+                # the queue is empty, and the ring is reallocated to match on the next frame
+                self.frame_queue.maxsize = length
+                self.ring_size = length + 2
+        with self._sequence:
+            self._sequence_exposures = 0
+            self._sequence_frames = 0
+            # frame ids count up with every exposure, lost frames included
+            self._sequence_first_id = None if self._last_frame_id is None else self._last_frame_id + 1
+            self._sequence_ahead = None
+            self._sequence_length = length
+
+    def expose_sequence(self, n, timeout_s=FRAME_TIMEOUT_S):
+        """Block until exposure n of the sequence is over."""
+        with self._sequence:
+            # the frame is proof of the exposure too, in case the event got lost
+            if not self._sequence.wait_for(lambda: max(self._sequence_exposures, self._sequence_frames) > n,
+                                           timeout=timeout_s):
+                raise CaptureTimeout(f"Exposure {n} didn't end within {timeout_s}s")
+
+    def collect_sequence(self, n, timeout_s=FRAME_TIMEOUT_S):
+        """The frame of exposure n of the sequence, raises CaptureTimeout if the camera lost it."""
+        while True:
+            frame, self._sequence_ahead = self._sequence_ahead, None
+            if frame is None:
+                frame = self._get(timeout_s)
+            if self._sequence_first_id is None:
+                self._sequence_first_id = frame.frame_id
+            index = frame.frame_id - self._sequence_first_id
+            if index == n:
+                return frame
+            if index > n:
+                # frame n never made it, keep this one for whoever asks for it
+                self._sequence_ahead = frame
+                raise CaptureTimeout(f"Frame {n} of the sequence was lost, got {index}")
+            # older than n, its caller already gave up on it
+
+    def _on_exposure_end(self):
+        # Runs in the backend's event thread
+        self._exposure_ended.set()
+        with self._sequence:
+            self._sequence_exposures += 1
+            self._sequence.notify_all()
+
+    def _get(self, timeout_s):
+        try:
+            return self.frame_queue.get(timeout=timeout_s)
+        except queue.Empty:
+            raise CaptureTimeout(f"No frame received within {timeout_s}s")
+
+    def _drain(self):
+        while True:
+            try:
+                self.frame_queue.get_nowait()
+            except queue.Empty:
+                return
+
+    def _next_buffer(self, image):
+        if (len(self._ring) != self.ring_size or self._ring[0].shape != image.shape
+                or self._ring[0].dtype != image.dtype):
+            self._ring = [numpy.empty_like(image) for _ in range(self.ring_size)]
+            self._ring_index = 0
+        buffer = self._ring[self._ring_index]
+        self._ring_index = (self._ring_index + 1) % self.ring_size
+        return buffer
+
+    def _on_frame(self, image, frame_id):
+        # Runs in the backend's acquisition thread
+        timestamp = time.monotonic()
+        with self._ring_lock:
+            if self.frame_queue.full():
+                # Drop the oldest queued frame, the newest is the one we want
+                try:
+                    dropped = self.frame_queue.get_nowait()
+                    self.dropped_frames += 1
+                    if self._sequence_length is not None:
+                        # nothing will trigger it again
+                        print(f"Error: dropped frame {dropped.frame_id} of a triggered sequence, "
+                              f"the worker is more than {self.frame_queue.maxsize} frames behind")
+                except queue.Empty:
+                    pass
+            buffer = self._next_buffer(image)
+            numpy.copyto(buffer, image)
+            self.frame_queue.put_nowait(CapturedFrame(buffer, frame_id, timestamp))
+        # in case the event got lost, a frame means its exposure is over too
+        self._exposure_ended.set()
+        with self._sequence:
+            self._last_frame_id = frame_id
+            self._sequence_frames += 1
+            self._sequence.notify_all()
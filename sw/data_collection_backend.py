@@ -1,32 +1,61 @@
 #!/usr/bin/env python3
 
 from PyQt5 import QtCore, QtGui, QtWidgets
-from python_qt_binding import loadUi
+from ui_cache import load_ui
 from fractional_spinbox import CustomDoubleSpinBox
 
 import cv2
 import sys
 import threading
 import time
-import serial
 import json
 import uuid
 
-from vimba import *
+try:
+    from vimba import *
+except ImportError:
+    # Lets the GUI run with SIMULATE_CAMERA without the Vimba SDK
+    Vimba = None
+
+    class VimbaFeatureError(Exception):
+        pass
 import os
 from datetime import datetime
 from collections import OrderedDict
-from rclone_python import rclone
 
 import numpy
-import torch
-import torchvision.transforms.transforms as T
-from utils import ModelHelper, DisplayHelper
+from capture_engine import CaptureEngine, CaptureTimeout, FRAME_TIMEOUT_S
+from vimba_backend import VimbaCameraBackend
+from simulated_camera import SimulatedCamera
+from serial_transport import SerialTimeout, SERIAL_PORT, ACK_TIMEOUT_S
+from serial_protocol import FramedSerialTransport
+from fake_bluepill import FakeBluepill
+from image_writer import ImageWriter
+from image_codecs import IMAGE_EXTENSIONS
+from upload_manager import UploadManager
+from inference_service import InferenceService
+from upload_manifest import UploadManifest
+from preview import PreviewRenderer, bgr_to_pixmap
+from frame_cache import FrameCache
+from camera_profiles import CameraProfileManager
+from instrumentation import RECORDER, span, summarize, fasteners_per_hour
 
 # TODO Figure out a better way to move these around ie not globals
 TOP_IMAGES_FOLDER = os.path.join(os.path.dirname(__file__), "images")
 FULL_SESSION_PATH = ""
 REMOTE_IMAGE_FOLDER = "gdrive_more_storage:2357 Screw Sorter/Data Real"
+# Uploads still to be done, survives restarts. Kept outside TOP_IMAGES_FOLDER so it isn't uploaded itself.
+UPLOAD_QUEUE_FILE = os.path.join(os.path.dirname(__file__), "upload_queue.json")
+# Every file uploaded so far, so "upload all" only sends what's new
+UPLOAD_MANIFEST_FILE = os.path.join(os.path.dirname(__file__), "upload_manifest.sqlite")
+# Overrides for the profiles in camera_profiles.py, written by CameraProfileManager.save()
+CAMERA_PROFILES_FILE = os.path.join(os.path.dirname(__file__), "camera_profiles.xml")
+# Keep the top-down/side-view profiles in camera user sets and switch with a single UserSetLoad
+USE_CAMERA_USER_SETS=True
+# Which profiles are already saved in the user sets of which camera
+CAMERA_USER_SETS_FILE = os.path.join(os.path.dirname(__file__), "camera_user_sets.json")
+# Loaded through the compiled module in ui_cache/, recompiled whenever this file changes
+UI_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data_collection.ui")
 CURRENT_STAGED_IMAGE_FOLDER = ""
 IMAGING_STATION_VERSION="1.0"
 IMAGING_STATION_CONFIGURATION="A1"
@@ -35,31 +64,129 @@ FIRST_TIME_SETUP=True
 TOPDOWN_INCLUDED=True
 SIDEON_INCLUDED=True
 NUMBER_SIDEON=9
+# Size of the thumbnails on the review screen relative to the full frame
+REVIEW_PERCENTAGE=7
+# Format frames are saved in, one of image_codecs.CODECS.
+# python-test-scripts/benchmark_codecs.py compares their speed and size.
+IMAGE_CODEC="tiff"
+# Run the GUI against simulated_camera.SimulatedCamera instead of the Allied Vision camera
+SIMULATE_CAMERA=False
+# Talk to fake_bluepill.FakeBluepill over a pseudo terminal instead of the board on SERIAL_PORT
+SIMULATE_BLUEPILL=False
+# Send "finished" as soon as the camera reports the exposure is over, rather than once the
+# frame is read out and handed to the writer, so motion overlaps readout and processing
+ACK_ON_EXPOSURE_END=True
+# Exposures are started by the Bluepill pulsing the camera's TRIGGER_LINE once a move is done,
+# not by "picture" requests, so the serial round trip is off the critical path. The firmware
+# has to be built with HARDWARE_TRIGGER defined (fw/src/main.cpp) to match
+HARDWARE_TRIGGER=False
+TRIGGER_LINE="Line0"
+# The side-on views are taken while the plane turns once without stopping, at the angles the
+# firmware reports, which go into the label json. Needs HARDWARE_TRIGGER, and firmware built
+# with CONTINUOUS_SCAN. python-test-scripts/simulate_scan.py trades its speed against accuracy
+CONTINUOUS_SCAN=False
+# Stepper speed while scanning, SCAN_RPM in fw/src/main.cpp, and the stepper revolutions in one
+# turn of the plane (stepper_toSteps(PLANE_END_ANGLE) / 400 steps). The plane turns NUMBER_SIDEON
+# views apart in 60 * SCAN_TURN_REVOLUTIONS / SCAN_RPM / NUMBER_SIDEON seconds
+SCAN_RPM=100
+SCAN_TURN_REVOLUTIONS=24
+# An on-the-fly view that hasn't arrived this many view periods after it was triggered is lost,
+# but never give up on it sooner than an exposure and readout take
+SCAN_TIMEOUT_VIEWS=3
+SCAN_MIN_TIMEOUT_S=0.5
+# The metrics panel shows the spans (see instrumentation.py) of the last METRICS_WINDOW_S
+METRICS_WINDOW_S=600
+METRICS_REFRESH_MS=1000
+# Written on close when set, eg. "trace.json". Open it in chrome://tracing or ui.perfetto.dev
+CHROME_TRACE_FILE=None
+# TorchScript model for "Begin Imaging Process with Inference", loaded on first use.
+# torch and friends are only imported then, they take seconds to import.
+MODEL_PATH=None
 
 CAMERA = None
 
 
+def build_review_pixmaps(image_directory, frame_cache):
+    """Pixmaps for the review screen, in image order, from the worker's thumbnails where it cached them."""
+    with span("review build"):
+        images = [os.path.join(image_directory, x)
+                  for x in sorted(os.listdir(image_directory))
+                  if x.endswith(IMAGE_EXTENSIONS)]
+        pixmaps = []
+        for img in images:
+            # images are named "{n}_{uuid}", the worker cached a thumbnail of each one
+            n = int(os.path.basename(img).split("_")[0])
+            resized_photo = frame_cache.get(image_directory, ("review", n))
+            if resized_photo is None:
+                cv_img = cv2.imread(img)
+                resized_photo = cv2.resize(cv_img, (int(cv_img.shape[1] * REVIEW_PERCENTAGE / 100),
+                                                    int(cv_img.shape[0] * REVIEW_PERCENTAGE / 100)),
+                                           interpolation=cv2.INTER_AREA)
+            pixmaps.append(bgr_to_pixmap(resized_photo))
+        return images, pixmaps
+
+
+def update_label_json(fastener_directory, fields):
+    """Adds fields to the label json written by create_label_json."""
+    for name in os.listdir(fastener_directory):
+        if not name.endswith(".json"):
+            continue
+        label_json_path = os.path.join(fastener_directory, name)
+        with open(label_json_path) as file_obj:
+            label_json = json.load(file_obj)
+        label_json.update(fields)
+        # replaced in one go, an upload may be reading it
+        with open(label_json_path + ".part", "w") as file_obj:
+            json.dump(label_json, file_obj)
+        os.replace(label_json_path + ".part", label_json_path)
+
+
+def add_prediction_to_label(fastener_directory, prediction):
+    """Adds the model's fastener-level prediction to the label json."""
+    update_label_json(fastener_directory, {"prediction": dict(prediction, model=os.path.basename(MODEL_PATH or ""))})
+
+
+def add_view_angles_to_label(fastener_directory, angles, missing=()):
+    """
+    Adds the plane angle, in degrees, of every side-on view to the label json,
+    keyed by picture number, and the numbers of the views that were lost.
+    """
+    update_label_json(fastener_directory, {"view_angles": {str(n): angle for n, angle in sorted(angles.items())},
+                                           "missing_views": sorted(missing)})
+
+
+def scan_view_timeout_s():
+    """How long to wait for the frame of an on-the-fly view."""
+    view_period_s = 60 * SCAN_TURN_REVOLUTIONS / SCAN_RPM / NUMBER_SIDEON
+    return max(SCAN_TIMEOUT_VIEWS * view_period_s, SCAN_MIN_TIMEOUT_S)
+
+
 class CameraWorker(QtCore.QObject):
     upload = QtCore.pyqtSignal(str)
     finished = QtCore.pyqtSignal()
-    change_camera_settings = QtCore.pyqtSignal(Camera, int, float, float)
+    change_camera_profile = QtCore.pyqtSignal(str)
     progress = QtCore.pyqtSignal(numpy.ndarray)
 
-    def __init__(self, filename, model_helper=None, display_helper=None,feed=False, app=None):
+    def __init__(self, filename, capture_engine, image_writer, frame_cache, serial_port=SERIAL_PORT, model_helper=None, display_helper=None,feed=False, app=None):
         super(CameraWorker, self).__init__()
         self.filename = filename
-        # Camera config
-        self.top_down_exposure_us = 133952
-        self.top_down_balance_red = 2.88
-        self.top_down_balance_blue = 1.9
-        self.side_view_exposure_us = 723824
-        self.side_view_balance_red= 2.52
-        self.side_view_balance_blue = 1.45
+        self.capture_engine = capture_engine
+        self.image_writer = image_writer
+        self.frame_cache = frame_cache
+        self.serial_port = serial_port
+        # Camera config, see camera_profiles.py
+        self.top_down_profile = "top_down"
+        self.side_view_profile = "side_view"
+        self.side_view_scan_profile = "side_view_scan"
 
         self.app = app
+        self.preview = PreviewRenderer()
         self.model_helper = model_helper
         self.display_helper = display_helper
         self.feed = feed
+        # set from the GUI thread in batch mode
+        self._next_fastener = threading.Event()
+        self._end_batch = threading.Event()
 
     def create_label_json(self, unique_id):
         """Creates json label for specific imaging run. any variables not entered into the GUI will be `None`."""
@@ -90,6 +217,8 @@ class CameraWorker(QtCore.QObject):
             "topdown_included": TOPDOWN_INCLUDED,
             "sideon_included": SIDEON_INCLUDED,
             "number_sideon": NUMBER_SIDEON,
+            "capture_mode": "continuous_scan" if CONTINUOUS_SCAN else "stepped",
+            "image_codec": self.image_writer.codec.name,
             "attributes":{}
         }
         if label_json["fastener_type"] == "screw":
@@ -178,7 +307,65 @@ class CameraWorker(QtCore.QObject):
             f.write(report_string)
 
     def run(self):
+        """Images a single fastener."""
+        # establish serial communication with Bluepill
+        with FramedSerialTransport(self.serial_port) as link:
+            self.image_fastener(link)
+        self.finished.emit()
+
+    def run_batch(self):
+        """
+        Images fastener after fastener over one serial link, with the camera
+        streaming and the writer pool up throughout, until end_batch() is called.
+        upload is emitted for each fastener and its review and upload carry on
+        in the GUI while the next one is swapped in and imaged; next_fastener()
+        tells the worker the next one is in place.
+        """
+        self._next_fastener.clear()
+        self._end_batch.clear()
+        with FramedSerialTransport(self.serial_port) as link:
+            while not self._end_batch.is_set():
+                self.image_fastener(link)
+                self._next_fastener.wait()
+                self._next_fastener.clear()
+        self.finished.emit()
+
+    def next_fastener(self):
+        self._next_fastener.set()
+
+    def end_batch(self):
+        self._end_batch.set()
+        # also wakes a worker waiting for the next fastener
+        self._next_fastener.set()
+
+    def save_frame(self, frame, n, fastener_directory, fastener_uuid):
+        """Preview, cache and queue picture n of the fastener for writing."""
+        # flip image on both axes (i.e. rotate 180 deg)
+        # this also copies the frame out of the capture engine's buffer ring
+        with span("flip"):
+            frame_cv2 = cv2.flip(frame.image, -1)
+
+        # Only a thumbnail goes over to the GUI thread
+        with span("preview emit"):
+            thumbnail = self.preview.render(frame_cv2)
+            self.progress.emit(thumbnail)
+        # Keep what the review screen needs in memory, it then doesn't re-read the files
+        review_size = (int(frame_cv2.shape[1] * REVIEW_PERCENTAGE / 100),
+                       int(frame_cv2.shape[0] * REVIEW_PERCENTAGE / 100))
+        with span("review cache"):
+            self.frame_cache.put(fastener_directory, ("review", n),
+                                 cv2.resize(thumbnail, review_size, interpolation=cv2.INTER_AREA))
+        if self.feed:
+            # every view goes through the model in one call once the fastener is done
+            self.frame_cache.put(fastener_directory, ("inference", n), frame_cv2)
+        final_filename = os.path.join(
+            fastener_directory, f"{n}_{fastener_uuid}{self.image_writer.codec.extension}")
+        # encoded and saved in the background, the frame is already safe in memory
+        self.image_writer.submit(final_filename, frame_cv2, group=fastener_directory)
+
+    def image_fastener(self, link):
         global FIRST_TIME_SETUP
+        start = time.monotonic()
         if FIRST_TIME_SETUP:
             self.setup_imaging_directory()
             self.create_report_md()
@@ -188,101 +375,170 @@ class CameraWorker(QtCore.QObject):
         fastener_directory = self.setup_fastener_directory(fastener_uuid)
 
         # Calibrate camera before starting camera loop
-        print("before")
-        self.change_camera_settings.emit(CAMERA, self.top_down_exposure_us, self.top_down_balance_red, self.top_down_balance_blue)
+        # change_camera_profile is a blocking connection, emit() returns once the profile is applied
+        with span("settings change"):
+            self.change_camera_profile.emit(self.top_down_profile)
         side_view_exposure = False
-        print("Waiting for camera settings to finish")
-        # Wait 2s for the setup to finish (.emit() is multithreaded)
-        time.sleep(2)
 
-        print("Starting Loop")
         n = 0
-        # establish serial communication with Bluepill
-        s = serial.Serial("/dev/ttyUSB0", 115200)
-        # commence the imaging session with the "start" command
-        time.sleep(1)
-        print(s.write(b"start\n"))
-        s.flush()
-        while True:
-            # Change camera settings AFTER taking top-down shot
-            if n == 1 and not side_view_exposure:
-                print("sf")
-                time.sleep(2)
-                self.change_camera_settings.emit(CAMERA, 
-                        self.side_view_exposure_us, self.side_view_balance_red, self.side_view_balance_blue)
-                # Error occurred with repeatedly running this fcn
-                # So, we set this flag immediately after
-                side_view_exposure = True
-                # Wait 2s for the setup to finish (.emit() is multithreaded)
-                time.sleep(2)
-            if n >= 10:
-                break
-
-            # wait on serial communication
-            # to get around serial comms (ie test w/o bluepill), swap this if-statement with "if True"
-            # and replace "message" with "picture\r\n"
-            # if True:
-            if s.in_waiting > 0:
-                time.sleep(1)
-                # message = "picture\r\n"
-                message = s.readline().decode("ascii")
-                if message == "picture\r\n":
-                    print("Obtaining Frame")
-                    # requirement that Vimba instance is opened using "with"
-                    with Vimba.get_instance() as vimba:
-                        with CAMERA as cam:
-                            # set frame capture timeout at max exposure time
-                            try:
-                                frame = cam.get_frame(timeout_ms=1000000)
-                            except VimbaTimeout as e:
-                                print("Frame acquisition timed out: " + str(e))
-                                continue
-                            print("Got a frame")
-                            print("Frame saved to mem")
-                            
-                            frame_cv2 = frame.as_opencv_image()
-                            # flip image on both axes (i.e. rotate 180 deg)
-                            frame_cv2 = cv2.flip(frame_cv2, -1)
-
-                            # Draw directly
-                            print("Drawing")
-                            self.progress.emit(frame_cv2)
-                            print("Done Drawing")
-                            final_filename = os.path.join(
-                                fastener_directory, f"{n}_{fastener_uuid}.tiff")
-                            print(final_filename)
-                            cv2.imwrite(final_filename, frame_cv2)
+        # plane angle of each picture, when the firmware reports it, and the views never received
+        angles = {}
+        missing = []
+        try:
+            # commence the imaging session with the "start" command,
+            # the first picture request acknowledges it
+            if HARDWARE_TRIGGER:
+                # the frames of this fastener are numbered from the first pulse on
+                self.capture_engine.begin_sequence(1 + NUMBER_SIDEON)
+            with span("serial round trip"):
+                message = link.request("start", "picture", "triggered")
+            while True:
+                # Change camera settings AFTER taking top-down shot
+                if n == 1 and not side_view_exposure:
+                    with span("settings change"):
+                        self.change_camera_profile.emit(self.side_view_profile)
+                    # Error occurred with repeatedly running this fcn
+                    # So, we set this flag immediately after
+                    side_view_exposure = True
+                if n >= 10:
+                    break
+
+                if message == "picture":
+                    # the camera is already open and streaming, this only triggers an exposure
+                    try:
+                        with span("exposure wait"):
+                            if ACK_ON_EXPOSURE_END:
+                                self.capture_engine.expose()
+                            else:
+                                frame = self.capture_engine.capture()
+                    except CaptureTimeout as e:
+                        # the firmware holds position until it gets "finished", so just try again
+                        print("Frame acquisition timed out: " + str(e))
+                        continue
+
+                    if ACK_ON_EXPOSURE_END:
+                        # the sensor is done, the arm or turntable moves while the frame is read out and saved
+                        with span("serial round trip"):
+                            link.send("finished")
+                        try:
+                            with span("readout wait"):
+                                frame = self.capture_engine.collect()
+                        except CaptureTimeout as e:
+                            # too late to retake it, the firmware has moved on
+                            print(f"Picture {n} was exposed but never arrived: {e}")
                             n += 1
-                            # send a message to indicate a picture was saved
-                            s.write(b"finished\n")
-                            s.flush()
+                            with span("motion wait"):
+                                message = link.next_message(timeout_s=ACK_TIMEOUT_S)
+                            continue
+
+                    self.save_frame(frame, n, fastener_directory, fastener_uuid)
+                    n += 1
+                    if not ACK_ON_EXPOSURE_END:
+                        # send a message to indicate a picture was taken, returns once the firmware acked it
+                        with span("serial round trip"):
+                            link.send("finished")
+
+                elif message == "triggered":
+                    # the camera was already triggered by the Bluepill, the payload says at which pose
+                    pose = link.payload[0] if link.payload else n
+                    if pose != n:
+                        print(f"Bluepill triggered pose {pose}, expected {n}")
+                    n = pose
+                    # the plane angle follows in hundredths of a degree, if it is known
+                    angle = int.from_bytes(link.payload[1:3], "big") / 100 if len(link.payload) >= 3 else None
+                    # on-the-fly views don't wait for anything, there is no "finished" for them
+                    scanned = CONTINUOUS_SCAN and n > 0
+                    if not scanned:
+                        try:
+                            with span("exposure wait"):
+                                self.capture_engine.expose_sequence(n)
+                        except CaptureTimeout as e:
+                            # the firmware can't retrigger without "finished", don't hold it up
+                            print(f"Exposure {n} never ended: {e}")
+                        if n == 0:
+                            # the next pulse comes as soon as the turntable stops, change settings first
+                            with span("settings change"):
+                                self.change_camera_profile.emit(
+                                    self.side_view_scan_profile if CONTINUOUS_SCAN else self.side_view_profile)
+                            side_view_exposure = True
+                        with span("serial round trip"):
+                            link.send("finished")
+                    try:
+                        with span("readout wait"):
+                            # the plane has already moved on from a lost on-the-fly view, don't wait minutes
+                            frame = self.capture_engine.collect_sequence(
+                                n, timeout_s=scan_view_timeout_s() if scanned else FRAME_TIMEOUT_S)
+                    except CaptureTimeout as e:
+                        print(f"Picture {n} was triggered but never arrived: {e}")
+                        missing.append(n)
+                    else:
+                        self.save_frame(frame, n, fastener_directory, fastener_uuid)
+                        if angle is not None:
+                            angles[n] = angle
+                    n += 1
 
-                elif message == "finished-imaging\r\n":
+                elif message == "finished-imaging":
                     # exit the control loop
                     break
 
+                # wait on the next request from the Bluepill
+                with span("motion wait"):
+                    message = link.next_message(timeout_s=ACK_TIMEOUT_S)
+        except SerialTimeout as e:
+            print("Lost contact with the Bluepill: " + str(e))
+        if angles or missing:
+            add_view_angles_to_label(fastener_directory, angles, missing)
+
+        # Only hand over to the review screen once every image is on disk
+        with span("writer wait"):
+            results = self.image_writer.wait_for_group(fastener_directory)
+        for result in results:
+            if result.error is not None:
+                print(f"{result.path} was not saved: {result.error}")
+        RECORDER.record("fastener", start, time.monotonic())
         self.upload.emit(fastener_directory)
-        self.finished.emit()
+        return fastener_directory
 
 
 class My_App(QtWidgets.QMainWindow):
     def __init__(self):
         super(My_App, self).__init__()
-        loadUi("./data_collection.ui", self)
+        load_ui(UI_FILE, self)
 
         # Dynamically create certain custom widgets and add it to layout (PyQtDesigner can't put it in natively)
         self.screw_length_imperial_double = CustomDoubleSpinBox()
         self.horizontalLayout_25.addWidget(self.screw_length_imperial_double)
 
         # Obtaining camera and applying default settings
-        with Vimba.get_instance() as vimba:
-            cams = vimba.get_all_cameras()
-        if not cams:
-            raise Exception("No Cameras accessible. Abort.")
-        self.cam = cams[0]
+        if SIMULATE_CAMERA:
+            self.cam = SimulatedCamera()
+        else:
+            with Vimba.get_instance() as vimba:
+                cams = vimba.get_all_cameras()
+            if not cams:
+                raise Exception("No Cameras accessible. Abort.")
+            self.cam = cams[0]
         global CAMERA
         CAMERA = self.cam
         self.setup_camera(self.cam)
+        # Only writes the features that differ from what's already on the camera
+        self.camera_profiles = CameraProfileManager(self.cam)
+        if os.path.exists(CAMERA_PROFILES_FILE):
+            self.camera_profiles.load(CAMERA_PROFILES_FILE)
+        if USE_CAMERA_USER_SETS:
+            self.camera_profiles.provision_user_sets(record_file=CAMERA_USER_SETS_FILE)
+        self.camera_profiles.apply("auto")
+        # Opened on the first imaging run and kept streaming until the app closes
+        self.capture_engine = None
+        self.image_writer = ImageWriter(codec=IMAGE_CODEC)
+        self.frame_cache = FrameCache()
+
+        self.fake_bluepill = None
+        self.serial_port = SERIAL_PORT
+        if SIMULATE_BLUEPILL:
+            self.fake_bluepill = FakeBluepill(framed=True)
+            self.fake_bluepill.start()
+            self.serial_port = self.fake_bluepill.port
 
         # The order of fields put in here determines the order in the filename.
         self.filename_variables = OrderedDict()
@@ -308,6 +564,12 @@ class My_App(QtWidgets.QMainWindow):
         )
         self.start_imaging_button.clicked.connect(
             self.start_imaging_thread)
+        self.start_batch_button.clicked.connect(self.start_batch_thread)
+        self.next_fastener_button.clicked.connect(self.next_batch_fastener)
+        self.end_batch_button.clicked.connect(self.end_batch)
+        self.batch_fasteners = 0
+        self.batch_active = False
+        self.camera_thread = None
 
         # Assign buttons for labeling
         self.FastenerTypeGroup.buttonClicked.connect(
@@ -366,6 +628,25 @@ class My_App(QtWidgets.QMainWindow):
 
         self.model_helper = None
         self.display_helper = None
+        # started with the model, runs the detector off the GUI thread
+        self.inference_service = None
+        # (boxes, labels, scores) of each view of the fastener under review
+        self.view_predictions = []
+        # fasteners the model hasn't finished with, and the upload destinations held back
+        # until it has so the prediction goes up with the label json
+        self.inference_pending = set()
+        self.held_uploads = {}
+
+        self.upload_manager = UploadManager(UPLOAD_QUEUE_FILE, manifest=UploadManifest(UPLOAD_MANIFEST_FILE))
+        self.upload_manager.progress.connect(self.show_upload_progress)
+        self.upload_manager.uploaded.connect(self.show_upload_complete)
+        self.upload_manager.failed.connect(self.show_upload_failed)
+        self.upload_manager.start()
+
+        self.save_trace_button.clicked.connect(self.save_chrome_trace)
+        self.metrics_timer = QtCore.QTimer(self)
+        self.metrics_timer.timeout.connect(self.update_metrics_panel)
+        self.metrics_timer.start(METRICS_REFRESH_MS)
 
     def assign_height(self, height_text):
         self.filename_variables["height"] = height_text
@@ -521,31 +802,150 @@ class My_App(QtWidgets.QMainWindow):
             self.fastener_filename.setText(text)
 
     def start_feed_thread(self):
+        if not self.load_model():
+            return
         self.start_imaging_thread(feed=True)
+
+    def load_model(self):
+        if self.model_helper is not None:
+            return True
+        if MODEL_PATH is None:
+            self.statusbar.showMessage("No model configured, set MODEL_PATH to image with inference")
+            return False
+        self.statusbar.showMessage(f"Loading {MODEL_PATH}...")
+        QtWidgets.QApplication.processEvents()
+        # deferred, this is what pulls in torch, torchvision and matplotlib
+        from utils import ModelHelper, DisplayHelper
+        with span("model load"):
+            self.model_helper = ModelHelper(MODEL_PATH)
+        self.display_helper = DisplayHelper()
+        self.inference_service = InferenceService(self.model_helper, self.display_helper)
+        self.inference_service.result.connect(self.show_inference_result)
+        self.inference_service.failed.connect(self.show_inference_failed)
+        self.inference_service.queue_changed.connect(self.show_inference_queue)
+        self.inference_service.start()
+        self.statusbar.clearMessage()
+        return True
     
-    def start_imaging_thread(self, feed=False):
+    def start_capture_engine(self):
+        if self.capture_engine is None:
+            backend = self.cam if SIMULATE_CAMERA else VimbaCameraBackend(
+                self.cam, trigger_line=TRIGGER_LINE if HARDWARE_TRIGGER else None)
+            if not SIMULATE_CAMERA:
+                # the user sets were saved with the trigger off, see CameraProfileManager
+                self.camera_profiles.user_set_loaded.connect(backend.restore_settings)
+            self.capture_engine = CaptureEngine(backend)
+        self.capture_engine.start()
+
+    def closeEvent(self, event):
+        camera_thread = self.camera_thread
+        if camera_thread is not None:
+            if self.batch_active:
+                self.worker.end_batch()
+            camera_thread.quit()
+            # keep the GUI thread going, the worker blocks on it for profile changes
+            while not camera_thread.wait(50):
+                QtWidgets.QApplication.processEvents()
+        if self.capture_engine is not None:
+            self.capture_engine.stop()
+        if self.fake_bluepill is not None:
+            self.fake_bluepill.stop()
+        self.image_writer.close()
+        if self.inference_service is not None:
+            self.inference_service.stop()
+        # uploads still waiting on the model go without a prediction
+        for image_directory in list(self.held_uploads):
+            self.release_held_upload(image_directory)
+        # anything still queued is picked up again on the next start
+        self.upload_manager.stop()
+        if CHROME_TRACE_FILE:
+            RECORDER.dump_chrome_trace(CHROME_TRACE_FILE)
+        super(My_App, self).closeEvent(event)
+
+    def start_batch_thread(self):
+        self.start_imaging_thread(batch=True)
+
+    def start_imaging_thread(self, feed=False, batch=False):
         self.feed = feed
-        print(f"{feed=}")
+        self.start_capture_engine()
         self.camera_thread = QtCore.QThread()
         self.worker = CameraWorker(self.fastener_filename.text(),
+                                   self.capture_engine,
+                                   self.image_writer,
+                                   self.frame_cache,
+                                   serial_port = self.serial_port,
                                    model_helper = self.model_helper,
                                    display_helper = self.display_helper,
                                    feed = feed, app=self)
         self.worker.moveToThread(self.camera_thread)
         # Connect signals/slots
-        self.camera_thread.started.connect(self.worker.run)
         self.worker.progress.connect(self.draw_image_on_gui)
-        self.worker.change_camera_settings.connect(self.setup_camera)
-        self.worker.upload.connect(self.ask_user_for_upload_decision)
+        # Blocking so the worker only carries on once the new settings are applied
+        self.worker.change_camera_profile.connect(self.camera_profiles.apply, QtCore.Qt.BlockingQueuedConnection)
+        if batch:
+            self.camera_thread.started.connect(self.worker.run_batch)
+            self.worker.upload.connect(self.review_batch_fastener)
+            self.worker.finished.connect(self.batch_finished)
+            self.batch_fasteners = 0
+            self.batch_active = True
+            self.batch_group.setEnabled(True)
+            self.next_fastener_button.setEnabled(False)
+            self.start_batch_button.setEnabled(False)
+            self.start_imaging_button.setEnabled(False)
+            self.batch_status_label.setText("Imaging fastener 1")
+        else:
+            self.camera_thread.started.connect(self.worker.run)
+            self.worker.upload.connect(self.ask_user_for_upload_decision)
         self.worker.finished.connect(self.camera_thread.quit)
         self.worker.finished.connect(self.worker.deleteLater)
         self.camera_thread.finished.connect(self.camera_thread.deleteLater)
+        self.camera_thread.finished.connect(self.imaging_thread_finished)
         self.camera_thread.start()
 
         # switch to camera tab
         self.tabWidget.setCurrentIndex(1)
 
 
+    def review_batch_fastener(self, image_directory):
+        # No upload decision in batch mode, the thumbnails are shown and the fastener is
+        # queued for upload while the worker waits for the next one
+        global CURRENT_STAGED_IMAGE_FOLDER
+        CURRENT_STAGED_IMAGE_FOLDER = image_directory
+        _, pixmaps = build_review_pixmaps(image_directory, self.frame_cache)
+        # nothing else reads this fastener's frames back from the cache
+        self.frame_cache.drop(image_directory)
+        photo_labels = [self.photo1, self.photo2, self.photo3, self.photo4,
+                        self.photo5, self.photo6, self.photo7, self.photo8,
+                        self.photo9]
+        for pixmap, label in zip(pixmaps, photo_labels):
+            label.setPixmap(pixmap)
+        self.upload_single_fastener_to_gdrive()
+        self.batch_fasteners += 1
+        self.batch_status_label.setText(
+            f"{self.batch_fasteners} imaged, swap in the next fastener and press Next Fastener")
+        self.next_fastener_button.setEnabled(True)
+
+    def next_batch_fastener(self):
+        self.next_fastener_button.setEnabled(False)
+        self.batch_status_label.setText(f"Imaging fastener {self.batch_fasteners + 1}")
+        self.worker.next_fastener()
+
+    def end_batch(self):
+        self.batch_group.setEnabled(False)
+        self.batch_status_label.setText("Finishing the batch")
+        self.worker.end_batch()
+
+    def batch_finished(self):
+        self.batch_active = False
+        self.batch_group.setEnabled(False)
+        self.start_batch_button.setEnabled(True)
+        self.start_imaging_button.setEnabled(True)
+        self.batch_status_label.setText(f"Batch done, {self.batch_fasteners} fasteners imaged")
+
+    def imaging_thread_finished(self):
+        # the thread deletes itself once it is done
+        self.camera_thread = None
+
     def redo_imaging(self):
         # May contain more cleanup later
         self.start_imaging_thread()
@@ -554,30 +954,26 @@ class My_App(QtWidgets.QMainWindow):
         global CURRENT_STAGED_IMAGE_FOLDER
         CURRENT_STAGED_IMAGE_FOLDER = image_directory
         # draw images on the page
-        images = [os.path.join(image_directory, x)
-                  for x in sorted(os.listdir(image_directory))
-                  if x.endswith(".tiff")]
-        print(images)
+        images, pixmaps = build_review_pixmaps(image_directory, self.frame_cache)
         # photo_labels corresponds to squares within the GUI
         photo_labels = [self.photo1, self.photo2, self.photo3, self.photo4,
                         self.photo5, self.photo6, self.photo7, self.photo8,
                         self.photo9]
-        for img, label in zip(images, photo_labels):
-            image = cv2.imread(img)
-            resized_photo = self.resize_cv_photo(image, 7)
-            pixmap = self.convert_cv_to_pixmap(resized_photo)
+        for pixmap, label in zip(pixmaps, photo_labels):
             label.setPixmap(pixmap)
 
         if self.feed:
-            image = cv2.imread(images[0])
-            print("Starting inference...")
-            frame_cv2 = self.display_helper.crop_scale(image, scale=0.7)
-            prediction = self.model_helper.predict_single_image(frame_cv2, score_threshold=0.5)
-
-            frame_cv2 = self.display_helper.draw_prediction(frame_cv2, prediction, self.model_helper.mapping)
-            resized_photo = self.resize_cv_photo(frame_cv2, 20)
-            pixmap = self.convert_cv_to_pixmap(resized_photo)
-            self.camera_feed.setPixmap(pixmap)
+            views = []
+            for image_path in images:
+                n = int(os.path.basename(image_path).split("_")[0])
+                image = self.frame_cache.get(image_directory, ("inference", n))
+                # a cache miss is read from the file on the inference thread
+                views.append(image if image is not None else image_path)
+            self.view_predictions = []
+            self.inference_pending.add(image_directory)
+            self.inference_service.submit(image_directory, views)
+        # the pixmaps are built and the inference request holds its own views
+        self.frame_cache.drop(image_directory)
 
         self.DriveUploadConfirmStack.setCurrentIndex(0)
         self.tabWidget.setCurrentIndex(2)
@@ -593,56 +989,92 @@ class My_App(QtWidgets.QMainWindow):
         #    `                               '   
 
     def upload_all_sessions_to_gdrive(self):
-        # TODO Multithread this
-        # do an upload of all sessions. Will only push files that have changed compared to what's in the cloud.
+        # do an upload of all sessions. Will only push files that aren't in the upload manifest yet,
+        # so files changed directly on the drive are not overwritten
         image_directory = TOP_IMAGES_FOLDER
         upload_path = os.path.join(REMOTE_IMAGE_FOLDER)
-        print(f"Uploading to Drive. Path: {upload_path}")
+        print(f"Queueing upload to Drive. Path: {upload_path}")
         print(f"On-device path: {image_directory}")
-        try:
-            rclone.copy(image_directory, upload_path)
-        except UnicodeDecodeError as uni_e:
-            print(str(uni_e))
-            print("Error. Wait a few seconds and click 'Upload to Google Drive' again. Consult code for Kenneth commentary.")
-            print("If upload continues to fail after multiple retries, try typing this into your command line:")
-            print(f"rclone copy {image_directory} {upload_path}")
-            return
-            # Kenneth commentary: I think it's something to do with the image data not getting flushed to the file, so the copy() function finds files that are empty.
-            # I find that it always works after I retry a few times, so it's not a high-prio bug.
-        except Exception as e:
-            print(str(e))
-            print("You probably need to refresh the token with rclone config. Consult the README for a guide on how to do so.")
-            return
-        print(f"Upload complete")
+        self.upload_manager.enqueue(image_directory, upload_path)
         self.DriveUploadConfirmStack.setCurrentIndex(1)
 
     def upload_single_fastener_to_gdrive(self):
-        # TODO multithread this.
         # Split input so the gdrive only has the imaging_test_../ folder,
         # and we don't upload the images/ parent folder too
         image_directory = CURRENT_STAGED_IMAGE_FOLDER
         session_folder = os.path.split(FULL_SESSION_PATH)[-1]
         lowest_level_folder = os.path.split(image_directory)[-1]
         upload_path = os.path.join(REMOTE_IMAGE_FOLDER, session_folder, lowest_level_folder)
-        print(f"Uploading to Drive. Path: {upload_path}")
         print(f"On-device path: {image_directory}")
-        try:
-            rclone.copy(image_directory, upload_path)
-        except UnicodeDecodeError as uni_e:
-            print(str(uni_e))
-            print("Error. Wait a few seconds and click 'Upload to Google Drive' again. Consult code for Kenneth commentary.")
-            print("If upload continues to fail after multiple retries, try typing this into your command line:")
-            print(f"rclone copy {image_directory} {upload_path}")
-            return
-            # Kenneth commentary: I think it's something to do with the image data not getting flushed to the file, so the copy() function finds files that are empty.
-            # I find that it always works after I retry a few times, so it's not a high-prio bug.
-        except Exception as e:
-            print(str(e))
-            print("You probably need to refresh the token with rclone config. Consult the README for a guide on how to do so.")
-            return
-        print(f"Upload complete")
+        if image_directory in self.inference_pending:
+            print(f"Holding upload to Drive until inference is done. Path: {upload_path}")
+            self.held_uploads[image_directory] = upload_path
+        else:
+            print(f"Queueing upload to Drive. Path: {upload_path}")
+            self.upload_manager.enqueue(image_directory, upload_path)
         self.DriveUploadConfirmStack.setCurrentIndex(1)
 
+    def release_held_upload(self, image_directory):
+        self.inference_pending.discard(image_directory)
+        upload_path = self.held_uploads.pop(image_directory, None)
+        if upload_path is not None:
+            print(f"Queueing upload to Drive. Path: {upload_path}")
+            self.upload_manager.enqueue(image_directory, upload_path)
+
+    def show_upload_progress(self, source, fraction):
+        self.statusbar.showMessage(
+            f"Uploading {os.path.basename(source)}: {fraction:.0%} ({self.upload_manager.pending()} queued)")
+
+    def show_upload_complete(self, source):
+        self.statusbar.showMessage(
+            f"Uploaded {os.path.basename(source)} ({self.upload_manager.pending()} queued)")
+
+    def show_upload_failed(self, source, error):
+        # The job stays in UPLOAD_QUEUE_FILE and is retried when the app is restarted
+        print(error)
+        print("You probably need to refresh the token with rclone config. Consult the README for a guide on how to do so.")
+        self.statusbar.showMessage(f"Upload of {os.path.basename(source)} failed, will retry on restart: {error}")
+
+    def show_inference_result(self, image_directory, predictions, prediction, annotated):
+        add_prediction_to_label(image_directory, prediction)
+        self.release_held_upload(image_directory)
+        if image_directory != CURRENT_STAGED_IMAGE_FOLDER:
+            # the operator has moved on to another fastener
+            return
+        self.view_predictions = predictions
+        if prediction["label"] is not None:
+            self.statusbar.showMessage(f"Predicted {prediction['label']} ({prediction['score']:.2f}), "
+                                       f"detected in {prediction['views_detected']}/{prediction['views']} views")
+        resized_photo = self.resize_cv_photo(annotated, 20)
+        pixmap = self.convert_cv_to_pixmap(resized_photo)
+        self.camera_feed.setPixmap(pixmap)
+
+    def show_inference_failed(self, image_directory, error):
+        self.statusbar.showMessage(f"Inference on {os.path.basename(image_directory)} failed: {error}")
+        self.release_held_upload(image_directory)
+
+    def show_inference_queue(self, pending):
+        self.inference_queue_label.setText(
+            f"Inference queue: {pending} ({self.inference_service.dropped} dropped)")
+
+    def update_metrics_panel(self):
+        spans = RECORDER.spans(since=time.monotonic() - METRICS_WINDOW_S)
+        rate = fasteners_per_hour(spans)
+        self.fasteners_per_hour_label.setText(f"Fasteners/hour: {rate:.1f}" if rate else "Fasteners/hour: -")
+        summary = summarize(spans)
+        self.metrics_table.setRowCount(len(summary))
+        for row, (name, stats) in enumerate(summary.items()):
+            cells = [name, f"{stats['p50_ms']:.1f}", f"{stats['p95_ms']:.1f}", f"{stats['max_ms']:.1f}",
+                     str(stats["count"])]
+            for column, text in enumerate(cells):
+                self.metrics_table.setItem(row, column, QtWidgets.QTableWidgetItem(text))
+
+    def save_chrome_trace(self):
+        path, _ = QtWidgets.QFileDialog.getSaveFileName(self, "Save Chrome trace", "trace.json", "JSON (*.json)")
+        if path:
+            RECORDER.dump_chrome_trace(path)
+            self.statusbar.showMessage(f"Trace saved to {path}")
+
     def reset_filename_variables(self):
         # Reset variables for the next thread imaging suite
         for key in self.filename_variables:
@@ -651,42 +1083,13 @@ class My_App(QtWidgets.QMainWindow):
         # Unclick all buttons? No need?
         return
 
-    def setup_camera(self, cam: Camera, exposure_us=None, balance_red=None, balance_blue=None):
-        print("setup")
-        with Vimba.get_instance() as vimba:
+    def setup_camera(self, cam):
+        # One-off setup, exposure and white balance are set through self.camera_profiles
+        if isinstance(cam, SimulatedCamera):
+            # nothing to open through Vimba, and it only ever hands out Bgr8 frames
+            return
+        with span("setup camera"), Vimba.get_instance() as vimba:
             with cam:
-                # Enable auto exposure time setting if camera supports it
-                try:
-                    print("exposure")
-                    # If exposure_us is set, manually change exposure value
-                    if isinstance(exposure_us, int):
-                        cam.ExposureAuto.set("Off")
-                        cam.ExposureTime.set(exposure_us)
-                    else:
-                        cam.ExposureAuto.set("Continuous")
-
-                except (AttributeError, VimbaFeatureError) as e:
-                    print("error:" + str(e))
-                    pass
-
-                # Enable white balancing if camera supports it
-                try:
-                    print("balance")
-                    # If balance is set, manually change white balance value
-                    if isinstance(balance_red, float):
-                        cam.BalanceWhiteAuto.set("Off")
-                        cam.BalanceRatioSelector.set("Red")
-                        cam.BalanceRatio.set(balance_red)
-                    if isinstance(balance_blue, float):
-                        cam.BalanceWhiteAuto.set("Off")
-                        cam.BalanceRatioSelector.set("Blue")
-                        cam.BalanceRatio.set(balance_blue)
-                    else:
-                        cam.BalanceWhiteAuto.set("Continuous")
-
-                except (AttributeError, VimbaFeatureError):
-                    pass
-
                 # Try to adjust GeV packet size. This Feature is only available for GigE - Cameras.
                 try:
                     cam.GVSPAdjustPacketSize.run()
@@ -717,18 +1120,12 @@ class My_App(QtWidgets.QMainWindow):
                         raise Exception(
                             "Camera does not support a OpenCV compatible format natively.")
 
-    def draw_image_on_gui(self, frame):
-        resized_photo = self.resize_cv_photo(frame, 20)
-        pixmap = self.convert_cv_to_pixmap(resized_photo)
-        self.camera_feed.setPixmap(pixmap)
+    def draw_image_on_gui(self, thumbnail):
+        # already downsampled by the worker's PreviewRenderer
+        self.camera_feed.setPixmap(bgr_to_pixmap(thumbnail))
 
     def convert_cv_to_pixmap(self, cv_img):
-        cv_img = cv2.cvtColor(cv_img, cv2.COLOR_BGR2RGB)
-        height, width, channel = cv_img.shape
-        bytesPerLine = channel * width
-        q_img = QtGui.QImage(cv_img.data, width, height,
-                             bytesPerLine, QtGui.QImage.Format_RGB888)
-        return QtGui.QPixmap.fromImage(q_img)
+        return bgr_to_pixmap(cv_img)
 
     def resize_cv_photo(self, cv_img, percentage):
         width = int(cv_img.shape[1] * percentage / 100)
@@ -0,0 +1,370 @@
+import collections
+import math
+import os
+import random
+import select
+import threading
+import time
+import tty
+
+from instrumentation import RECORDER
+from serial_protocol import FrameLink
+from serial_transport import SerialTimeout
+
+# Motion of the real station, see fw/src/core/motion.cpp, servo.cpp and stepper.cpp.
+# Both axes follow a trapezoidal profile, the servo's top speed is still that of the
+# old ramp of SERVO_STEP_DEG at a time with a delay(30) in between.
+SERVO_STEP_DEG = 2
+SERVO_STEP_S = 0.030
+SERVO_ACCEL_DPS2 = 1000
+STEPPER_ACCEL_SPS2 = 8000
+ARM_UP_ANGLE = 15
+ARM_DOWN_ANGLE = 160
+# 400 step motor, stepper_rotate(angle) does angle * 6 / 0.9 steps
+STEPPER_STEPS = 400
+STEPPER_STEP_ANGLE = 0.9
+STEPPER_GEAR_RATIO = 6
+STEPPER_RPM = 100
+PLANE_STEP_ANGLE = 180
+# The plane is done after this many degrees (8 moves, 9 side-on pictures)
+PLANE_END_ANGLE = 360 * 4
+# CONTINUOUS_SCAN: side-on views taken in one turn of PLANE_END_ANGLE without stopping
+SCAN_VIEWS = 9
+SCAN_RPM = 100
+# How often the main loop checks the port while waiting, like the firmware's loop()
+LOOP_POLL_S = 0.01
+
+# state_t in fw/src/main.cpp
+ROT_ARM = "ROT_ARM"
+ROT_PLANE = "ROT_PLANE"
+WAIT_ON_MOTION = "WAIT_ON_MOTION"
+WAIT_ON_PIC = "WAIT_ON_PIC"
+TAKE_PIC = "TAKE_PIC"
+WAIT_ON_RPI = "WAIT_ON_RPI"
+START_SCAN = "START_SCAN"
+SCAN_PLANE = "SCAN_PLANE"
+STATES = (ROT_ARM, ROT_PLANE, WAIT_ON_MOTION, WAIT_ON_PIC, TAKE_PIC, WAIT_ON_RPI, START_SCAN, SCAN_PLANE)
+
+
+def trapezoid_s(distance, speed, accel):
+    """Time to cover distance from standstill to standstill, accelerating and braking at accel."""
+    if distance >= speed * speed / accel:
+        return distance / speed + speed / accel
+    # never reaches full speed
+    return 2 * math.sqrt(distance / accel)
+
+
+def servo_move_s(start, end, step_deg=SERVO_STEP_DEG, step_s=SERVO_STEP_S):
+    """Duration of servo_moveTo."""
+    return trapezoid_s(abs(end - start), step_deg / step_s, SERVO_ACCEL_DPS2)
+
+
+def stepper_steps(angle):
+    """stepper_toSteps"""
+    return int(angle * STEPPER_GEAR_RATIO / STEPPER_STEP_ANGLE)
+
+
+def stepper_move_s(angle, rpm=STEPPER_RPM):
+    """Duration of stepper_move, cruising at what the Arduino Stepper library would do at rpm."""
+    return trapezoid_s(stepper_steps(angle), STEPPER_STEPS * rpm / 60, STEPPER_ACCEL_SPS2)
+
+
+def reach_s(distance, speed, accel):
+    """Time from standstill to distance into a move, before it starts braking."""
+    if distance <= speed * speed / (2 * accel):
+        return math.sqrt(2 * distance / accel)
+    return speed / accel + (distance - speed * speed / (2 * accel)) / speed
+
+
+def scan_ramp(rpm=SCAN_RPM):
+    """Steps stepper_scan adds at either end of the turn to get up to speed and stop."""
+    speed = STEPPER_STEPS * rpm / 60
+    return int(speed * speed / (2 * STEPPER_ACCEL_SPS2)) + 1
+
+
+def scan_plan(angle=PLANE_END_ANGLE, views=SCAN_VIEWS, rpm=SCAN_RPM):
+    """
+    stepper_scan: the positions (in steps) views are triggered at, when after
+    the start of the move they are reached, and how long the whole move takes.
+    """
+    steps = stepper_steps(angle)
+    speed = STEPPER_STEPS * rpm / 60
+    ramp = scan_ramp(rpm)
+    positions = [ramp + steps * i // views for i in range(views)]
+    times = [reach_s(position, speed, STEPPER_ACCEL_SPS2) for position in positions]
+    return positions, times, trapezoid_s(steps + 2 * ramp, speed, STEPPER_ACCEL_SPS2)
+
+
+def scan_return_s(rpm=SCAN_RPM):
+    """Duration of stepper_scanReturn."""
+    return trapezoid_s(2 * scan_ramp(rpm), STEPPER_STEPS * rpm / 60, STEPPER_ACCEL_SPS2)
+
+
+class FakeBluepill:
+    """
+    Pretends to be the Bluepill on the other end of a pseudo terminal, so
+    the imaging loop can run without the board, servo or stepper. Open
+    `port` with pyserial exactly like /dev/ttyUSB0.
+
+    The main loop mirrors the state_t machine in fw/src/main.cpp. Moves run
+    in the background for as long as the real servo and stepper would (scaled
+    by time_scale), like the firmware's motion interrupt, while the loop keeps
+    polling the port. Time spent in each state is added up in state_times.
+    Every completed fastener adds its start-to-"finished-imaging" time to
+    cycle_times, and every move is recorded as a "firmware motion" span.
+
+    It speaks the framed protocol of serial_protocol.py, like the firmware,
+    or with framed=False the old line based one. corrupt_rate flips a random
+    bit in that fraction of the bytes going either way, to exercise the CRC
+    and retransmits.
+
+    With a trigger callback it runs like firmware built with HARDWARE_TRIGGER:
+    trigger() stands in for the pulse on the camera's trigger line and the
+    host is sent "triggered" with the pose index instead of "picture".
+    Also given scan_rpm, it takes the side-on views like CONTINUOUS_SCAN
+    firmware: trigger() is called at each view's position during a single
+    turn of the plane, from a timer like the motion interrupt, and each
+    "triggered" carries the view's angle. Every view is logged in scan_log as
+    (pose, reported angle, time it was due, time it was triggered).
+    """
+
+    def __init__(self, time_scale=1.0, servo_step_deg=SERVO_STEP_DEG, servo_step_s=SERVO_STEP_S,
+                 stepper_rpm=STEPPER_RPM, framed=True, corrupt_rate=0.0, trigger=None, scan_rpm=None,
+                 scan_views=SCAN_VIEWS):
+        if scan_rpm is not None and (trigger is None or not framed):
+            raise ValueError("Scanning needs a trigger and the framed protocol, like CONTINUOUS_SCAN needs HARDWARE_TRIGGER")
+        self.time_scale = time_scale
+        self.servo_step_deg = servo_step_deg
+        self.servo_step_s = servo_step_s
+        self.stepper_rpm = stepper_rpm
+        self.received = []
+        self.pictures_requested = 0
+        self.state = WAIT_ON_RPI
+        self.state_times = dict.fromkeys(STATES, 0.0)
+        self.cycle_times = []
+        self.servo_angle = ARM_UP_ANGLE
+        self.stepper_angle = 0
+        self.trigger = trigger
+        self.pose = 0
+        self.scan_rpm = scan_rpm
+        self.scan_views = scan_views
+        self.scan_log = []
+        self._scan_steps = stepper_steps(PLANE_END_ANGLE)
+        self._scan_first = 0
+        # (position, due, triggered) of the views triggered so far, appended from the timers
+        self._scan_marks = []
+        self._scan_timers = []
+        self._scan_reported = 0
+        # time.monotonic() at which each axis stops
+        self._moving_until = {"arm": 0.0, "plane": 0.0}
+
+        self._master, self._slave = os.openpty()
+        tty.setraw(self._slave)
+        self.port = os.ttyname(self._slave)
+        self._stop = threading.Event()
+        self._thread = None
+        self._inbox = collections.deque()
+        self._line = b""
+        self._cycle_start = None
+        self.corrupt_rate = corrupt_rate
+        self._random = random.Random()
+        self.link = FrameLink(self._write) if framed else None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        for timer in self._scan_timers:
+            timer.cancel()
+        self._thread.join(timeout=1)
+        os.close(self._master)
+        os.close(self._slave)
+
+    def fasteners_per_hour(self):
+        """Throughput of the completed fasteners, counting from "start" to "finished-imaging"."""
+        if not self.cycle_times:
+            return 0.0
+        return 3600 * len(self.cycle_times) / sum(self.cycle_times)
+
+    def _corrupt(self, data):
+        if not self.corrupt_rate:
+            return data
+        data = bytearray(data)
+        for i in range(len(data)):
+            if self._random.random() < self.corrupt_rate:
+                data[i] ^= 1 << self._random.randrange(8)
+        return bytes(data)
+
+    def _write(self, data):
+        os.write(self._master, self._corrupt(data))
+
+    def send(self, message, payload=b""):
+        if self.link is not None:
+            # like the firmware, resent from the main loop until the host ACKs it
+            self.link.post(message, payload)
+        else:
+            # Serial.println terminates with "\r\n"
+            self._write(message.encode("ascii") + b"\r\n")
+
+    def _start_move(self, axis, seconds):
+        start = time.monotonic()
+        self._moving_until[axis] = start + seconds * self.time_scale
+        RECORDER.record("firmware motion", start, self._moving_until[axis])
+
+    def _motion_idle(self):
+        return time.monotonic() >= max(self._moving_until.values())
+
+    def _scan_mark(self, position, due):
+        # the motion interrupt's mark, see scan_mark in fw/src/main.cpp
+        triggered = time.monotonic()
+        self.trigger()
+        self._scan_marks.append((position, due, triggered))
+
+    def _start_scan(self):
+        positions, times, seconds = scan_plan(PLANE_END_ANGLE, self.scan_views, self.scan_rpm)
+        self._scan_first = positions[0]
+        self._scan_marks = []
+        self._scan_reported = 0
+        self._start_move("plane", seconds)
+        start = time.monotonic()
+        self._scan_timers = []
+        for position, offset in zip(positions, times):
+            timer = threading.Timer(offset * self.time_scale, self._scan_mark,
+                                    (position, start + offset * self.time_scale))
+            timer.daemon = True
+            timer.start()
+            self._scan_timers.append(timer)
+
+    def _servo_move_to(self, angle):
+        self._start_move("arm", servo_move_s(self.servo_angle, angle, self.servo_step_deg, self.servo_step_s))
+        self.servo_angle = angle
+
+    def _stepper_move(self, angle):
+        self._start_move("plane", stepper_move_s(angle, self.stepper_rpm))
+        self.stepper_angle += angle
+
+    def _poll(self):
+        """serial_pollFrame: resend an unacked frame, then return the next new message, if any."""
+        if self.link is not None:
+            try:
+                self.link.retransmit_if_due()
+            except SerialTimeout as e:
+                print(f"Fake bluepill: {e}")
+        if not self._inbox:
+            readable, _, _ = select.select([self._master], [], [], LOOP_POLL_S)
+            if readable:
+                self._read(os.read(self._master, 1024))
+        if self._inbox:
+            message = self._inbox.popleft()
+            self.received.append(message)
+            return message
+        return None
+
+    def _read(self, data):
+        data = self._corrupt(data)
+        if self.link is not None:
+            self._inbox.extend(message for message, _ in self.link.receive(data))
+            return
+        self._line += data
+        while b"\n" in self._line:
+            line, self._line = self._line.split(b"\n", 1)
+            message = line.decode("ascii", errors="replace").strip()
+            if message:
+                self._inbox.append(message)
+
+    def _loop(self):
+        # fw/src/main.cpp loop(), minus the lights and debug messages
+        if self.state == ROT_ARM:
+            self._servo_move_to(ARM_DOWN_ANGLE)
+            self.state = WAIT_ON_MOTION
+
+        elif self.state == ROT_PLANE:
+            if self.stepper_angle >= PLANE_END_ANGLE:
+                self.state = WAIT_ON_RPI
+                self.stepper_angle = 0
+                # the host carries on while the arm goes up
+                self._servo_move_to(ARM_UP_ANGLE)
+                self.send("finished-imaging")
+                self.cycle_times.append(time.monotonic() - self._cycle_start)
+            else:
+                self._stepper_move(PLANE_STEP_ANGLE)
+                self.state = WAIT_ON_MOTION
+
+        elif self.state == WAIT_ON_MOTION:
+            # keeps acking and resending while moving, nothing new is expected
+            self._poll()
+            if self._motion_idle():
+                side_on = self.servo_angle != ARM_UP_ANGLE
+                self.state = START_SCAN if side_on and self.scan_rpm is not None else TAKE_PIC
+
+        elif self.state == WAIT_ON_PIC:
+            if self._poll() == "finished":
+                if self.servo_angle == ARM_UP_ANGLE:
+                    self.state = ROT_ARM
+                elif self.stepper_angle <= PLANE_END_ANGLE:
+                    self.state = ROT_PLANE
+                else:
+                    self.state = WAIT_ON_RPI
+
+        elif self.state == TAKE_PIC:
+            self.pictures_requested += 1
+            if self.trigger is not None:
+                self.trigger()
+                self.send("triggered", bytes([self.pose]))
+            else:
+                self.send("picture")
+            self.pose += 1
+            self.state = WAIT_ON_PIC
+
+        elif self.state == WAIT_ON_RPI:
+            if self._poll() == "start":
+                self._cycle_start = time.monotonic()
+                self.pose = 0
+                # the arm may still be on its way up from the last fastener
+                self.state = WAIT_ON_MOTION
+
+        elif self.state == START_SCAN:
+            self._start_scan()
+            self.state = SCAN_PLANE
+
+        elif self.state == SCAN_PLANE:
+            self._poll()
+            if self.link.pending():
+                return
+            if self._scan_reported < len(self._scan_marks):
+                position, due, triggered = self._scan_marks[self._scan_reported]
+                # integer hundredths of a degree, as the firmware works them out
+                angle = (position - self._scan_first) * 36000 // self._scan_steps
+                self.send("triggered", bytes([self.pose]) + angle.to_bytes(2, "big"))
+                self.scan_log.append((self.pose, angle / 100, due, triggered))
+                self._scan_reported += 1
+                self.pose += 1
+            elif self._scan_reported == self.scan_views and self._motion_idle():
+                self.state = WAIT_ON_RPI
+                # turned back by the ramps while the arm goes up
+                self._start_move("plane", scan_return_s(self.scan_rpm))
+                self.stepper_angle = 0
+                self._servo_move_to(ARM_UP_ANGLE)
+                self.send("finished-imaging")
+                self.cycle_times.append(time.monotonic() - self._cycle_start)
+
+    def _run(self):
+        while not self._stop.is_set():
+            state = self.state
+            start = time.monotonic()
+            try:
+                self._loop()
+            except OSError:
+                # the pty was closed under us
+                return
+            self.state_times[state] += time.monotonic() - start
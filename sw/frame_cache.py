@@ -0,0 +1,49 @@
+import threading
+from collections import OrderedDict
+
+# Review thumbnails are tiny, this is mostly room for the full-res inference frames
+FRAME_CACHE_BYTES = 256 * 1024 * 1024
+
+
+class FrameCache:
+    """
+    In-memory images of recent fasteners, bounded by total bytes with
+    least-recently-used eviction. Entries are keyed by (fastener directory, name),
+    so the review screen can use what the worker already has in memory instead of
+    reading the images it just wrote back from disk. Callers must treat a miss as
+    normal and fall back to the file. drop() frees a fastener once the GUI has
+    built its review screen and handed its views to the model.
+    """
+
+    def __init__(self, max_bytes=FRAME_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.size_bytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def put(self, group, name, image):
+        if image.nbytes > self.max_bytes:
+            return
+        key = (group, name)
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.size_bytes -= old.nbytes
+            self._entries[key] = image
+            self.size_bytes += image.nbytes
+            while self.size_bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.size_bytes -= evicted.nbytes
+
+    def get(self, group, name):
+        key = (group, name)
+        with self._lock:
+            image = self._entries.get(key)
+            if image is not None:
+                self._entries.move_to_end(key)
+            return image
+
+    def drop(self, group):
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == group]:
+                self.size_bytes -= self._entries.pop(key).nbytes
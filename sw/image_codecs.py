@@ -0,0 +1,82 @@
+import cv2
+
+# libtiff compression tags, see IMWRITE_TIFF_COMPRESSION in the OpenCV docs
+TIFF_COMPRESSION_NONE = 1
+TIFF_COMPRESSION_LZW = 5
+TIFF_COMPRESSION_DEFLATE = 8
+TIFF_COMPRESSION_ZSTD = 50000
+# TIFF horizontal differencing predictor, helps LZW/Deflate/ZSTD a lot on camera images
+TIFF_PREDICTOR_HORIZONTAL = 2
+# WebP quality above 100 selects lossless mode
+WEBP_LOSSLESS_QUALITY = 101
+
+# cv2.imwrite(".tiff") as it always was, OpenCV compresses it with LZW by default
+DEFAULT_CODEC = "tiff"
+
+
+class ImageCodec:
+    """Lossless image format plus the OpenCV encoder parameters for it."""
+
+    def __init__(self, name, extension, params=()):
+        self.name = name
+        self.extension = extension
+        self.params = list(params)
+
+    def __repr__(self):
+        return f"ImageCodec({self.name})"
+
+    def encode(self, image):
+        ok, encoded = cv2.imencode(self.extension, image, self.params)
+        if not ok:
+            raise IOError(f"{self.name} could not encode the image")
+        return encoded
+
+    def decode(self, data):
+        return cv2.imdecode(data, cv2.IMREAD_UNCHANGED)
+
+    def save(self, path, image):
+        with open(path, "wb") as f:
+            f.write(self.encode(image))
+
+
+def _tiff(name, compression=None):
+    # None leaves the compression to OpenCV, like a plain cv2.imwrite
+    if compression is None:
+        return ImageCodec(name, ".tiff")
+    params = [cv2.IMWRITE_TIFF_COMPRESSION, compression]
+    # the predictor flag only exists in recent OpenCV builds
+    if compression != TIFF_COMPRESSION_NONE and hasattr(cv2, "IMWRITE_TIFF_PREDICTOR"):
+        params += [cv2.IMWRITE_TIFF_PREDICTOR, TIFF_PREDICTOR_HORIZONTAL]
+    return ImageCodec(name, ".tiff", params)
+
+
+def png_codec(level):
+    """PNG at zlib level 0 (fastest, largest) to 9 (slowest, smallest)."""
+    return ImageCodec(f"png-{level}", ".png", [cv2.IMWRITE_PNG_COMPRESSION, level])
+
+
+CODECS = {
+    "tiff": _tiff("tiff"),
+    "tiff-none": _tiff("tiff-none", TIFF_COMPRESSION_NONE),
+    "tiff-lzw": _tiff("tiff-lzw", TIFF_COMPRESSION_LZW),
+    "tiff-deflate": _tiff("tiff-deflate", TIFF_COMPRESSION_DEFLATE),
+    "tiff-zstd": _tiff("tiff-zstd", TIFF_COMPRESSION_ZSTD),
+    "png-1": png_codec(1),
+    "png-3": png_codec(3),
+    "png-6": png_codec(6),
+    "png-9": png_codec(9),
+    "webp-lossless": ImageCodec("webp-lossless", ".webp", [cv2.IMWRITE_WEBP_QUALITY, WEBP_LOSSLESS_QUALITY]),
+}
+# JPEG-XL needs OpenCV >= 4.11 built with libjxl, distance 0 is mathematically lossless
+if hasattr(cv2, "IMWRITE_JPEGXL_DISTANCE"):
+    CODECS["jxl-lossless"] = ImageCodec("jxl-lossless", ".jxl", [cv2.IMWRITE_JPEGXL_DISTANCE, 0])
+
+# Everything the review screen should pick up as a captured frame
+IMAGE_EXTENSIONS = tuple(sorted({codec.extension for codec in CODECS.values()}))
+
+
+def get_codec(name):
+    try:
+        return CODECS[name]
+    except KeyError:
+        raise ValueError(f"Unknown image codec '{name}', choose one of {', '.join(CODECS)}")
@@ -0,0 +1,104 @@
+import os
+import queue
+import threading
+import time
+from collections import namedtuple
+
+from image_codecs import get_codec, DEFAULT_CODEC
+from instrumentation import span
+
+# cv2 releases the GIL while encoding, so threads are enough to keep several cores busy
+WRITER_THREADS = 3
+# Frames waiting to be encoded. submit() blocks once this many are queued, which
+# bounds memory if the disk can't keep up with acquisition
+WRITER_QUEUE_SIZE = 10
+
+WriteResult = namedtuple("WriteResult", ["path", "group", "error", "seconds"])
+
+
+class ImageWriter:
+    """
+    Encodes and saves frames on a pool of background threads, so the
+    acquisition thread can tell the firmware to move on as soon as a frame is
+    in memory.
+
+    Frames are encoded with codec (see image_codecs.py), callers should name
+    their files with codec.extension.
+
+    Every frame belongs to a group (the fastener directory); wait_for_group()
+    blocks until all writes of that group have landed on disk.
+    """
+
+    def __init__(self, threads=WRITER_THREADS, queue_size=WRITER_QUEUE_SIZE, codec=DEFAULT_CODEC, on_complete=None):
+        self.codec = get_codec(codec)
+        self.jobs = queue.Queue(maxsize=queue_size)
+        self.on_complete = on_complete
+        self._pending = {}
+        self._results = {}
+        self._condition = threading.Condition()
+        self._threads = [threading.Thread(target=self._work, daemon=True) for _ in range(threads)]
+        for thread in self._threads:
+            thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def submit(self, path, image, group=None):
+        """Queue a frame for writing. The writer keeps a reference, so don't modify the image afterwards."""
+        with self._condition:
+            self._pending[group] = self._pending.get(group, 0) + 1
+            self._results.setdefault(group, [])
+        self.jobs.put((path, image, group))
+
+    def pending(self, group=None):
+        with self._condition:
+            return self._pending.get(group, 0)
+
+    def wait_for_group(self, group=None, timeout_s=None):
+        """Block until every frame submitted for group is on disk, returns their WriteResults."""
+        with self._condition:
+            if not self._condition.wait_for(lambda: self._pending.get(group, 0) == 0, timeout=timeout_s):
+                raise TimeoutError(f"{self._pending[group]} images still being written for {group}")
+            self._pending.pop(group, None)
+            return self._results.pop(group, [])
+
+    def close(self):
+        for _ in self._threads:
+            self.jobs.put(None)
+        for thread in self._threads:
+            thread.join()
+
+    def _write(self, path, image):
+        encoded = self.codec.encode(image)
+        # Write next to the destination and rename, so nothing (eg. rclone) ever sees a half written file
+        tmp_path = path + ".part"
+        with open(tmp_path, "wb") as f:
+            f.write(encoded)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    def _work(self):
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                return
+            path, image, group = job
+            start = time.monotonic()
+            error = None
+            try:
+                with span("imwrite"):
+                    self._write(path, image)
+            except Exception as e:
+                error = e
+                print(f"Failed to write {path}: {e}")
+            result = WriteResult(path, group, error, time.monotonic() - start)
+            if self.on_complete:
+                self.on_complete(result)
+            with self._condition:
+                self._results[group].append(result)
+                self._pending[group] -= 1
+                self._condition.notify_all()
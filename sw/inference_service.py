@@ -0,0 +1,117 @@
+import threading
+import time
+from collections import deque, namedtuple
+
+import cv2
+import numpy
+from PyQt5 import QtCore
+
+from instrumentation import RECORDER, span
+from view_fusion import fuse_predictions
+
+# Fasteners waiting for the model. When another one comes in the oldest request is
+# dropped, the operator only ever looks at the latest fastener
+INFERENCE_QUEUE_SIZE = 2
+# Views are cropped to the middle of the frame before going through the model
+INFERENCE_CROP_SCALE = 0.7
+INFERENCE_SCORE_THRESHOLD = 0.5
+
+InferenceRequest = namedtuple("InferenceRequest", ["group", "images", "submitted"])
+
+
+class InferenceService(QtCore.QObject):
+    """
+    Runs the detector on a background thread so the GUI never waits on it.
+
+    submit() queues the views of a fastener (images in memory or paths to
+    read) and returns straight away. Once the model is done, result is emitted
+    with the fastener directory, the (boxes, labels, scores) of every view, the
+    fastener-level prediction fused from all views (see view_fusion.py) and the
+    first view with its detections drawn on. The queue holds at most
+    queue_size requests, submitting to a full queue drops the oldest one,
+    which is reported through failed.
+
+    Time spent waiting in the queue and in the model are recorded as the
+    "inference wait" and "inference" spans.
+    """
+    result = QtCore.pyqtSignal(str, list, dict, numpy.ndarray)
+    failed = QtCore.pyqtSignal(str, str)
+    queue_changed = QtCore.pyqtSignal(int)
+
+    def __init__(self, model_helper, display_helper, queue_size=INFERENCE_QUEUE_SIZE,
+                 crop_scale=INFERENCE_CROP_SCALE, score_threshold=INFERENCE_SCORE_THRESHOLD):
+        super(InferenceService, self).__init__()
+        self.model_helper = model_helper
+        self.display_helper = display_helper
+        self.crop_scale = crop_scale
+        self.score_threshold = score_threshold
+        self.dropped = 0
+        self._requests = deque(maxlen=queue_size)
+        self._condition = threading.Condition()
+        self._stop = False
+        self._thread = None
+
+    def start(self):
+        self._stop = False
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        with self._condition:
+            self._stop = True
+            self._condition.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def pending(self):
+        with self._condition:
+            return len(self._requests)
+
+    def submit(self, group, images):
+        dropped = None
+        with self._condition:
+            if len(self._requests) == self._requests.maxlen:
+                # the deque pushes the oldest one out itself
+                self.dropped += 1
+                dropped = self._requests[0].group
+                print(f"Inference queue full, dropped {dropped}")
+            self._requests.append(InferenceRequest(group, images, time.monotonic()))
+            self._condition.notify_all()
+        if dropped is not None:
+            self.failed.emit(dropped, "dropped from the inference queue")
+        self.queue_changed.emit(self.pending())
+
+    def _infer(self, images):
+        views = []
+        for image in images:
+            if isinstance(image, str):
+                image = cv2.imread(image)
+            views.append(self.display_helper.crop_scale(image, scale=self.crop_scale))
+        predictions = self.model_helper.predict_images(views, score_threshold=self.score_threshold)
+        with span("view fusion"):
+            fused = fuse_predictions(predictions, self.model_helper.mapping)
+        # the top-down view is the one shown
+        annotated = self.display_helper.draw_prediction(views[0], predictions[0], self.model_helper.mapping)
+        return predictions, fused, annotated
+
+    def _run(self):
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: self._stop or self._requests)
+                if self._stop:
+                    return
+                request = self._requests.popleft()
+            self.queue_changed.emit(self.pending())
+
+            start = time.monotonic()
+            RECORDER.record("inference wait", request.submitted, start)
+            try:
+                with span("inference"):
+                    predictions, fused, annotated = self._infer(request.images)
+            except Exception as e:
+                print(f"Inference on {request.group} failed: {e}")
+                self.failed.emit(request.group, str(e))
+                continue
+            print(f"Inference on {request.group} took {time.monotonic() - start:.2f}s")
+            self.result.emit(request.group, predictions, fused, annotated)
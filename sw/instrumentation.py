@@ -0,0 +1,104 @@
+import json
+import os
+import statistics
+import threading
+import time
+from collections import deque, namedtuple
+from contextlib import contextmanager
+
+# Spans kept in memory, a fastener records a few dozen
+SPAN_BUFFER_SIZE = 20000
+
+# start and end are time.monotonic() seconds
+Span = namedtuple("Span", ["name", "start", "end", "thread"])
+
+
+class SpanRecorder:
+    """
+    Named stages timed with the monotonic clock, kept in a ring buffer so
+    recording costs an append and old spans fall off on their own.
+    Safe to use from any thread.
+    """
+
+    def __init__(self, size=SPAN_BUFFER_SIZE):
+        self._spans = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def span(self, name):
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.record(name, start, time.monotonic())
+
+    def record(self, name, start, end):
+        with self._lock:
+            self._spans.append(Span(name, start, end, threading.current_thread().name))
+
+    def spans(self, since=None):
+        with self._lock:
+            spans = list(self._spans)
+        if since is not None:
+            spans = [span for span in spans if span.start >= since]
+        return spans
+
+    def clear(self):
+        with self._lock:
+            self._spans.clear()
+
+    def dump_chrome_trace(self, path):
+        """Write the spans as Chrome trace JSON, open it in chrome://tracing or ui.perfetto.dev."""
+        with open(path, "w") as f:
+            json.dump(chrome_trace(self.spans()), f)
+
+
+def chrome_trace(spans):
+    pid = os.getpid()
+    threads = {}
+    events = []
+    for span in spans:
+        tid = threads.setdefault(span.thread, len(threads) + 1)
+        events.append({"name": span.name, "ph": "X", "pid": pid, "tid": tid,
+                       "ts": span.start * 1e6, "dur": (span.end - span.start) * 1e6})
+    # name the rows after the threads
+    for thread, tid in threads.items():
+        events.append({"name": "thread_name", "ph": "M", "pid": pid, "tid": tid, "args": {"name": thread}})
+    return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+
+def summarize(spans):
+    """Per stage count, total and latency percentiles, in order of first appearance."""
+    durations = {}
+    for span in spans:
+        durations.setdefault(span.name, []).append((span.end - span.start) * 1000)
+    summary = {}
+    for name, times_ms in durations.items():
+        times_ms.sort()
+        summary[name] = {
+            "count": len(times_ms),
+            "total_s": sum(times_ms) / 1000,
+            "mean_ms": statistics.mean(times_ms),
+            "p50_ms": times_ms[len(times_ms) // 2],
+            "p95_ms": times_ms[min(len(times_ms) - 1, int(len(times_ms) * 0.95))],
+            "max_ms": times_ms[-1],
+        }
+    return summary
+
+
+def fasteners_per_hour(spans, name="fastener"):
+    """Rate at which the named span completed, including the time between them."""
+    done = sorted((span for span in spans if span.name == name), key=lambda span: span.end)
+    if not done:
+        return 0.0
+    if len(done) == 1:
+        return 3600 / (done[0].end - done[0].start)
+    return 3600 * (len(done) - 1) / (done[-1].end - done[0].end)
+
+
+# Shared by everything in the process
+RECORDER = SpanRecorder()
+
+
+def span(name):
+    return RECORDER.span(name)
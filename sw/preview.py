@@ -0,0 +1,51 @@
+import cv2
+import numpy
+from PyQt5 import QtGui
+
+# Size of the live preview relative to the full frame
+PREVIEW_PERCENTAGE = 20
+
+
+def bgr_to_pixmap(cv_img):
+    """QPixmap from a BGR image without a colour conversion copy (Qt >= 5.14 reads BGR directly)."""
+    height, width = cv_img.shape[:2]
+    cv_img = numpy.ascontiguousarray(cv_img)
+    if hasattr(QtGui.QImage, "Format_BGR888"):
+        q_img = QtGui.QImage(cv_img.data, width, height, cv_img.strides[0], QtGui.QImage.Format_BGR888)
+    else:
+        q_img = QtGui.QImage(cv_img.data, width, height, cv_img.strides[0],
+                             QtGui.QImage.Format_RGB888).rgbSwapped()
+    return QtGui.QPixmap.fromImage(q_img)
+
+
+class PreviewRenderer:
+    """
+    Downsamples frames on the worker thread, so only the thumbnail crosses over
+    to the GUI thread. Every thumbnail is a new array, the GUI thread can fall
+    any number of frames behind and still owns what it was sent.
+    """
+
+    def __init__(self, percentage=PREVIEW_PERCENTAGE):
+        self.percentage = percentage
+
+    def _factor(self):
+        # INTER_AREA has a much faster path for exact integer ratios,
+        # so 20% is done as 1/5 of the frame cropped to a multiple of 5
+        factor = 100 / self.percentage
+        return int(factor) if factor.is_integer() else None
+
+    def preview_shape(self, frame):
+        factor = self._factor()
+        if factor:
+            return (frame.shape[0] // factor, frame.shape[1] // factor) + frame.shape[2:]
+        width = int(frame.shape[1] * self.percentage / 100)
+        height = int(frame.shape[0] * self.percentage / 100)
+        return (height, width) + frame.shape[2:]
+
+    def render(self, frame):
+        shape = self.preview_shape(frame)
+        factor = self._factor()
+        if factor:
+            # drops at most factor - 1 pixels off the bottom and right edges
+            frame = frame[:shape[0] * factor, :shape[1] * factor]
+        return cv2.resize(frame, (shape[1], shape[0]), interpolation=cv2.INTER_AREA)
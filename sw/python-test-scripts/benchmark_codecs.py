@@ -0,0 +1,69 @@
+#!/usr/bin/python3
+# Compares the image codecs in sw/image_codecs.py on representative fastener frames.
+# Usage: ./benchmark_codecs.py [image ...] [--repeat N]
+# Without images a synthetic frame from simulated_camera.py is used, which compresses
+# far better than real frames, so pass a few captured images when choosing a codec.
+
+import argparse
+import os
+import sys
+import time
+
+import cv2
+import numpy
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from image_codecs import CODECS
+from simulated_camera import SimulatedCamera
+
+
+def load_frames(paths):
+    if not paths:
+        cam = SimulatedCamera()
+        frame = cam._image.copy()
+        # add sensor noise so the frame isn't trivially compressible
+        noise = numpy.random.default_rng(0).normal(0, 3, frame.shape)
+        return [numpy.clip(frame + noise, 0, 255).astype(numpy.uint8)]
+    return [cv2.imread(path, cv2.IMREAD_UNCHANGED) for path in paths]
+
+
+def benchmark(codec, frames, repeat):
+    encode_s = decode_s = 0.0
+    total_bytes = 0
+    lossless = True
+    for frame in frames:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            encoded = codec.encode(frame)
+            encode_s += time.perf_counter() - start
+
+            start = time.perf_counter()
+            decoded = codec.decode(encoded)
+            decode_s += time.perf_counter() - start
+        total_bytes += encoded.nbytes
+        lossless = lossless and decoded is not None and numpy.array_equal(decoded, frame)
+    runs = len(frames) * repeat
+    return encode_s / runs * 1000, decode_s / runs * 1000, total_bytes / len(frames), lossless
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("images", nargs="*", help="representative fastener frames")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    frames = load_frames(args.images)
+    raw_bytes = sum(frame.nbytes for frame in frames) / len(frames)
+    print(f"{len(frames)} frame(s), {raw_bytes / 1e6:.1f} MB raw each\n")
+    print(f"{'codec':<15}{'encode ms':>12}{'decode ms':>12}{'MB/image':>12}{'ratio':>8}  lossless")
+    for name, codec in CODECS.items():
+        try:
+            encode_ms, decode_ms, size, lossless = benchmark(codec, frames, args.repeat)
+        except (IOError, cv2.error) as e:
+            print(f"{name:<15}  unsupported by this OpenCV build ({str(e).strip().splitlines()[-1]})")
+            continue
+        print(f"{name:<15}{encode_ms:>12.1f}{decode_ms:>12.1f}{size / 1e6:>12.2f}{raw_bytes / size:>8.2f}  {lossless}")
+
+
+if __name__ == "__main__":
+    main()
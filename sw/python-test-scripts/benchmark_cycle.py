@@ -0,0 +1,107 @@
+#!/usr/bin/python3
+# End-to-end cycle time of CameraWorker.run against the simulated firmware and camera,
+# broken down by the spans recorded through instrumentation.py. Each fastener is also
+# put through the review screen build and an upload to a local directory.
+# Usage: QT_QPA_PLATFORM=offscreen ./benchmark_cycle.py [--fasteners N] [--json out.json]
+#        [--baseline old.json --max-regression 5]
+# With --baseline the exit code is 1 when fasteners/hour dropped by more than --max-regression %.
+
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+
+from PyQt5 import QtWidgets
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from fake_bluepill import FakeBluepill
+from frame_cache import FrameCache
+from instrumentation import RECORDER, summarize
+from simulated_camera import SimulatedCamera
+from simulate_station import run_worker
+
+# Table order, roughly the order they happen in within a fastener
+PHASES = ["camera open", "settings change", "serial round trip", "exposure wait", "readout wait", "flip", "preview emit",
+          "review cache", "motion wait", "writer wait", "review build", "imwrite", "upload"]
+# Done on other threads, these overlap the phases above
+BACKGROUND_PHASES = ("imwrite", "upload")
+
+
+def copy_transfer(source, destination, listener=None, args=None):
+    # stands in for rclone_copy, a local copy has no network in it
+    shutil.copytree(source, os.path.join(destination, os.path.basename(source)), dirs_exist_ok=True)
+
+
+def print_table(result):
+    wall_s = sum(result["cycle_s"])
+    print(f"{'phase':<18}{'count':>6}{'total s':>9}{'mean ms':>9}{'p50 ms':>9}{'p95 ms':>9}{'max ms':>9}{'cycle %':>9}")
+    for name, stats in result["phases"].items():
+        share = "" if name in BACKGROUND_PHASES else f"{stats['total_s'] / wall_s * 100:8.1f}%"
+        print(f"{name:<18}{stats['count']:>6}{stats['total_s']:>9.2f}{stats['mean_ms']:>9.1f}"
+              f"{stats['p50_ms']:>9.1f}{stats['p95_ms']:>9.1f}{stats['max_ms']:>9.1f}{share:>9}")
+    print(f"{result['fasteners']} fasteners, mean cycle {wall_s / result['fasteners']:.2f} s, "
+          f"{result['fasteners_per_hour']:.1f} fasteners/hour ({', '.join(BACKGROUND_PHASES)} run in the background)")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--fasteners", type=int, default=3)
+    parser.add_argument("--time-scale", type=float, default=1.0)
+    parser.add_argument("--json", help="write the results here")
+    parser.add_argument("--baseline", help="results of an earlier run to compare against")
+    parser.add_argument("--max-regression", type=float, default=5.0,
+                        help="allowed drop in fasteners/hour against the baseline, in percent")
+    args = parser.parse_args()
+
+    app = QtWidgets.QApplication(sys.argv)
+    # imported after the QApplication exists, it pulls in the whole GUI module
+    from data_collection_backend import build_review_pixmaps
+    from upload_manager import UploadManager
+
+    output_dir = tempfile.mkdtemp(prefix="benchmark_cycle_")
+    remote_dir = os.path.join(output_dir, "remote")
+    upload_manager = UploadManager(os.path.join(output_dir, "upload_queue.json"), transfer=copy_transfer)
+    upload_manager.start()
+    frame_cache = FrameCache()
+
+    def on_fastener(fastener_directory):
+        # what the GUI does when the worker hands over a fastener
+        build_review_pixmaps(fastener_directory, frame_cache)
+        frame_cache.drop(fastener_directory)
+        upload_manager.enqueue(fastener_directory, remote_dir)
+
+    cam = SimulatedCamera(time_scale=args.time_scale)
+    RECORDER.clear()
+    with FakeBluepill(time_scale=args.time_scale) as bluepill:
+        cycle_s = run_worker(bluepill, cam, os.path.join(output_dir, "images"), args.fasteners,
+                             on_fastener=on_fastener, frame_cache=frame_cache)
+    upload_manager.wait_until_idle()
+    upload_manager.stop()
+
+    summary = summarize(RECORDER.spans())
+    result = {
+        "fasteners": len(cycle_s),
+        "time_scale": args.time_scale,
+        "cycle_s": cycle_s,
+        "fasteners_per_hour": 3600 * len(cycle_s) / sum(cycle_s),
+        "phases": {name: summary[name] for name in PHASES if name in summary},
+    }
+    print_table(result)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(result, f, indent=2)
+    shutil.rmtree(output_dir)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        change = (result["fasteners_per_hour"] / baseline["fasteners_per_hour"] - 1) * 100
+        print(f"Fasteners/hour {change:+.1f}% against {args.baseline}")
+        if change < -args.max_regression:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+#!/usr/bin/python3
+# ModelHelper.decode_prediction as it was (a Python loop with nms per image and a numpy
+# copy per tensor) against decode_detections (batched_nms over the whole batch and one
+# copy off the device), on synthetic detections for batches of 10 to 100 images.
+# Usage: ./benchmark_decode.py [--batch-sizes 10 25 50 100] [--detections 100] [--device cpu]
+# --detections is per image, the scripted Faster R-CNN returns up to 100.
+# "batched" is decode_detections alone, "+ split" also turns the result back into
+# per-image tuples like decode_prediction does for the existing callers, and is
+# what the speedup is worked out from.
+
+import argparse
+import os
+import sys
+import time
+
+import numpy
+import torch
+import torchvision
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from utils import ModelHelper
+
+# Frame size the boxes are drawn from
+IMAGE_SIZE = 1232
+
+
+def loop_decode(predictions, score_threshold=0.7, nms_iou_threshold=0.2):
+    # decode_prediction before batching
+    res = []
+    for prediction in predictions:
+        boxes = prediction['boxes']
+        scores = prediction['scores']
+        labels = prediction['labels']
+        if score_threshold:
+            want = scores > score_threshold
+            boxes = boxes[want]
+            scores = scores[want]
+            labels = labels[want]
+        if nms_iou_threshold:
+            want = torchvision.ops.nms(boxes=boxes, scores=scores, iou_threshold=nms_iou_threshold)
+            boxes = boxes[want]
+            scores = scores[want]
+            labels = labels[want]
+        res.append((boxes.cpu().numpy(), labels.cpu().numpy(), scores.cpu().numpy()))
+    return res
+
+
+def synthetic_predictions(images, detections, device, generator):
+    predictions = []
+    for _ in range(images):
+        corners = torch.rand(detections, 2, generator=generator) * IMAGE_SIZE * 0.8
+        sizes = torch.rand(detections, 2, generator=generator) * IMAGE_SIZE * 0.2 + 10
+        scores, _ = torch.sort(torch.rand(detections, generator=generator), descending=True)
+        predictions.append({
+            'boxes': torch.cat([corners, corners + sizes], dim=1).to(device),
+            'scores': scores.to(device),
+            'labels': torch.randint(1, 3, (detections,), generator=generator).to(device),
+        })
+    return predictions
+
+
+def timed(function, repeats):
+    function()
+    start = time.perf_counter()
+    for _ in range(repeats):
+        result = function()
+    return (time.perf_counter() - start) / repeats, result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[10, 25, 50, 100])
+    parser.add_argument("--detections", type=int, default=100)
+    parser.add_argument("--repeats", type=int, default=20)
+    parser.add_argument("--device", default="cuda" if torch.cuda.is_available() else "cpu")
+    args = parser.parse_args()
+
+    # only the decode methods are used, no model needs loading
+    helper = ModelHelper.__new__(ModelHelper)
+    generator = torch.Generator().manual_seed(0)
+    print(f"{args.detections} detections per image on {args.device}")
+    print(f"{'images':>7}{'loop ms':>10}{'batched ms':>12}{'+ split ms':>12}{'speedup':>9}")
+    for batch_size in args.batch_sizes:
+        predictions = synthetic_predictions(batch_size, args.detections, args.device, generator)
+        loop_s, expected = timed(lambda: loop_decode(predictions), args.repeats)
+        batched_s, _ = timed(lambda: helper.decode_detections(predictions), args.repeats)
+        split_s, decoded = timed(lambda: helper.decode_prediction(predictions), args.repeats)
+        for (boxes, labels, scores), (new_boxes, new_labels, new_scores) in zip(expected, decoded):
+            assert numpy.allclose(boxes, new_boxes) and (labels == new_labels).all() and numpy.allclose(scores, new_scores)
+        print(f"{batch_size:>7}{loop_s * 1000:>10.2f}{batched_s * 1000:>12.2f}{split_s * 1000:>12.2f}"
+              f"{loop_s / split_s:>8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
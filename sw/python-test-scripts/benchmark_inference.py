@@ -0,0 +1,85 @@
+#!/usr/bin/python3
+# CPU throughput of ModelHelper in images/second: the old one image per call path
+# (predict_single_image before batching) against predict_fasteners at a few batch sizes,
+# on the 10 views of simulated fasteners.
+# Usage: ./benchmark_inference.py [--model model.pt] [--fasteners N] [--batch-sizes 1 4 10]
+# Without --model an untrained torchvision Faster R-CNN is scripted to stand in for ours,
+# which gives the same per-image work but no meaningful detections.
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import cv2
+import torch
+import torchvision
+import torchvision.transforms.transforms as T
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from simulated_camera import SimulatedCamera
+from utils import ModelHelper
+
+VIEWS_PER_FASTENER = 10
+
+
+def stand_in_model(path):
+    model = torchvision.models.detection.fasterrcnn_mobilenet_v3_large_fpn(
+        weights=None, weights_backbone=None, num_classes=3)
+    model.eval()
+    torch.jit.save(torch.jit.script(model), path)
+
+
+@torch.no_grad()
+def old_predict_single_image(helper, img, score_threshold=0.7):
+    # predict_single_image and predict_batch as they were, transform and model placement every call
+    transform = T.Compose([T.ToTensor()])
+    img = transform(cv2.cvtColor(img, cv2.COLOR_BGR2RGB))
+    helper.model.to(helper.device)
+    helper.model.eval()
+    X, _ = helper.unbatch((torch.stack([img]), ({})))
+    _, predictions = helper.model(X)
+    return helper.decode_prediction(predictions, score_threshold=score_threshold)[0]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model", help="TorchScript model, as loaded by the GUI")
+    parser.add_argument("--fasteners", type=int, default=2)
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 4, 10])
+    parser.add_argument("--threads", type=int, help="torch.set_num_threads")
+    args = parser.parse_args()
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    model_path = args.model
+    if model_path is None:
+        model_path = os.path.join(tempfile.mkdtemp(prefix="benchmark_inference_"), "stand_in.pt")
+        stand_in_model(model_path)
+    helper = ModelHelper(model_path)
+    print(f"device {helper.device}, {torch.get_num_threads()} threads")
+
+    frame = SimulatedCamera()._image
+    fasteners = [[frame.copy() for _ in range(VIEWS_PER_FASTENER)] for _ in range(args.fasteners)]
+    images = sum(len(views) for views in fasteners)
+
+    # warm up, the first call of a TorchScript model optimizes the graph
+    helper.predict_images(fasteners[0][:2])
+
+    start = time.perf_counter()
+    for views in fasteners:
+        for view in views:
+            old_predict_single_image(helper, view)
+    elapsed = time.perf_counter() - start
+    print(f"{'one per call':<14} {images / elapsed:6.2f} images/s")
+
+    for batch_size in args.batch_sizes:
+        start = time.perf_counter()
+        helper.predict_fasteners(fasteners, batch_size=batch_size)
+        elapsed = time.perf_counter() - start
+        print(f"{f'batch of {batch_size}':<14} {images / elapsed:6.2f} images/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+#!/usr/bin/python3
+# Compares the old live preview path (full frame emitted to the GUI, resized,
+# cvtColor'd and turned into a pixmap there) against sw/preview.py.
+# Usage: QT_QPA_PLATFORM=offscreen ./benchmark_preview.py [--frames N]
+
+import argparse
+import os
+import sys
+import time
+
+import cv2
+from PyQt5 import QtGui, QtWidgets
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from preview import PreviewRenderer, bgr_to_pixmap
+from simulated_camera import SimulatedCamera
+
+
+def old_path(flipped):
+    # what draw_image_on_gui used to do on the GUI thread with the full frame
+    copied = 0
+    width = int(flipped.shape[1] * 20 / 100)
+    height = int(flipped.shape[0] * 20 / 100)
+    resized = cv2.resize(flipped, (width, height), interpolation=cv2.INTER_AREA)
+    copied += resized.nbytes
+    rgb = cv2.cvtColor(resized, cv2.COLOR_BGR2RGB)
+    copied += rgb.nbytes
+    q_img = QtGui.QImage(rgb.data, width, height, 3 * width, QtGui.QImage.Format_RGB888)
+    QtGui.QPixmap.fromImage(q_img)
+    copied += rgb.nbytes
+    return copied
+
+
+def new_path(renderer, flipped):
+    # CameraWorker.save_frame renders the thumbnail and emits it, draw_image_on_gui
+    # turns it into a pixmap
+    thumbnail = renderer.render(flipped)
+    bgr_to_pixmap(thumbnail)
+    # the thumbnail and the pixmap
+    return 2 * thumbnail.nbytes
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--frames", type=int, default=50)
+    args = parser.parse_args()
+
+    app = QtWidgets.QApplication(sys.argv)
+    frame = SimulatedCamera()._image
+    # both paths start from the flipped frame that is saved to disk anyway
+    flipped = cv2.flip(frame, -1)
+    renderer = PreviewRenderer()
+
+    for name, run in (("old", lambda: old_path(flipped)), ("new", lambda: new_path(renderer, flipped))):
+        run()
+        start = time.perf_counter()
+        copied = 0
+        for _ in range(args.frames):
+            copied += run()
+        elapsed = time.perf_counter() - start
+        print(f"{name}: {elapsed / args.frames * 1000:.2f} ms/frame, {copied / args.frames / 1e3:.0f} kB copied/frame")
+    print(f"full frame {frame.nbytes / 1e6:.1f} MB; the old path also sent that across the progress signal")
+
+
+if __name__ == "__main__":
+    main()
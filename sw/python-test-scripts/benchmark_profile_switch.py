@@ -0,0 +1,75 @@
+#!/usr/bin/python3
+# Times top-down <-> side-view camera profile switches, feature by feature versus
+# a single UserSetLoad (sw/camera_profiles.py). A user set switch includes putting
+# the trigger back afterwards, as the GUI does.
+# Usage: ./benchmark_profile_switch.py [--sim] [--switches N] [--trigger-line Line0]
+# Without --sim the first Vimba camera is used and UserSet1/UserSet2 are overwritten.
+
+import argparse
+import os
+import statistics
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from camera_profiles import CameraProfileManager
+from simulated_camera import SimulatedCamera
+
+
+def get_camera(sim):
+    if sim:
+        return SimulatedCamera()
+    from vimba import Vimba
+    with Vimba.get_instance() as vimba:
+        cams = vimba.get_all_cameras()
+    if not cams:
+        sys.exit("No Cameras accessible. Abort.")
+    return cams[0]
+
+
+def time_switches(manager, switches):
+    manager.switch_times = []
+    for i in range(switches):
+        manager.apply("side_view" if i % 2 else "top_down")
+    # the very first switch has nothing to diff against, leave it out
+    return [elapsed for _, _, elapsed in manager.switch_times[1:]]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sim", action="store_true", help="use simulated_camera.py instead of a real camera")
+    parser.add_argument("--switches", type=int, default=20)
+    parser.add_argument("--trigger-line", default=None,
+                        help="hardware trigger input, eg. Line0, the software trigger otherwise")
+    args = parser.parse_args()
+
+    cam = get_camera(args.sim)
+    backend = None
+    if not args.sim:
+        # holds the camera open with the trigger set up, like the capture engine in the GUI
+        from vimba_backend import VimbaCameraBackend
+        backend = VimbaCameraBackend(cam, trigger_line=args.trigger_line)
+        backend.open()
+    results = {}
+
+    try:
+        manager = CameraProfileManager(cam)
+        results["features"] = time_switches(manager, args.switches)
+
+        manager = CameraProfileManager(cam)
+        if backend is not None:
+            manager.user_set_loaded.connect(backend.restore_settings)
+        if manager.provision_user_sets():
+            results["user set"] = time_switches(manager, args.switches)
+        else:
+            print("Camera has no user sets")
+    finally:
+        if backend is not None:
+            backend.close()
+
+    for method, times in results.items():
+        times_ms = [t * 1000 for t in times]
+        print(f"{method:<10} median {statistics.median(times_ms):7.1f} ms   max {max(times_ms):7.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+#!/usr/bin/python3
+# GUI startup cost: `python -X importtime` of data_collection_backend.py with the slowest
+# imports listed, and with --window the time until My_App is shown (simulated camera and
+# Bluepill, so no hardware is needed). --ui compares parsing data_collection.ui at runtime
+# with setting it up from the module compiled by ui_cache.py.
+# Usage: QT_QPA_PLATFORM=offscreen ./benchmark_startup.py [--top N] [--window] [--ui] [--runs N]
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+SW_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+WINDOW_SNIPPET = """
+import time
+start = time.perf_counter()
+from PyQt5 import QtWidgets
+app = QtWidgets.QApplication([])
+import data_collection_backend as backend
+backend.SIMULATE_CAMERA = True
+backend.SIMULATE_BLUEPILL = True
+window = backend.My_App()
+window.show()
+app.processEvents()
+print(time.perf_counter() - start)
+window.close()
+"""
+
+UI_SNIPPET = """
+import sys, time
+from PyQt5 import QtWidgets
+app = QtWidgets.QApplication([])
+import ui_cache
+window = QtWidgets.QMainWindow()
+start = time.perf_counter()
+if sys.argv[1] == "runtime":
+    from PyQt5 import uic
+    uic.loadUi("data_collection.ui", window)
+else:
+    ui_cache.load_ui("data_collection.ui", window)
+print(time.perf_counter() - start)
+"""
+
+
+def import_times(module):
+    """(self us, cumulative us, module) for every import, from -X importtime's stderr."""
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                            cwd=SW_DIR, capture_output=True, text=True)
+    if result.returncode != 0:
+        sys.exit(result.stderr.strip().splitlines()[-1])
+    times = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        times.append((int(self_us), int(cumulative_us), name.rstrip()))
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--module", default="data_collection_backend")
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--window", action="store_true", help="also time My_App until it is shown")
+    parser.add_argument("--ui", action="store_true", help="also time loading data_collection.ui both ways")
+    args = parser.parse_args()
+
+    totals = []
+    for _ in range(args.runs):
+        times = import_times(args.module)
+        # the module itself is the last top-level entry, its cumulative time covers everything
+        totals.append(times[-1][1])
+    print(f"import {args.module}: median {statistics.median(totals) / 1000:.0f} ms over {args.runs} runs")
+    print(f"{'cumulative ms':>14}{'self ms':>9}  module")
+    for self_us, cumulative_us, name in sorted(times, key=lambda t: t[1], reverse=True)[:args.top]:
+        print(f"{cumulative_us / 1000:>14.1f}{self_us / 1000:>9.1f}  {name}")
+
+    if args.window:
+        runs = []
+        for _ in range(args.runs):
+            result = subprocess.run([sys.executable, "-c", WINDOW_SNIPPET], cwd=SW_DIR, capture_output=True, text=True)
+            if result.returncode != 0:
+                sys.exit(result.stderr.strip().splitlines()[-1])
+            runs.append(float(result.stdout.strip().splitlines()[-1]))
+        print(f"My_App shown after: median {statistics.median(runs) * 1000:.0f} ms over {args.runs} runs")
+
+    if args.ui:
+        # the first compiled run builds ui_cache/ if it is out of date, the median leaves it out
+        for mode in ("runtime", "compiled"):
+            runs = []
+            for _ in range(args.runs):
+                result = subprocess.run([sys.executable, "-c", UI_SNIPPET, mode], cwd=SW_DIR,
+                                        capture_output=True, text=True)
+                if result.returncode != 0:
+                    sys.exit(result.stderr.strip().splitlines()[-1])
+                runs.append(float(result.stdout.strip().splitlines()[-1]))
+            print(f"data_collection.ui {mode}: median {statistics.median(runs) * 1000:.0f} ms over {args.runs} runs")
+
+
+if __name__ == "__main__":
+    main()
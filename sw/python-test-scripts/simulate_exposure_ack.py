@@ -0,0 +1,72 @@
+#!/usr/bin/python3
+# Runs the same fasteners through CameraWorker.run with "finished" sent after the frame is
+# read out and processed (the old order) and as soon as the exposure ends, against the
+# simulated firmware and camera, and shows how much of the readout and processing now
+# happens while the arm or turntable is moving.
+# Usage: QT_QPA_PLATFORM=offscreen ./simulate_exposure_ack.py [--fasteners N] [--readout-ms 50]
+# Exits with 1 if acking on exposure end overlapped nothing or wasn't faster.
+
+import argparse
+import os
+import sys
+import tempfile
+
+from PyQt5 import QtWidgets
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from fake_bluepill import FakeBluepill, WAIT_ON_PIC
+from instrumentation import RECORDER
+from simulated_camera import SimulatedCamera, SIM_READOUT_S
+from simulate_station import run_worker
+
+# Host work between the end of the exposure and the frame being handed to the writer
+PROCESSING_SPANS = ("readout wait", "flip", "preview emit", "review cache")
+
+
+def overlap_s(spans, names, other):
+    """Total time spans called one of names ran at the same time as spans called other."""
+    busy = [span for span in spans if span.name == other]
+    total = 0.0
+    for span in spans:
+        if span.name not in names:
+            continue
+        for moving in busy:
+            total += max(0.0, min(span.end, moving.end) - max(span.start, moving.start))
+    return total
+
+
+def run(ack_on_exposure_end, args):
+    import data_collection_backend as backend
+
+    backend.ACK_ON_EXPOSURE_END = ack_on_exposure_end
+    RECORDER.clear()
+    cam = SimulatedCamera(readout_s=args.readout_ms / 1000)
+    with FakeBluepill() as bluepill:
+        times = run_worker(bluepill, cam, tempfile.mkdtemp(prefix="simulate_exposure_ack_"), args.fasteners)
+    spans = RECORDER.spans()
+    return {
+        "cycle_s": sum(times) / len(times),
+        "held_ms": bluepill.state_times[WAIT_ON_PIC] / bluepill.pictures_requested * 1000,
+        "overlap_s": overlap_s(spans, PROCESSING_SPANS, "firmware motion") / len(times),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--fasteners", type=int, default=2)
+    parser.add_argument("--readout-ms", type=float, default=SIM_READOUT_S * 1000)
+    args = parser.parse_args()
+
+    app = QtWidgets.QApplication(sys.argv)
+    results = {"after processing": run(False, args), "on exposure end": run(True, args)}
+    print(f"{'ack':<18}{'cycle s':>9}{'held ms/picture':>17}{'overlap s/fastener':>20}")
+    for name, result in results.items():
+        print(f"{name:<18}{result['cycle_s']:>9.2f}{result['held_ms']:>17.1f}{result['overlap_s']:>20.2f}")
+    old, new = results["after processing"], results["on exposure end"]
+    print(f"Cycle time {(new['cycle_s'] / old['cycle_s'] - 1) * 100:+.1f}%")
+    if new["overlap_s"] <= 0 or new["cycle_s"] >= old["cycle_s"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
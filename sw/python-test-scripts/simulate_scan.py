@@ -0,0 +1,116 @@
+#!/usr/bin/python3
+# Runs fasteners through CameraWorker.run with the side-on views taken on the fly
+# (CONTINUOUS_SCAN) at a range of plane speeds, against the simulated firmware and camera,
+# and shows how far off the angle in the label json is from where the plane really was
+# during the exposure, how much it turned during the exposure, and what each speed gives in
+# fasteners/hour. The stepped hardware trigger mode is run first for comparison.
+# Usage: QT_QPA_PLATFORM=offscreen ./simulate_scan.py [--rpms 100 400 1600] [--exposure-us 8000]
+#                                                   [--readout-ms 50] [--views 9] [--fasteners 1]
+# Views are lost once they come faster than the camera's exposure plus readout.
+# Exits with 1 if a view is lost or mislabelled at the firmware's SCAN_RPM.
+
+import argparse
+import glob
+import json
+import os
+import sys
+import tempfile
+
+import cv2
+from PyQt5 import QtWidgets
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from camera_profiles import SIDE_VIEW_SCAN_PROFILE
+from fake_bluepill import (FakeBluepill, PLANE_END_ANGLE, SCAN_RPM, SCAN_VIEWS, STEPPER_STEPS,
+                           stepper_steps)
+from simulated_camera import SimulatedCamera, SIM_READOUT_S
+from simulate_station import run_worker
+
+# A view more than this far from its label angle counts as mislabelled
+MISLABELLED_DEG = 5
+
+
+def plane_dps(rpm):
+    """Degrees per second the plane turns at when the stepper runs at rpm."""
+    return STEPPER_STEPS * rpm / 60 / stepper_steps(PLANE_END_ANGLE) * 360
+
+
+def angle_errors(directories, cam, bluepill, dps):
+    """Label angle minus the plane's angle in the middle of the exposure, for every saved view."""
+    errors = []
+    for directory in directories:
+        with open(glob.glob(os.path.join(directory, "*.json"))[0]) as file_obj:
+            view_angles = json.load(file_obj).get("view_angles", {})
+        for n, label_angle in view_angles.items():
+            image = cv2.imread(glob.glob(os.path.join(directory, f"{n}_*"))[0])
+            # the simulated camera stamps the frame id, the frame is saved flipped
+            start, exposure_s = cam.exposures[int(image[-1, -1, 0])]
+            middle = start + exposure_s / 2
+            # extrapolate from the last view due before it, the plane turns at dps in between
+            _, angle, due, _ = max((entry for entry in bluepill.scan_log if entry[2] <= middle),
+                                   key=lambda entry: entry[2])
+            error = (label_angle - (angle + (middle - due) * dps) + 180) % 360 - 180
+            errors.append(error)
+    return errors
+
+
+def run(rpm, args):
+    import data_collection_backend as backend
+
+    backend.HARDWARE_TRIGGER = True
+    backend.CONTINUOUS_SCAN = rpm is not None
+    backend.SCAN_RPM = rpm or SCAN_RPM
+    backend.NUMBER_SIDEON = args.views
+    cam = SimulatedCamera(readout_s=args.readout_ms / 1000)
+    directories = []
+    with FakeBluepill(trigger=cam.pulse, scan_rpm=rpm, scan_views=args.views) as bluepill:
+        times = run_worker(bluepill, cam, tempfile.mkdtemp(prefix="simulate_scan_"), args.fasteners,
+                           on_fastener=directories.append)
+    result = {
+        "cycle_s": sum(times) / len(times),
+        "fasteners_per_hour": 3600 * len(times) / sum(times),
+        "missed": cam.missed_triggers,
+        "saved": sum(len(glob.glob(os.path.join(directory, "*_*"))) - 1 for directory in directories),
+    }
+    if rpm is None:
+        return result
+    errors = angle_errors(directories, cam, bluepill, plane_dps(rpm))
+    result.update({
+        "blur_deg": plane_dps(rpm) * args.exposure_us / 1e6,
+        "max_error_deg": max(map(abs, errors), default=0.0),
+        "mislabelled": sum(abs(error) > MISLABELLED_DEG for error in errors),
+        # the late trigger timers are the simulator's, the motion interrupt is within a 100us tick
+        "late_ms": max((triggered - due) * 1000 for _, _, due, triggered in bluepill.scan_log),
+    })
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rpms", type=float, nargs="+", default=[SCAN_RPM, 400, 1600, 3200])
+    parser.add_argument("--exposure-us", type=float, default=SIDE_VIEW_SCAN_PROFILE.features["ExposureTime"])
+    parser.add_argument("--readout-ms", type=float, default=SIM_READOUT_S * 1000)
+    parser.add_argument("--views", type=int, default=SCAN_VIEWS)
+    parser.add_argument("--fasteners", type=int, default=1)
+    args = parser.parse_args()
+
+    SIDE_VIEW_SCAN_PROFILE.features["ExposureTime"] = args.exposure_us
+    app = QtWidgets.QApplication(sys.argv)
+    stepped = run(None, args)
+    print(f"{'mode':<14}{'s/fastener':>11}{'fasteners/h':>13}{'views':>7}{'missed':>8}"
+          f"{'blur deg':>10}{'max err deg':>13}{'mislabelled':>13}{'late ms':>9}")
+    print(f"{'stepped':<14}{stepped['cycle_s']:>11.2f}{stepped['fasteners_per_hour']:>13.1f}"
+          f"{stepped['saved']:>7}{stepped['missed']:>8}")
+    failed = False
+    for rpm in args.rpms:
+        result = run(rpm, args)
+        print(f"{f'scan {rpm:g} rpm':<14}{result['cycle_s']:>11.2f}{result['fasteners_per_hour']:>13.1f}"
+              f"{result['saved']:>7}{result['missed']:>8}{result['blur_deg']:>10.2f}"
+              f"{result['max_error_deg']:>13.2f}{result['mislabelled']:>13}{result['late_ms']:>9.1f}")
+        if rpm == SCAN_RPM:
+            failed = result["saved"] < args.views * args.fasteners or result["mislabelled"] > 0
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
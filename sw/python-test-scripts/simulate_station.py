@@ -0,0 +1,109 @@
+#!/usr/bin/python3
+# Runs complete fasteners against the simulated firmware (fake_bluepill.py, over a pty)
+# and the simulated camera, through either CameraWorker.run or
+# camera_controller.begin_imaging_process, and reports fasteners per hour.
+# Usage: ./simulate_station.py [--client worker|controller] [--fasteners N] [--time-scale S]
+#                              [--hardware-trigger]
+# With --time-scale below 1 motion and exposures are sped up, host-side work is not,
+# so only the default of 1 gives a fasteners/hour figure comparable to the station.
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+import types
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from fake_bluepill import FakeBluepill, SERVO_STEP_S, STEPPER_RPM
+from simulated_camera import SimulatedCamera
+
+FILENAME_VARIABLES = {
+    "type": "screw", "standard": "metric", "length": "20", "diameter": "M5", "pitch": "0.8",
+    "head": "socket", "drive": "hex", "direction": "right", "material": "steel", "finish": "zinc",
+}
+
+
+def run_worker(bluepill, cam, output_dir, fasteners, on_fastener=None, frame_cache=None):
+    import data_collection_backend as backend
+    from camera_profiles import CameraProfileManager
+    from capture_engine import CaptureEngine
+    from frame_cache import FrameCache
+    from image_writer import ImageWriter
+
+    backend.TOP_IMAGES_FOLDER = output_dir
+    profiles = CameraProfileManager(cam)
+    app = types.SimpleNamespace(filename_variables=FILENAME_VARIABLES)
+    image_writer = ImageWriter(codec=backend.IMAGE_CODEC)
+    times = []
+    with CaptureEngine(cam) as capture_engine:
+        worker = backend.CameraWorker("sim", capture_engine, image_writer, frame_cache or FrameCache(),
+                                      serial_port=bluepill.port, app=app)
+        # no event loop here, so this is a direct call like the blocking connection in the GUI
+        worker.change_camera_profile.connect(profiles.apply)
+        if on_fastener is not None:
+            # called with the fastener directory once its images are on disk
+            worker.upload.connect(on_fastener)
+        for _ in range(fasteners):
+            start = time.monotonic()
+            worker.run()
+            times.append(time.monotonic() - start)
+    image_writer.close()
+    return times
+
+
+def run_controller(bluepill, cam, output_dir, fasteners):
+    import camera_controller
+
+    times = []
+    for i in range(fasteners):
+        # begin_imaging_process names its folder by the second, give each fastener its own directory
+        fastener_dir = os.path.join(output_dir, str(i))
+        os.mkdir(fastener_dir)
+        os.chdir(fastener_dir)
+        start = time.monotonic()
+        camera_controller.begin_imaging_process(cam, port=bluepill.port)
+        times.append(time.monotonic() - start)
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--client", choices=("worker", "controller"), default="worker")
+    parser.add_argument("--fasteners", type=int, default=3)
+    parser.add_argument("--time-scale", type=float, default=1.0)
+    parser.add_argument("--servo-step-ms", type=float, default=SERVO_STEP_S * 1000)
+    parser.add_argument("--stepper-rpm", type=float, default=STEPPER_RPM)
+    parser.add_argument("--corrupt-rate", type=float, default=0.0)
+    parser.add_argument("--hardware-trigger", action="store_true",
+                        help="the fake Bluepill triggers the camera itself (worker only)")
+    parser.add_argument("--output", help="keep the images here instead of a temporary directory")
+    args = parser.parse_args()
+
+    output_dir = args.output or tempfile.mkdtemp(prefix="simulate_station_")
+    os.makedirs(output_dir, exist_ok=True)
+    cam = SimulatedCamera(time_scale=args.time_scale)
+    run = run_worker if args.client == "worker" else run_controller
+    if args.hardware_trigger:
+        import data_collection_backend as backend
+        backend.HARDWARE_TRIGGER = True
+    with FakeBluepill(time_scale=args.time_scale, servo_step_s=args.servo_step_ms / 1000,
+                      stepper_rpm=args.stepper_rpm, corrupt_rate=args.corrupt_rate,
+                      trigger=cam.pulse if args.hardware_trigger else None) as bluepill:
+        times = run(bluepill, cam, output_dir, args.fasteners)
+
+    print(f"{len(times)} fasteners, {bluepill.pictures_requested} pictures, images in {output_dir}")
+    for i, elapsed in enumerate(times):
+        print(f"  fastener {i}: {elapsed:6.2f} s")
+    total = sum(bluepill.state_times.values())
+    print("Firmware time by state:")
+    for state, seconds in bluepill.state_times.items():
+        print(f"  {state:<15} {seconds:7.2f} s  {seconds / total * 100:5.1f}%")
+    if bluepill.link is not None:
+        print(f"Retransmits: firmware {bluepill.link.retransmits}, corrupt frames seen {bluepill.link.corrupt_frames}")
+    print(f"Fasteners/hour: {3600 * len(times) / sum(times):.1f} (time scale {args.time_scale}), "
+          f"{bluepill.fasteners_per_hour():.1f} counting from \"start\" to \"finished-imaging\" only")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,228 @@
+import binascii
+import random
+import threading
+import time
+from collections import namedtuple
+
+import serial
+
+from serial_transport import SerialTransport, SerialTimeout, SERIAL_PORT, BAUD_RATE
+
+# Frame layout, must match fw/src/core/serial.h:
+#   FRAME_START | length | type | sequence | payload (length bytes) | CRC-16 (big endian)
+# The CRC is CRC-16/CCITT-FALSE over length, type, sequence and payload.
+FRAME_START = 0xA5
+FRAME_HEADER_LEN = 4
+FRAME_CRC_LEN = 2
+FRAME_MAX_PAYLOAD = 16
+
+MESSAGE_TYPES = {
+    "start": 0x01,
+    "picture": 0x02,
+    "finished": 0x03,
+    "finished-imaging": 0x04,
+    # hardware trigger mode, the payload is the index of the pose the camera was triggered at,
+    # followed when scanning by the plane angle in hundredths of a degree (2 bytes, big endian)
+    "triggered": 0x05,
+}
+MESSAGE_NAMES = {value: name for name, value in MESSAGE_TYPES.items()}
+# Link control, never handed to the imaging loop
+ACK = 0x06
+NAK = 0x15
+
+# An unacknowledged frame is resent after this long, or straight away on a NAK
+RETRANSMIT_S = 0.25
+# The firmware doesn't read the port during an arm or plane move,
+# so keep resending for longer than the slowest move
+RETRANSMIT_ATTEMPTS = 40
+
+Frame = namedtuple("Frame", ["type", "seq", "payload"])
+
+
+def crc16(data):
+    # crc_hqx is the CCITT polynomial, seeded with 0xFFFF that is CRC-16/CCITT-FALSE
+    return binascii.crc_hqx(data, 0xFFFF)
+
+
+def encode_frame(frame_type, seq, payload=b""):
+    if len(payload) > FRAME_MAX_PAYLOAD:
+        raise ValueError(f"Payload of {len(payload)} bytes, at most {FRAME_MAX_PAYLOAD} fit in a frame")
+    body = bytes([len(payload), frame_type, seq]) + payload
+    return bytes([FRAME_START]) + body + crc16(body).to_bytes(2, "big")
+
+
+class FrameDecoder:
+    """
+    Reassembles frames from a byte stream. feed() returns the complete frames
+    found so far, with None in place of each corrupt one. After a corrupt frame
+    the decoder resynchronises on the next FRAME_START byte.
+    """
+
+    def __init__(self):
+        self._buffer = bytearray()
+
+    def feed(self, data):
+        self._buffer += data
+        frames = []
+        while True:
+            start = self._buffer.find(FRAME_START)
+            if start < 0:
+                self._buffer.clear()
+                break
+            del self._buffer[:start]
+            if len(self._buffer) < FRAME_HEADER_LEN:
+                break
+            length = self._buffer[1]
+            if length > FRAME_MAX_PAYLOAD:
+                del self._buffer[:1]
+                frames.append(None)
+                continue
+            end = FRAME_HEADER_LEN + length + FRAME_CRC_LEN
+            if len(self._buffer) < end:
+                break
+            body = bytes(self._buffer[1:end - FRAME_CRC_LEN])
+            if crc16(body) != int.from_bytes(self._buffer[end - FRAME_CRC_LEN:end], "big"):
+                del self._buffer[:1]
+                frames.append(None)
+                continue
+            del self._buffer[:end]
+            frames.append(Frame(body[1], body[2], body[3:]))
+        return frames
+
+
+class FrameLink:
+    """
+    Sequence numbers, acknowledgements and retransmits on top of the framing,
+    shared by the host side and fake_bluepill.py. Every message frame is ACKed
+    with its sequence number; a corrupt frame gets a NAK, which makes the other
+    end resend at once instead of waiting out RETRANSMIT_S. A resent frame that
+    was already received (its ACK got lost) is ACKed again but not delivered twice.
+
+    Like the firmware there is a single outgoing frame in flight: post() sends
+    it and retransmit_if_due() resends it, for loops that can't block. send()
+    does both and blocks until the frame is ACKed.
+    """
+
+    def __init__(self, write, retransmit_s=RETRANSMIT_S, attempts=RETRANSMIT_ATTEMPTS):
+        self._write_bytes = write
+        self.retransmit_s = retransmit_s
+        self.attempts = attempts
+        self.retransmits = 0
+        self.corrupt_frames = 0
+        self.decoder = FrameDecoder()
+        # a fresh host session is unlikely to reuse the sequence number the firmware saw last
+        self._tx_seq = random.randrange(256)
+        self._rx_seq = None
+        self._write_lock = threading.Lock()
+        self._send_lock = threading.Lock()
+        self._acked = threading.Condition()
+        self._pending = None
+        self._nak = False
+
+    def _write(self, data):
+        with self._write_lock:
+            self._write_bytes(data)
+
+    def post(self, message, payload=b""):
+        seq = self._tx_seq
+        self._tx_seq = (seq + 1) % 256
+        data = encode_frame(MESSAGE_TYPES[message], seq, payload)
+        with self._acked:
+            # [seq, frame, attempts so far, time of last attempt]
+            self._pending = [seq, data, 1, time.monotonic()]
+            self._nak = False
+        self._write(data)
+        return seq
+
+    def pending(self):
+        with self._acked:
+            return self._pending is not None
+
+    def retransmit_if_due(self):
+        with self._acked:
+            if self._pending is None:
+                return
+            seq, data, attempts, sent = self._pending
+            if not self._nak and time.monotonic() - sent < self.retransmit_s:
+                return
+            self._nak = False
+            if attempts >= self.attempts:
+                self._pending = None
+                raise SerialTimeout(f"Frame {seq} was not acknowledged after {attempts} attempts")
+            self._pending = [seq, data, attempts + 1, time.monotonic()]
+            self.retransmits += 1
+        self._write(data)
+
+    def send(self, message, payload=b""):
+        with self._send_lock:
+            self.post(message, payload)
+            while True:
+                with self._acked:
+                    self._acked.wait_for(lambda: self._pending is None or self._nak, timeout=self.retransmit_s)
+                    if self._pending is None:
+                        return
+                self.retransmit_if_due()
+
+    def receive(self, data):
+        """Feed bytes read from the port, returns the new messages as (name, payload) pairs."""
+        messages = []
+        for frame in self.decoder.feed(data):
+            if frame is None:
+                self.corrupt_frames += 1
+                self._write(encode_frame(NAK, 0))
+            elif frame.type == ACK:
+                with self._acked:
+                    if self._pending is not None and self._pending[0] == frame.seq:
+                        self._pending = None
+                        self._acked.notify_all()
+            elif frame.type == NAK:
+                with self._acked:
+                    if self._pending is not None:
+                        self._nak = True
+                        self._acked.notify_all()
+            else:
+                self._write(encode_frame(ACK, frame.seq))
+                if frame.seq == self._rx_seq:
+                    continue
+                self._rx_seq = frame.seq
+                name = MESSAGE_NAMES.get(frame.type)
+                if name is None:
+                    print(f"Ignoring frame of unknown type {frame.type:#04x}")
+                    continue
+                messages.append((name, frame.payload))
+        return messages
+
+
+class FramedSerialTransport(SerialTransport):
+    """
+    SerialTransport speaking the framed protocol. The imaging loop sees the
+    same message names as before; send() returns once the firmware has
+    acknowledged the frame and raises SerialTimeout if it never does.
+    The payload of the message last returned by next_message() is in payload.
+    """
+
+    def __init__(self, port=SERIAL_PORT, baudrate=BAUD_RATE):
+        super(FramedSerialTransport, self).__init__(port, baudrate)
+        self.link = FrameLink(self._write)
+        self.payload = b""
+
+    def _write(self, data):
+        self.connection.write(data)
+        self.connection.flush()
+
+    def send(self, message):
+        self.link.send(message)
+
+    def next_message(self, timeout_s=None):
+        message, self.payload = super(FramedSerialTransport, self).next_message(timeout_s)
+        return message
+
+    def _read_loop(self):
+        while not self._stop.is_set():
+            try:
+                data = self.connection.read(self.connection.in_waiting or 1)
+            except serial.SerialException as e:
+                print("Serial read failed: " + str(e))
+                return
+            for message, payload in self.link.receive(data):
+                self.messages.put((message, payload))
@@ -0,0 +1,103 @@
+import queue
+import threading
+import time
+
+import serial
+
+SERIAL_PORT = "/dev/ttyUSB0"
+BAUD_RATE = 115200
+# How often the reader thread checks whether it should stop
+READ_POLL_S = 0.1
+# The firmware answers "start" and "finished" after at most one arm or plane move
+ACK_TIMEOUT_S = 10
+REQUEST_RETRIES = 3
+
+
+class SerialTimeout(Exception):
+    pass
+
+
+class SerialTransport:
+    """
+    Line based link to the Bluepill. A reader thread splits the incoming bytes
+    into messages (without the trailing "\\r\\n") and queues them, so the imaging
+    loop can block on the message it expects instead of polling and sleeping.
+    """
+
+    def __init__(self, port=SERIAL_PORT, baudrate=BAUD_RATE):
+        self.port = port
+        self.baudrate = baudrate
+        self.connection = None
+        self.messages = queue.Queue()
+        self._reader = None
+        self._stop = threading.Event()
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def open(self):
+        self.connection = serial.Serial(self.port, self.baudrate, timeout=READ_POLL_S)
+        # Drop anything left over from a previous session, eg. "finished-imaging"
+        self.connection.reset_input_buffer()
+        self._stop.clear()
+        self._reader = threading.Thread(target=self._read_loop, daemon=True)
+        self._reader.start()
+
+    def close(self):
+        self._stop.set()
+        if self._reader is not None:
+            self._reader.join()
+            self._reader = None
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+    def send(self, message):
+        self.connection.write(message.encode("ascii") + b"\n")
+        self.connection.flush()
+
+    def next_message(self, timeout_s=None):
+        try:
+            return self.messages.get(timeout=timeout_s)
+        except queue.Empty:
+            raise SerialTimeout(f"No message from {self.port} within {timeout_s}s")
+
+    def wait_for(self, *expected, timeout_s=ACK_TIMEOUT_S):
+        """Block until one of the expected messages arrives, other messages are logged and dropped."""
+        deadline = time.monotonic() + timeout_s
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise SerialTimeout(f"Timed out waiting for {expected} from {self.port}")
+            message = self.next_message(timeout_s=remaining)
+            if message in expected:
+                return message
+            print(f"Ignoring unexpected serial message: {message}")
+
+    def request(self, message, *expected, timeout_s=ACK_TIMEOUT_S, retries=REQUEST_RETRIES):
+        """Send a message and wait for its acknowledgement, resending it if none arrives."""
+        for attempt in range(retries):
+            self.send(message)
+            try:
+                return self.wait_for(*expected, timeout_s=timeout_s)
+            except SerialTimeout:
+                print(f"No reply to '{message}' (attempt {attempt + 1}/{retries})")
+        raise SerialTimeout(f"'{message}' was never acknowledged by {self.port}")
+
+    def _read_loop(self):
+        buffer = b""
+        while not self._stop.is_set():
+            try:
+                buffer += self.connection.read(self.connection.in_waiting or 1)
+            except serial.SerialException as e:
+                print("Serial read failed: " + str(e))
+                return
+            while b"\n" in buffer:
+                line, buffer = buffer.split(b"\n", 1)
+                message = line.decode("ascii", errors="replace").strip()
+                if message:
+                    self.messages.put(message)
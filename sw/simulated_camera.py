@@ -0,0 +1,257 @@
+import threading
+import time
+
+import numpy
+
+# Matches the readout of the station camera closely enough for cycle-time work
+SIM_READOUT_S = 0.05
+SIM_FRAME_SHAPE = (1028, 1232, 3)
+# Round trip of a single feature write over GigE, and of loading a whole user set
+SIM_FEATURE_WRITE_S = 0.01
+SIM_USER_SET_LOAD_S = 0.03
+SIM_USER_SETS = ("Default", "UserSet1", "UserSet2", "UserSet3")
+
+
+class SimulatedFeature:
+    """Stand-in for a Vimba feature, enough for the code paths in this repo."""
+
+    def __init__(self, name, value=None, on_set=None, delay_s=0.0, entries=()):
+        self._name = name
+        self._value = value
+        self._entries = entries
+        self._on_set = on_set
+        self.delay_s = delay_s
+        self.write_count = 0
+
+    def get_name(self):
+        return self._name
+
+    def get(self):
+        return self._value
+
+    def get_available_entries(self):
+        return self._entries
+
+    def set(self, value):
+        time.sleep(self.delay_s)
+        self.write_count += 1
+        self._value = value
+        if self._on_set:
+            self._on_set(value)
+
+    def run(self):
+        time.sleep(self.delay_s)
+        self.write_count += 1
+        if self._on_set:
+            self._on_set(None)
+
+    def is_done(self):
+        return True
+
+
+class SimulatedFrame:
+    """Stand-in for a vimba Frame returned by SimulatedCamera.get_frame."""
+
+    def __init__(self, image, frame_id):
+        self._image = image
+        self._frame_id = frame_id
+
+    def get_id(self):
+        return self._frame_id
+
+    def convert_pixel_format(self, fmt):
+        if getattr(fmt, "name", fmt).startswith("Mono") and self._image.ndim == 3:
+            self._image = self._image.mean(axis=2, dtype=numpy.float32).astype(numpy.uint8)[:, :, None]
+
+    def as_opencv_image(self):
+        return self._image
+
+
+class SimulatedCamera:
+    """
+    Hardware-free camera usable both as a CaptureEngine backend and, for the
+    feature writes done by My_App.setup_camera and the get_frame calls of
+    camera_controller.py, in place of a vimba Camera.
+
+    time_scale shrinks every simulated delay, so a 0.7s side-on exposure can be
+    run in a few milliseconds under test.
+
+    pulse() is the trigger input line. Like the camera, it ignores a pulse
+    that comes before the last frame is read out (counted in missed_triggers).
+    Every exposure it starts is logged in exposures as (start, seconds).
+    """
+
+    def __init__(self, shape=SIM_FRAME_SHAPE, time_scale=1.0, readout_s=SIM_READOUT_S, free_run=False,
+                 feature_write_s=SIM_FEATURE_WRITE_S, user_set_load_s=SIM_USER_SET_LOAD_S):
+        self.shape = shape
+        self.time_scale = time_scale
+        self.readout_s = readout_s
+        self.free_run = free_run
+
+        self.ExposureAuto = SimulatedFeature("ExposureAuto", "Continuous")
+        self.ExposureTime = SimulatedFeature("ExposureTime", 50000.0)
+        self.Gain = SimulatedFeature("Gain", 0.0)
+        self.BalanceWhiteAuto = SimulatedFeature("BalanceWhiteAuto", "Continuous")
+        self._balance = {"Red": 1.0, "Blue": 1.0}
+        self.BalanceRatioSelector = SimulatedFeature("BalanceRatioSelector", "Red", on_set=self._select_balance)
+        self.BalanceRatio = SimulatedFeature("BalanceRatio", 1.0, on_set=self._set_balance)
+        for feature in (self.ExposureAuto, self.ExposureTime, self.Gain, self.BalanceWhiteAuto,
+                        self.BalanceRatioSelector, self.BalanceRatio):
+            feature.delay_s = feature_write_s * time_scale
+
+        # user sets hold a snapshot of the features above
+        self._user_sets = {set_id: None for set_id in SIM_USER_SETS}
+        self.UserSetSelector = SimulatedFeature("UserSetSelector", "Default", entries=SIM_USER_SETS)
+        self.UserSetSave = SimulatedFeature("UserSetSave", on_set=self._save_user_set)
+        self.UserSetLoad = SimulatedFeature("UserSetLoad", on_set=self._load_user_set,
+                                            delay_s=user_set_load_s * time_scale)
+
+        self._handler = None
+        self._exposure_handler = None
+        self._streaming = False
+        self._frame_id = 0
+        self._lock = threading.Lock()
+        self._free_run_thread = None
+        self._timers = []
+        self.exposures = []
+        self.missed_triggers = 0
+        self._busy_until = 0.0
+
+        # dark background with a bright "fastener" in the middle
+        self._image = numpy.full(shape, 24, dtype=numpy.uint8)
+        h, w = shape[0], shape[1]
+        self._image[h // 3:2 * h // 3, w // 3:2 * w // 3] = 200
+
+    # Vimba Camera surface
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+    def get_id(self):
+        return "SIM-CAMERA"
+
+    def is_streaming(self):
+        return self._streaming
+
+    def get_pixel_formats(self):
+        from vimba import PixelFormat
+        return (PixelFormat.Bgr8,)
+
+    def set_pixel_format(self, fmt):
+        pass
+
+    def _snapshot(self):
+        return {"ExposureAuto": self.ExposureAuto.get(), "ExposureTime": self.ExposureTime.get(),
+                "Gain": self.Gain.get(), "BalanceWhiteAuto": self.BalanceWhiteAuto.get(),
+                "balance": dict(self._balance)}
+
+    def _save_user_set(self, _):
+        self._user_sets[self.UserSetSelector.get()] = self._snapshot()
+
+    def _load_user_set(self, _):
+        snapshot = self._user_sets[self.UserSetSelector.get()]
+        if snapshot is None:
+            return
+        self.ExposureAuto._value = snapshot["ExposureAuto"]
+        self.ExposureTime._value = snapshot["ExposureTime"]
+        self.Gain._value = snapshot["Gain"]
+        self.BalanceWhiteAuto._value = snapshot["BalanceWhiteAuto"]
+        self._balance = dict(snapshot["balance"])
+        self.BalanceRatio._value = self._balance[self.BalanceRatioSelector.get()]
+
+    def _select_balance(self, channel):
+        self.BalanceRatio._value = self._balance[channel]
+
+    def _set_balance(self, value):
+        self._balance[self.BalanceRatioSelector.get()] = value
+
+    def exposure_s(self):
+        return self.ExposureTime.get() / 1e6 * self.time_scale
+
+    def get_frame(self, timeout_ms=2000):
+        """Synchronous acquisition, as used by camera_controller.py."""
+        time.sleep(self.exposure_s() + self.readout_s * self.time_scale)
+        with self._lock:
+            frame_id = self._frame_id
+            self._frame_id += 1
+            image = self._image.copy()
+        image[:8, :8] = frame_id % 256
+        return SimulatedFrame(image, frame_id)
+
+    # CaptureEngine backend surface
+    def open(self):
+        pass
+
+    def close(self):
+        pass
+
+    def enable_exposure_events(self, handler):
+        # like the ExposureEnd event, called readout_s before the frame arrives
+        self._exposure_handler = handler
+        return True
+
+    def start_streaming(self, handler, buffer_count):
+        self._handler = handler
+        self._streaming = True
+        if self.free_run:
+            self._free_run_thread = threading.Thread(target=self._free_run_loop, daemon=True)
+            self._free_run_thread.start()
+
+    def stop_streaming(self):
+        self._streaming = False
+        for timer in self._timers:
+            timer.cancel()
+        self._timers = []
+        self._exposure_handler = None
+        if self._free_run_thread:
+            self._free_run_thread.join()
+            self._free_run_thread = None
+        self._handler = None
+
+    def trigger(self):
+        if self.free_run:
+            return False
+        self._expose()
+        return True
+
+    def pulse(self):
+        """A rising edge on the trigger input line, what the Bluepill does in hardware trigger mode."""
+        if time.monotonic() < self._busy_until:
+            self.missed_triggers += 1
+            return
+        self._expose()
+
+    def _expose(self):
+        exposure_s = self.exposure_s()
+        start = time.monotonic()
+        self.exposures.append((start, exposure_s))
+        self._busy_until = start + exposure_s + self.readout_s * self.time_scale
+        timers = [threading.Timer(exposure_s + self.readout_s * self.time_scale, self._deliver)]
+        if self._exposure_handler is not None:
+            timers.append(threading.Timer(exposure_s, self._exposure_end))
+        self._timers = [t for t in self._timers if t.is_alive()] + timers
+        for timer in timers:
+            timer.daemon = True
+            timer.start()
+
+    def _exposure_end(self):
+        if self._streaming and self._exposure_handler is not None:
+            self._exposure_handler()
+
+    def _free_run_loop(self):
+        while self._streaming:
+            time.sleep(self.exposure_s() + self.readout_s * self.time_scale)
+            self._deliver()
+
+    def _deliver(self):
+        with self._lock:
+            handler = self._handler
+            if not self._streaming or handler is None:
+                return
+            frame_id = self._frame_id
+            self._frame_id += 1
+            # stamp the frame id so consecutive frames differ
+            self._image[:8, :8] = frame_id % 256
+            handler(self._image, frame_id)
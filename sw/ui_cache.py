@@ -0,0 +1,89 @@
+import hashlib
+import importlib.util
+import io
+import os
+import sys
+
+# Compiled .ui modules live here, named <ui file>_ui.py
+UI_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "ui_cache")
+# First line of every compiled module, it is recompiled when the .ui file no longer matches
+HASH_HEADER = "# ui sha256: "
+
+
+def ui_hash(ui_path):
+    with open(ui_path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def compiled_path(ui_path):
+    name = os.path.splitext(os.path.basename(ui_path))[0]
+    return os.path.join(UI_CACHE_DIR, f"{name}_ui.py")
+
+
+def compile_ui(ui_path, digest=None):
+    """pyuic5 the .ui file into UI_CACHE_DIR, returns the path of the module."""
+    from PyQt5 import uic
+
+    source = io.StringIO()
+    uic.compileUi(ui_path, source)
+    module_path = compiled_path(ui_path)
+    os.makedirs(UI_CACHE_DIR, exist_ok=True)
+    # written next to it and moved in place, another instance may be starting at the same time
+    partial_path = f"{module_path}.{os.getpid()}.part"
+    with open(partial_path, "w") as f:
+        f.write(HASH_HEADER + (digest or ui_hash(ui_path)) + "\n")
+        f.write(source.getvalue())
+    os.replace(partial_path, module_path)
+    return module_path
+
+
+def is_current(ui_path, digest=None):
+    try:
+        with open(compiled_path(ui_path)) as f:
+            header = f.readline().strip()
+    except OSError:
+        return False
+    return header == HASH_HEADER + (digest or ui_hash(ui_path))
+
+
+def load_form_class(ui_path):
+    """The Ui_* class compiled from ui_path, compiling it first if the .ui file changed."""
+    digest = ui_hash(ui_path)
+    if not is_current(ui_path, digest):
+        print(f"Compiling {ui_path}")
+        compile_ui(ui_path, digest)
+    module_path = compiled_path(ui_path)
+    name = os.path.splitext(os.path.basename(module_path))[0]
+    spec = importlib.util.spec_from_file_location(name, module_path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return next(value for key, value in vars(module).items() if key.startswith("Ui_"))
+
+
+def load_ui(ui_path, widget):
+    """
+    Same as loadUi(ui_path, widget), but from the compiled module so the XML
+    isn't parsed on every launch. Falls back to loadUi when the module can't
+    be compiled or imported.
+    """
+    try:
+        form_class = load_form_class(ui_path)
+    except Exception as e:
+        print(f"Couldn't use the compiled {ui_path} ({e}), loading it at runtime")
+        from python_qt_binding import loadUi
+        loadUi(ui_path, widget)
+        return
+    form = form_class()
+    form.setupUi(widget)
+    # loadUi makes every named widget an attribute of the window, setupUi puts them on the form
+    for name, value in vars(form).items():
+        setattr(widget, name, value)
+
+
+if __name__ == "__main__":
+    # Build step: ./ui_cache.py [file.ui ...], compiles whatever is out of date
+    for path in sys.argv[1:] or [os.path.join(os.path.dirname(os.path.abspath(__file__)), "data_collection.ui")]:
+        if is_current(path):
+            print(f"{compiled_path(path)} is up to date")
+        else:
+            print(f"Wrote {compile_ui(path)}")
@@ -0,0 +1,187 @@
+import json
+import os
+import tempfile
+import threading
+import time
+
+from PyQt5 import QtCore
+
+from instrumentation import span
+
+UPLOAD_ATTEMPTS = 6
+# Backoff doubles after every failed attempt: 5s, 10s, 20s ... capped at 5 min
+RETRY_BASE_S = 5
+RETRY_MAX_S = 300
+
+
+def rclone_copy(source, destination, listener=None, args=None):
+    # imported on the first upload rather than at GUI startup
+    from rclone_python import rclone
+    rclone.copy(source, destination, show_progress=False, listener=listener, args=args)
+
+
+class UploadManager(QtCore.QObject):
+    """
+    Runs rclone transfers on a background thread, one directory at a time.
+
+    The queue is persisted to queue_file after every change, so uploads that
+    were pending when the app closed or crashed are resumed on the next start.
+    Jobs that run out of attempts stay in the file and are retried on restart.
+
+    With a manifest (see upload_manifest.py) only files that are new or changed
+    since their last upload are transferred, listed to rclone with --files-from.
+
+    destination can be any rclone remote, including a plain local directory,
+    which is handy for trying this out without Google Drive. transfer can be
+    replaced for the same reason; it's called as transfer(source, destination, listener, args).
+    """
+    progress = QtCore.pyqtSignal(str, float)
+    uploaded = QtCore.pyqtSignal(str)
+    failed = QtCore.pyqtSignal(str, str)
+    queue_changed = QtCore.pyqtSignal(int)
+
+    def __init__(self, queue_file, manifest=None, transfer=rclone_copy, retry_base_s=RETRY_BASE_S, attempts=UPLOAD_ATTEMPTS):
+        super(UploadManager, self).__init__()
+        self.queue_file = queue_file
+        self.manifest = manifest
+        self.transfer = transfer
+        self.retry_base_s = retry_base_s
+        self.attempts = attempts
+        self.jobs = []
+        self.failed_jobs = []
+        self._condition = threading.Condition()
+        self._stop = False
+        self._thread = None
+        self._load()
+
+    def start(self):
+        self._stop = False
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        self.queue_changed.emit(self.pending())
+
+    def stop(self):
+        with self._condition:
+            self._stop = True
+            self._condition.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def pending(self):
+        with self._condition:
+            return len(self.jobs)
+
+    def enqueue(self, source, destination):
+        with self._condition:
+            job = {"source": source, "destination": destination}
+            if job in self.jobs:
+                return
+            self.jobs.append(job)
+            self._save()
+            self._condition.notify_all()
+        self.queue_changed.emit(self.pending())
+
+    def wait_until_idle(self, timeout_s=None):
+        with self._condition:
+            return self._condition.wait_for(lambda: not self.jobs, timeout=timeout_s)
+
+    def _load(self):
+        if not os.path.exists(self.queue_file):
+            return
+        try:
+            with open(self.queue_file) as f:
+                saved = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Could not read upload queue {self.queue_file}: {e}")
+            return
+        # give previously failed jobs another go
+        self.jobs = saved.get("pending", []) + saved.get("failed", [])
+        if self.jobs:
+            print(f"Resuming {len(self.jobs)} pending uploads")
+
+    def _save(self):
+        tmp_path = self.queue_file + ".part"
+        with open(tmp_path, "w") as f:
+            json.dump({"pending": self.jobs, "failed": self.failed_jobs}, f, indent=2)
+        os.replace(tmp_path, self.queue_file)
+
+    def _wait(self, seconds):
+        # returns True if we were asked to stop while waiting
+        with self._condition:
+            return self._condition.wait_for(lambda: self._stop, timeout=seconds)
+
+    def _transfer(self, source, destination, listener):
+        if self.manifest is None:
+            self.transfer(source, destination, listener, None)
+            return
+
+        # worked out at upload time, more images may have landed since the job was queued
+        files = self.manifest.delta(source, destination)
+        if not files:
+            print(f"Nothing new to upload in {source}")
+            return
+        print(f"Uploading {len(files)} new or changed files from {source}")
+        fd, files_from = tempfile.mkstemp(suffix=".txt", prefix="rclone_files_from_")
+        os.close(fd)
+        try:
+            self.manifest.write_files_from(files, files_from)
+            # --no-traverse stops rclone listing the whole destination to compare against
+            self.transfer(source, destination, listener, ["--files-from", files_from, "--no-traverse"])
+        finally:
+            os.remove(files_from)
+        self.manifest.record(destination, files)
+
+    def _upload(self, job):
+        source = job["source"]
+
+        def listener(update):
+            self.progress.emit(source, float(update.get("progress", 0)))
+
+        for attempt in range(self.attempts):
+            try:
+                self._transfer(source, job["destination"], listener)
+                return None
+            except UnicodeDecodeError as e:
+                # rclone_python trips over rclone's output now and then, retrying works
+                error = e
+            except Exception as e:
+                # usually an expired token, see the README on refreshing it
+                error = e
+            if attempt == self.attempts - 1:
+                break
+            delay = min(self.retry_base_s * 2 ** attempt, RETRY_MAX_S)
+            print(f"Upload of {source} failed ({error}), retrying in {delay}s")
+            if self._wait(delay):
+                return error
+        return error
+
+    def _run(self):
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: self._stop or self.jobs)
+                if self._stop:
+                    return
+                job = self.jobs[0]
+
+            print(f"Uploading {job['source']} to {job['destination']}")
+            start = time.monotonic()
+            with span("upload"):
+                error = self._upload(job)
+            with self._condition:
+                if self._stop and error is not None:
+                    # leave the job in the queue file for the next start
+                    return
+                self.jobs.remove(job)
+                if error is not None:
+                    self.failed_jobs.append(job)
+                self._save()
+                self._condition.notify_all()
+
+            if error is None:
+                print(f"Uploaded {job['source']} in {time.monotonic() - start:.1f}s")
+                self.progress.emit(job["source"], 1.0)
+                self.uploaded.emit(job["source"])
+            else:
+                self.failed.emit(job["source"], str(error))
+            self.queue_changed.emit(self.pending())
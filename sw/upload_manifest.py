@@ -0,0 +1,97 @@
+import hashlib
+import os
+import posixpath
+import sqlite3
+import threading
+import time
+
+HASH_CHUNK_BYTES = 1 << 20
+# Left behind by ImageWriter while a file is being written, never upload these
+PARTIAL_SUFFIX = ".part"
+
+
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_BYTES), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class UploadManifest:
+    """
+    Local record of every file that has been uploaded, keyed by its remote path.
+
+    delta() walks a local directory and returns only the files that are new or
+    changed since they were last uploaded to the given destination, so a bulk
+    upload can hand rclone a --files-from list instead of having it re-list and
+    re-check every session ever captured.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._db.execute(
+            """CREATE TABLE IF NOT EXISTS uploaded_files (
+                   remote_path TEXT PRIMARY KEY,
+                   size INTEGER NOT NULL,
+                   mtime_ns INTEGER NOT NULL,
+                   sha256 TEXT NOT NULL,
+                   uploaded_at REAL NOT NULL
+               )""")
+        self._db.commit()
+
+    def close(self):
+        self._db.close()
+
+    @staticmethod
+    def remote_path(destination, relative_path):
+        return posixpath.join(destination, relative_path.replace(os.sep, "/"))
+
+    def delta(self, source, destination):
+        """
+        Returns [(relative_path, size, mtime_ns, sha256)] for the files under
+        source that aren't in the manifest for destination, or have changed.
+        Files whose size and mtime match the manifest are not re-hashed.
+        """
+        changed = []
+        with self._lock:
+            for root, _, files in os.walk(source):
+                for name in sorted(files):
+                    if name.endswith(PARTIAL_SUFFIX):
+                        continue
+                    path = os.path.join(root, name)
+                    relative_path = os.path.relpath(path, source)
+                    remote_path = self.remote_path(destination, relative_path)
+                    stat = os.stat(path)
+                    row = self._db.execute(
+                        "SELECT size, mtime_ns, sha256 FROM uploaded_files WHERE remote_path = ?",
+                        (remote_path,)).fetchone()
+                    if row is not None and row[0] == stat.st_size and row[1] == stat.st_mtime_ns:
+                        continue
+                    sha256 = file_hash(path)
+                    if row is not None and row[0] == stat.st_size and row[2] == sha256:
+                        # touched but not changed
+                        self._db.execute("UPDATE uploaded_files SET mtime_ns = ? WHERE remote_path = ?",
+                                         (stat.st_mtime_ns, remote_path))
+                        continue
+                    changed.append((relative_path, stat.st_size, stat.st_mtime_ns, sha256))
+            self._db.commit()
+        return changed
+
+    def record(self, destination, files):
+        """Mark files, as returned by delta(), as uploaded to destination."""
+        now = time.time()
+        with self._lock:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO uploaded_files VALUES (?, ?, ?, ?, ?)",
+                [(self.remote_path(destination, relative_path), size, mtime_ns, sha256, now)
+                 for relative_path, size, mtime_ns, sha256 in files])
+            self._db.commit()
+
+    def write_files_from(self, files, list_path):
+        """Writes an rclone --files-from list (paths relative to the source directory)."""
+        with open(list_path, "w") as f:
+            for relative_path, _, _, _ in files:
+                f.write(relative_path.replace(os.sep, "/") + "\n")
@@ -1,13 +1,17 @@
 import cv2
+import numpy
 import os
-import matplotlib.pyplot as plt
-import matplotlib.patches as patches
-import PIL
 import torch
 import torchvision
 import torchvision.transforms.functional as F
 import torchvision.transforms.transforms as T
 
+# Images per forward pass in predict_images, a fastener is 10 views
+INFERENCE_BATCH_SIZE = 4
+# One row per detection, see ModelHelper.decode_detections
+DETECTION_DTYPE = numpy.dtype([('image', numpy.int32), ('box', numpy.float32, 4),
+                               ('label', numpy.int64), ('score', numpy.float32)])
+
 class ModelHelper:
     def __init__(self, model_path):
         self.mapping = {
@@ -21,9 +25,13 @@ class ModelHelper:
         self.device = torch.device('cuda') if torch.cuda.is_available() else \
                       torch.device('cpu')
         self.model = torch.jit.load(model_path, map_location=self.device)
+        self.model.to(self.device)
         self.model.eval()
+        # built once, not for every image
+        self.transform = T.ToTensor()
 
     def convert_to_tensor(self, image_path):
+        import PIL.Image
         tensor = PIL.Image.open(image_path).convert("RGB")
         tensor = F.pil_to_tensor(tensor)
         tensor = F.convert_image_dtype(tensor)
@@ -68,12 +76,74 @@ class ModelHelper:
           List of dicts containing the predictions for the 
           bounding boxes, labels and confidence scores.
       """
-      self.model.to(self.device)
-      self.model.eval()
       X, _ = self.unbatch(batch)
       predictions = self.model(X)
       return [x.cpu() for x in X], predictions[1]
 
+    def decode_detections(self,
+                          predictions,
+                          score_threshold = 0.7,
+                          nms_iou_threshold = 0.2):
+      """
+      Thresholds and NMS's the predictions of a whole batch at once.
+      Inputs
+        predictions: list
+          One dict of boxes, labels and scores per image, as the model returns them.
+        score_threshold: float
+        nms_iou_threshold: float
+      Returns
+        detections: numpy structured array
+          DETECTION_DTYPE rows of every image, grouped by image and by
+          descending score within an image.
+      """
+      if not predictions:
+        return numpy.empty(0, dtype=DETECTION_DTYPE)
+      counts = torch.tensor([len(prediction['scores']) for prediction in predictions])
+      boxes = torch.cat([prediction['boxes'] for prediction in predictions])
+      scores = torch.cat([prediction['scores'] for prediction in predictions])
+      labels = torch.cat([prediction['labels'] for prediction in predictions])
+      images = torch.repeat_interleave(torch.arange(len(predictions)), counts).to(scores.device)
+
+      if score_threshold:
+        want = scores > score_threshold
+        boxes, scores, labels, images = boxes[want], scores[want], labels[want], images[want]
+
+      if nms_iou_threshold:
+        # batched_nms offsets each image's boxes so boxes of different images never overlap,
+        # that's the same as running nms on every image on its own
+        want = torchvision.ops.batched_nms(boxes, scores, images, nms_iou_threshold)
+        # comes back in descending score over the whole batch, group it by image again
+        _, order = torch.sort(images[want], stable=True)
+        want = want[order]
+        boxes, scores, labels, images = boxes[want], scores[want], labels[want], images[want]
+
+      # one copy off the device for the whole batch
+      packed = torch.cat([images[:, None].to(boxes.dtype), boxes, labels[:, None].to(boxes.dtype),
+                          scores[:, None].to(boxes.dtype)], dim=1).cpu().numpy()
+      detections = numpy.empty(len(packed), dtype=DETECTION_DTYPE)
+      detections['image'] = packed[:, 0]
+      detections['box'] = packed[:, 1:5]
+      detections['label'] = packed[:, 5]
+      detections['score'] = packed[:, 6]
+      return detections
+
+    def split_detections(self, detections, images):
+      """
+      Inputs
+        detections: numpy structured array
+          As returned by decode_detections.
+        images: int
+          Number of images in the batch.
+      Returns
+        predictions: list
+          (boxes, labels, scores) for each image.
+      """
+      bounds = numpy.searchsorted(detections['image'], numpy.arange(images + 1))
+      return [(detections['box'][start:end],
+               detections['label'][start:end],
+               detections['score'][start:end])
+              for start, end in zip(bounds[:-1], bounds[1:])]
+
     def decode_prediction(self,
                           predictions,
                           score_threshold = 0.7,
@@ -86,45 +156,53 @@ class ModelHelper:
       Returns
         prediction: tuple
       """
-      res = []
-      for prediction in predictions:
-          boxes = prediction['boxes']
-          scores = prediction['scores']
-          labels = prediction['labels']
-
-          if score_threshold:
-            want = scores > score_threshold
-            boxes = boxes[want]
-            scores = scores[want]
-            labels = labels[want]
-
-          if nms_iou_threshold:
-            want = torchvision.ops.nms(boxes = boxes, 
-                                       scores = scores, 
-                                       iou_threshold = nms_iou_threshold)
-            boxes = boxes[want]
-            scores = scores[want]
-            labels = labels[want]
-
-          res.append((boxes.cpu().numpy(),
-                  labels.cpu().numpy(),
-                  scores.cpu().numpy()))
-      return res
-
-    def predict_single_image(self, img, score_threshold=0.7):
-        transform = T.Compose([
-            T.ToTensor()
-        ])
+      detections = self.decode_detections(predictions, score_threshold, nms_iou_threshold)
+      return self.split_detections(detections, len(predictions))
 
+    def to_tensor(self, img):
+        """BGR OpenCV image to an RGB float tensor on the model's device."""
         img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-        img = transform(img)
+        return self.transform(img).to(self.device)
 
-        batch = (torch.stack([img]), ({}))
-        _, predictions = self.predict_batch(batch)
+    @torch.no_grad()
+    def predict_images(self, images, score_threshold=0.7, batch_size=INFERENCE_BATCH_SIZE):
+        """
+        Runs every image through the model, batch_size at a time.
+        Inputs
+          images: list
+            BGR OpenCV images, they don't have to be the same size.
+        Returns
+          predictions: list
+            (boxes, labels, scores) for each image, in order.
+        """
+        predictions = []
+        for i in range(0, len(images), batch_size):
+            # the model takes a list and resizes/pads the images into one batch tensor itself,
+            # so there is no torch.stack (and no copy) here
+            X = [self.to_tensor(img) for img in images[i:i + batch_size]]
+            _, batch_predictions = self.model(X)
+            predictions.extend(self.decode_prediction(batch_predictions, score_threshold=score_threshold))
+        return predictions
 
-        prediction = self.decode_prediction(predictions, score_threshold=score_threshold)[0]
+    def predict_fasteners(self, fasteners, score_threshold=0.7, batch_size=INFERENCE_BATCH_SIZE):
+        """
+        Inputs
+          fasteners: list
+            One list of views (top-down then side-on images) per fastener.
+        Returns
+          predictions: list
+            One list of (boxes, labels, scores) per fastener, one per view.
+        """
+        views = [img for fastener in fasteners for img in fastener]
+        predictions = self.predict_images(views, score_threshold=score_threshold, batch_size=batch_size)
+        res = []
+        for fastener in fasteners:
+            res.append(predictions[:len(fastener)])
+            predictions = predictions[len(fastener):]
+        return res
 
-        return prediction
+    def predict_single_image(self, img, score_threshold=0.7):
+        return self.predict_images([img], score_threshold=score_threshold)[0]
 
 class DisplayHelper:
     def draw_prediction(self, img, prediction):
@@ -172,6 +250,9 @@ class DisplayHelper:
         return scaled
 
     def display_single(self, image, prediction):
+        # only used when debugging, matplotlib is slow to import
+        import matplotlib.pyplot as plt
+        import matplotlib.patches as patches
         boxes, labels, scores = prediction
         fig, ax = plt.subplots(figsize = [15, 15])
         ax.imshow(image.permute(1, 2, 0).numpy())
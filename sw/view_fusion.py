@@ -0,0 +1,50 @@
+import numpy
+
+# Weight of the top-down view (view 0) against each side-on view in the vote
+TOPDOWN_WEIGHT = 1.0
+SIDEON_WEIGHT = 1.0
+
+
+def view_weights(views, topdown_weight=TOPDOWN_WEIGHT, sideon_weight=SIDEON_WEIGHT):
+    weights = numpy.full(views, sideon_weight, dtype=numpy.float32)
+    if views:
+        weights[0] = topdown_weight
+    return weights
+
+
+def fuse_predictions(predictions, mapping, weights=None):
+    """
+    One prediction for the fastener from the (boxes, labels, scores) of each of its views.
+
+    Every view scores every class with its most confident detection of it (0 when
+    it has none), and the fastener gets the class with the highest weighted mean
+    over the views. All views go through numpy in one go, there is no per-view loop
+    over the detections.
+    """
+    classes = sorted(mapping)
+    views = len(predictions)
+    if weights is None:
+        weights = view_weights(views)
+    counts = [len(labels) for _, labels, _ in predictions]
+    labels = numpy.concatenate([numpy.asarray(labels, dtype=numpy.int64) for _, labels, _ in predictions] or [[]])
+    scores = numpy.concatenate([numpy.asarray(scores, dtype=numpy.float32) for _, _, scores in predictions] or [[]])
+    view_index = numpy.repeat(numpy.arange(views), counts)
+
+    # labels the mapping doesn't know (eg. commented out classes) don't get a vote
+    known = numpy.isin(labels, classes)
+    class_index = numpy.searchsorted(classes, labels[known])
+    view_scores = numpy.zeros((views, len(classes)), dtype=numpy.float32)
+    numpy.maximum.at(view_scores, (view_index[known], class_index), scores[known])
+
+    fused = weights @ view_scores / max(float(weights.sum()), 1e-9)
+    detected = view_scores.max(axis=1) > 0
+    votes = numpy.bincount(view_scores[detected].argmax(axis=1), minlength=len(classes))
+    best = int(fused.argmax()) if fused.size and fused.max() > 0 else None
+    return {
+        "label": mapping[classes[best]] if best is not None else None,
+        "score": round(float(fused[best]), 4) if best is not None else 0.0,
+        "views": views,
+        "views_detected": int(detected.sum()),
+        "scores": {mapping[c]: round(float(s), 4) for c, s in zip(classes, fused)},
+        "votes": {mapping[c]: int(v) for c, v in zip(classes, votes)},
+    }
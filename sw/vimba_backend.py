@@ -0,0 +1,142 @@
+try:
+    from vimba import *
+except ImportError:
+    # Lets data_collection_backend.py run with SIMULATE_CAMERA without the Vimba SDK
+    Vimba = None
+    Camera = None
+    Frame = None
+
+    class VimbaFeatureError(Exception):
+        pass
+
+
+class VimbaCameraBackend:
+    """
+    CaptureEngine backend for an Allied Vision camera. With trigger_line
+    (eg. "Line0") exposures are started by a rising edge on that input
+    instead of by trigger(), see HARDWARE_TRIGGER in data_collection_backend.py.
+    """
+
+    def __init__(self, cam: Camera, trigger_line=None):
+        self.cam = cam
+        self.trigger_line = trigger_line
+        self.software_trigger = False
+        self._vimba = None
+        self._handler = None
+        self._exposure_handler = None
+
+    def open(self):
+        # requirement that Vimba instance is opened using "with", we keep both
+        # contexts entered until close() so the camera is only opened once
+        self._vimba = Vimba.get_instance()
+        self._vimba.__enter__()
+        try:
+            self.cam.__enter__()
+        except Exception:
+            self._vimba.__exit__(None, None, None)
+            raise
+        if self.trigger_line is not None:
+            self._enable_hardware_trigger()
+        else:
+            self.software_trigger = self._enable_software_trigger()
+
+    def close(self):
+        try:
+            self._disable_exposure_events()
+            self.cam.__exit__(None, None, None)
+        finally:
+            self._vimba.__exit__(None, None, None)
+            self._vimba = None
+
+    def _set_trigger(self):
+        self.cam.TriggerSelector.set("FrameStart")
+        if self.trigger_line is not None:
+            self.cam.TriggerSource.set(self.trigger_line)
+            self.cam.TriggerActivation.set("RisingEdge")
+        else:
+            self.cam.TriggerSource.set("Software")
+        self.cam.TriggerMode.set("On")
+
+    def _enable_software_trigger(self):
+        # Expose only when asked to, so a streaming camera never hands us a
+        # frame that was exposed while the arm or turntable was still moving
+        try:
+            self._set_trigger()
+            self.cam.AcquisitionMode.set("Continuous")
+            return True
+        except (AttributeError, VimbaFeatureError) as e:
+            print("Software trigger unavailable, free running instead: " + str(e))
+            return False
+
+    def _enable_hardware_trigger(self):
+        # no fallback here, without the trigger the Bluepill's poses would never be imaged
+        self._set_trigger()
+        self.cam.AcquisitionMode.set("Continuous")
+
+    def restore_settings(self):
+        """
+        Puts back the trigger and ExposureEnd event set up by open() and
+        enable_exposure_events(). A UserSetLoad overwrites the whole camera
+        state with what was saved, which has the trigger off.
+        """
+        try:
+            if self.trigger_line is not None or self.software_trigger:
+                self._set_trigger()
+            if self._exposure_handler is not None:
+                self.cam.EventSelector.set("ExposureEnd")
+                self.cam.EventNotification.set("On")
+        except (AttributeError, VimbaFeatureError) as e:
+            print("Could not restore the trigger after loading a user set, frames may not match poses: " + str(e))
+
+    def enable_exposure_events(self, handler):
+        # GigE event channel, see Examples_from_Vimba/event_handling.py. EventExposureEnd
+        # changes value (to the frame id) every time the sensor finishes an exposure
+        self._exposure_handler = handler
+        try:
+            self.cam.EventSelector.set("ExposureEnd")
+            self.cam.EventNotification.set("On")
+            self.cam.EventExposureEnd.register_change_handler(self._exposure_end_handler)
+            return True
+        except (AttributeError, VimbaFeatureError) as e:
+            print("ExposureEnd event unavailable, waiting for whole frames instead: " + str(e))
+            self._exposure_handler = None
+            return False
+
+    def _disable_exposure_events(self):
+        if self._exposure_handler is None:
+            return
+        self._exposure_handler = None
+        try:
+            self.cam.EventExposureEnd.unregister_all_change_handlers()
+            self.cam.EventSelector.set("ExposureEnd")
+            self.cam.EventNotification.set("Off")
+        except (AttributeError, VimbaFeatureError) as e:
+            print("Could not turn off the ExposureEnd event: " + str(e))
+
+    def _exposure_end_handler(self, feature):
+        handler = self._exposure_handler
+        if handler is not None:
+            handler()
+
+    def start_streaming(self, handler, buffer_count):
+        self._handler = handler
+        self.cam.start_streaming(handler=self._frame_handler, buffer_count=buffer_count)
+
+    def stop_streaming(self):
+        self.cam.stop_streaming()
+        self._handler = None
+
+    def trigger(self):
+        if not self.software_trigger:
+            return False
+        self.cam.TriggerSoftware.run()
+        return True
+
+    def _frame_handler(self, cam: Camera, frame: Frame):
+        # Executed within VimbaC context, the frame buffer is handed back to the
+        # camera as soon as the engine has copied it out
+        try:
+            if frame.get_status() == FrameStatus.Complete:
+                self._handler(frame.as_opencv_image(), frame.get_id())
+        finally:
+            cam.queue_frame(frame)